@@ -0,0 +1,25 @@
+import re
+import unicodedata
+
+
+def normalize_address(address):
+    address = address.replace(',', ' ')
+    address = unicodedata.normalize('NFKD', address).encode('ASCII', 'ignore').decode('ASCII')
+    address = re.sub(r'\s+', ' ', address).strip()
+    
+    return address
+
+# Letters NFKD does not decompose into an ASCII base letter
+_FOLD_LETTERS = str.maketrans({'ł': 'l', 'Ł': 'L', 'ø': 'o', 'Ø': 'O', 'đ': 'd', 'Đ': 'D', 'ß': 'ss', 'æ': 'ae', 'Æ': 'AE'})
+
+# Words that only say "street" and are often left out (ul. = ulica)
+_NOISE_TOKENS = {'ul', 'ulica'}
+
+def address_tokens(address):
+    """Lowercase ASCII words of an address, without punctuation or noise words"""
+    folded = normalize_address(address.translate(_FOLD_LETTERS)).lower()
+    return [token for token in re.split(r'[^a-z0-9]+', folded) if token and token not in _NOISE_TOKENS]
+
+def address_key(address):
+    """Looser key than normalize_address(): also ignores case, punctuation and `ul.`"""
+    return ' '.join(address_tokens(address))
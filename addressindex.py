@@ -0,0 +1,153 @@
+import math
+import os
+import threading
+from collections import defaultdict
+from addresses import address_tokens
+
+
+DEFAULT_THRESHOLD = 0.85
+# Share of the query's place words that must show up in the matched display_name
+DISPLAY_NAME_AGREEMENT = 0.75
+TOKEN_SIMILARITY = 0.6
+
+def address_index_enabled():
+    return os.getenv('ADDRESS_INDEX_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+def trigrams(text):
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def dice(grams, other):
+    return 2 * len(grams & other) / (len(grams) + len(other)) if grams or other else 0.0
+
+def number_signature(tokens):
+    """House numbers, postal codes and other tokens with digits, which a match must share exactly"""
+    # Tokens are ASCII letters and digits only
+    return tuple(sorted(token for token in tokens if not token.isalpha()))
+
+def display_name_agrees(tokens, display_name):
+    """True unless the geocoder's display_name for a match lacks most of the query's place words"""
+    if not display_name:
+        return True
+    words = [token for token in tokens if len(token) >= 3 and token.isalpha()]
+    if not words:
+        return True
+    place_grams = [trigrams(token) for token in set(address_tokens(display_name))]
+    agreeing = sum(1 for word in words if any(dice(trigrams(word), grams) >= TOKEN_SIMILARITY for grams in place_grams))
+    return agreeing / len(words) >= DISPLAY_NAME_AGREEMENT
+
+class AddressIndex:
+    """
+    In-memory index of geocoded addresses for lookups that miss the exact cache key.
+    An address is looked up by address_key() first; failing that, it is compared by
+    trigram Dice similarity with the addresses that contain exactly the same numbers,
+    so "Street 6" never matches "Street 7". Only the rarest trigrams of the query are
+    probed: enough that any address above the threshold has to share one of them. The
+    trigram postings of a group of addresses are built on its first fuzzy lookup. With
+    verify set, a fuzzy match must also agree with the display_name it was geocoded to.
+    """
+
+    def __init__(self, threshold=None, verify=None):
+        self.threshold = threshold if threshold is not None else float(os.getenv('ADDRESS_MATCH_THRESHOLD', DEFAULT_THRESHOLD))
+        self.verify = verify if verify is not None else os.getenv('ADDRESS_MATCH_VERIFY', '1').lower() not in ('0', 'false', 'no')
+        self.keys = {}
+        self.entries = []
+        self.grams = {}
+        self.partitions = {}
+        self.lock = threading.Lock()
+        self.normalized_hits = 0
+        self.fuzzy_hits = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, address, coords):
+
+        tokens = address_tokens(address)
+        key = ' '.join(tokens)
+        if not key:
+            return
+
+        with self.lock:
+            entry_id = self.keys.get(key)
+            if entry_id is not None:
+                self.entries[entry_id] = (address, coords, key)
+                return
+
+            self.entries.append((address, coords, key))
+            entry_id = len(self.entries) - 1
+            self.keys[key] = entry_id
+            partition = self.partitions.setdefault(number_signature(tokens), {'entries': [], 'postings': None})
+            partition['entries'].append(entry_id)
+            if partition['postings'] is not None:
+                self._index_entry(partition['postings'], entry_id)
+
+    def _index_entry(self, postings, entry_id):
+
+        grams = trigrams(self.entries[entry_id][2])
+        # Set before any posting refers to the entry, so lookups need no lock
+        self.grams[entry_id] = grams
+        for gram in grams:
+            postings[gram].append(entry_id)
+
+    def _postings(self, partition):
+
+        postings = partition['postings']
+        if postings is not None:
+            return postings
+        with self.lock:
+            if partition['postings'] is None:
+                postings = defaultdict(list)
+                for entry_id in partition['entries']:
+                    self._index_entry(postings, entry_id)
+                partition['postings'] = postings
+            return partition['postings']
+
+    def lookup(self, address):
+        """Return (coords, matched address, similarity) for the best match, or None"""
+        tokens = address_tokens(address)
+        key = ' '.join(tokens)
+        if not key:
+            return None
+
+        entry_id = self.keys.get(key)
+        if entry_id is not None:
+            matched_address, coords, _ = self.entries[entry_id]
+            with self.lock:
+                self.normalized_hits += 1
+            return coords, matched_address, 1.0
+
+        partition = self.partitions.get(number_signature(tokens))
+        if partition is None:
+            return None
+        postings = self._postings(partition)
+
+        grams = trigrams(key)
+        # Dice >= t needs at least t|A| / (2 - t) shared trigrams, so a match shares one of the rest
+        required = math.ceil(self.threshold * len(grams) / (2 - self.threshold))
+        probes = sorted(grams, key=lambda gram: len(postings.get(gram, ())))[:max(1, len(grams) - required + 1)]
+        candidates = set()
+        for gram in probes:
+            candidates.update(postings.get(gram, ()))
+
+        best_id, best_score = None, 0.0
+        for candidate in candidates:
+            score = dice(grams, self.grams[candidate])
+            if score > best_score:
+                best_id, best_score = candidate, score
+        if best_id is None or best_score < self.threshold:
+            return None
+
+        matched_address, coords, _ = self.entries[best_id]
+        if self.verify and not display_name_agrees(tokens, coords.get('display_name')):
+            with self.lock:
+                self.rejected += 1
+            return None
+
+        with self.lock:
+            self.fuzzy_hits += 1
+        return coords, matched_address, best_score
+
+    def stats(self):
+        return {'addresses': len(self.entries), 'normalized_hits': self.normalized_hits, 'fuzzy_hits': self.fuzzy_hits, 'rejected': self.rejected}
@@ -0,0 +1,299 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from fares import loads
+from delta import RUN_BLOB_RE
+from history import ManifestBuilder, day_prefixes, index_blob, manifest_entry_name, parse_time, read_manifest_entry, write_manifest_entry
+from output import GCSStore, LocalStore
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+ARCHIVE_PREFIX = 'archive/'
+DEFAULT_ZSTD_LEVEL = 3
+# archive/{date}/{timestamp}_{datetime}/pack[-shard-0000-of-0008]-{attempt}.json
+INDEX_NAME_RE = re.compile(r'^archive/(\d{4}/\d{2}/\d{2}/\d+_[^/]+)/pack(-shard-\d+-of-\d+)?-(\d+)\.json$')
+
+def archive_enabled():
+    return os.getenv('ARCHIVE_RAW', '').lower() in ('1', 'true', 'yes')
+
+def canonical_json(raw_data):
+    """Serialize a response with sorted keys, so equal responses hash the same"""
+    if orjson is not None:
+        return orjson.dumps(raw_data, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(raw_data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def compress(data, level=DEFAULT_ZSTD_LEVEL):
+    """zstd frame of data, from the zstandard package if installed, otherwise pyarrow's codec"""
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    import pyarrow as pa
+    return pa.Codec('zstd', compression_level=level).compress(data, asbytes=True)
+
+def decompress(data, size):
+
+    if zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+    import pyarrow as pa
+    return pa.decompress(data, decompressed_size=size, codec='zstd', asbytes=True)
+
+class RawArchive:
+    """
+    Keeps the raw Products responses of a run in a pack blob. Each distinct response
+    (by SHA-256 of its canonical JSON) is stored once as its own zstd frame, so a route
+    answered with the same response as another costs only an index record. The pack is
+    streamed to the store as responses arrive; the JSON index next to it lists the
+    frames' offsets and the route of every record, and is written last.
+    """
+
+    def __init__(self, store, run_name, timestamp, formatted_datetime, shard_index=0, shard_count=1, level=None):
+        self.store = store
+        suffix = f"-shard-{shard_index:04d}-of-{shard_count:04d}" if shard_count > 1 else ''
+        # Each attempt of a run gets its own pack, a resumed run keeps the earlier ones
+        base_name = f"{ARCHIVE_PREFIX}{run_name}/pack{suffix}-{time.time_ns()}"
+        self.pack_name = f"{base_name}.pack"
+        self.index_name = f"{base_name}.json"
+        self.run_name = run_name
+        self.timestamp = timestamp
+        self.formatted_datetime = formatted_datetime
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.level = level if level is not None else int(os.getenv('ARCHIVE_ZSTD_LEVEL', DEFAULT_ZSTD_LEVEL))
+        self.objects = {}
+        self.records = []
+        self.offset = 0
+        self.bytes_in = 0
+        self.failed = False
+        self.lock = threading.Lock()
+        self._raw = None
+
+    def add(self, origin, destination, raw_data):
+        """Archive one route's response; called from the route worker threads"""
+        if self.failed:
+            return
+        try:
+            data = canonical_json(raw_data)
+            digest = hashlib.sha256(data).hexdigest()
+            with self.lock:
+                self.records.append([origin, destination, digest])
+                self.bytes_in += len(data)
+                if digest in self.objects:
+                    return
+
+            frame = compress(data, self.level)
+            with self.lock:
+                # Another worker may have stored the same response meanwhile
+                if digest in self.objects:
+                    return
+                if self._raw is None:
+                    self._raw = self.store.open_write(self.pack_name, content_type='application/octet-stream')
+                self._raw.write(frame)
+                self.objects[digest] = [self.offset, len(frame), len(data)]
+                self.offset += len(frame)
+        except Exception as e:
+            # The run goes on without its raw responses
+            self.failed = True
+            print(f"Warning: Could not archive raw responses to {self.pack_name}: {str(e)}")
+
+    def close(self):
+        """Finish the pack and write its index; returns True if an archive was written"""
+        if self._raw is None:
+            return False
+        try:
+            self._raw.close()
+            if self.failed:
+                return False
+            index = {
+                'run': self.run_name,
+                'timestamp': self.timestamp,
+                'datetime': self.formatted_datetime,
+                'shard_index': self.shard_index,
+                'shard_count': self.shard_count,
+                'codec': 'zstd',
+                'pack': self.pack_name,
+                'objects': self.objects,
+                'records': self.records,
+            }
+            with self.store.open_write(self.index_name, content_type='application/json') as f:
+                f.write(json.dumps(index, ensure_ascii=False).encode('utf-8'))
+            return True
+        except Exception as e:
+            print(f"Warning: Could not finish raw response archive {self.pack_name}: {str(e)}")
+            return False
+
+def read_index(store, name):
+
+    with store.open_read(name) as f:
+        return json.loads(f.read().decode('utf-8'))
+
+def iter_responses(store, index):
+    """Yield (origin, destination, raw_data) for every record of a pack, decoding each frame once"""
+    routes_by_object = defaultdict(list)
+    for origin, destination, digest in index['records']:
+        routes_by_object[digest].append((origin, destination))
+
+    # Frames are read in pack order, so the pack is streamed rather than loaded whole
+    with store.open_read(index['pack']) as pack:
+        position = 0
+        for digest, (offset, length, size) in sorted(index['objects'].items(), key=lambda item: item[1][0]):
+            if offset > position:
+                pack.read(offset - position)
+            frame = pack.read(length)
+            position = offset + length
+            data = decompress(frame, size)
+            if hashlib.sha256(data).hexdigest() != digest:
+                print(f"Warning: Skipping corrupt object {digest} in {index['pack']}")
+                continue
+            raw_data = loads(data)
+            for origin, destination in routes_by_object[digest]:
+                yield origin, destination, raw_data
+
+def list_archive(store, start_timestamp=None, end_timestamp=None):
+    """{(run_name, shard_index, shard_count): [index names]} of the packs archived in the window"""
+    prefixes = [f"{ARCHIVE_PREFIX}{day}" for day in day_prefixes(store, start_timestamp, end_timestamp)] if start_timestamp is not None else [ARCHIVE_PREFIX]
+
+    groups = defaultdict(list)
+    for prefix in prefixes:
+        for name in store.list_names(prefix):
+            match = INDEX_NAME_RE.match(name)
+            if not match:
+                continue
+            timestamp = int(match.group(1).split('/')[-1].split('_')[0])
+            if start_timestamp is not None and timestamp < start_timestamp or end_timestamp is not None and timestamp > end_timestamp:
+                continue
+            shard = re.match(r'-shard-(\d+)-of-(\d+)', match.group(2) or '')
+            key = (match.group(1), int(shard.group(1)), int(shard.group(2))) if shard else (match.group(1), 0, 1)
+            groups[key].append(name)
+    return {key: sorted(names) for key, names in sorted(groups.items())}
+
+def archived_routes(store, index_names):
+
+    routes = set()
+    for name in index_names:
+        routes.update((origin, destination) for origin, destination, _ in read_index(store, name)['records'])
+    return routes
+
+def output_routes(store, run_name):
+    """Routes in the output blobs of a run, from their manifest entries or, lacking one, their content"""
+    routes = set()
+    for name in store.list_names(run_name):
+        if not RUN_BLOB_RE.match(name) or not name[len(run_name):].startswith(('.', '/')):
+            continue
+        entry_name = manifest_entry_name(name)
+        entry = read_manifest_entry(store, entry_name) if store.exists(entry_name) else index_blob(store, name)
+        routes.update(tuple(route) for route in entry['routes'])
+    return routes
+
+def store_spec():
+    """Picklable description of the configured output store, for worker processes"""
+    if os.getenv('OUTPUT_DIR'):
+        return ('local', os.getenv('OUTPUT_DIR'))
+    return ('gcs', os.getenv('GCS_BUCKET_NAME'))
+
+def open_store(spec):
+
+    kind, location = spec
+    if kind == 'local':
+        return LocalStore(location)
+    from scrape import get_warm_bucket
+    bucket = get_warm_bucket(location)
+    if bucket is None:
+        raise RuntimeError(f"Could not open bucket {location}")
+    return GCSStore(bucket)
+
+def reprocess_run(source_spec, target_spec, index_names):
+    """Re-parse the packs of one run (or shard of one) into a fresh output blob; returns (records, rows)"""
+    from scrape import create_output_writer, format_price_data_for_csv
+
+    source = open_store(source_spec)
+    target = open_store(target_spec)
+    indexes = [read_index(source, name) for name in index_names]
+    first = indexes[0]
+
+    writer = create_output_writer(target, first['timestamp'], first['datetime'], first['shard_index'], first['shard_count'])
+    manifest = ManifestBuilder()
+    records = 0
+    for index in indexes:
+        for origin, destination, raw_data in iter_responses(source, index):
+            rows = format_price_data_for_csv(origin, destination, raw_data, index['timestamp'], index['datetime'])
+            writer.write_rows(rows)
+            manifest.add(rows)
+            records += 1
+
+    if writer.close():
+        write_manifest_entry(target, manifest.entry(writer.blob_name, first['run']))
+    return records, writer.rows_written
+
+def reprocess_archive(source_spec, target_spec, start_timestamp=None, end_timestamp=None, workers=None):
+    """
+    Re-parse every archived run in the window with the current parser, one process per
+    run or shard, writing to the target store in the current OUTPUT_FORMAT. Sharded runs
+    are compacted afterwards. A run whose output has routes the archive lacks, e.g. ones
+    replayed from a journal or fetched by an attempt killed before its pack index was
+    written, is skipped rather than rewritten without them. Returns (runs, records, rows).
+    """
+    from shards import compact_shards
+
+    source = open_store(source_spec)
+    groups = list_archive(source, start_timestamp, end_timestamp)
+    for run_name in sorted({run_name for run_name, _, _ in groups}):
+        keys = [key for key in groups if key[0] == run_name]
+        missing = output_routes(source, run_name) - archived_routes(source, [name for key in keys for name in groups[key]])
+        if missing:
+            print(f"Skipping {run_name}: {len(missing)} routes of its output are not in the archive")
+            for key in keys:
+                del groups[key]
+    if not groups:
+        return 0, 0, 0
+
+    records = rows = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {key: executor.submit(reprocess_run, source_spec, target_spec, names) for key, names in groups.items()}
+        for (run_name, shard_index, shard_count), future in futures.items():
+            run_records, run_rows = future.result()
+            records += run_records
+            rows += run_rows
+            print(f"Reprocessed {run_name} ({shard_index + 1} of {shard_count}): {run_records} responses, {run_rows} rows")
+
+    # Shards without a pack had no routes in the output, or their run was skipped above
+    target = open_store(target_spec)
+    for run_name in sorted({run_name for run_name, _, shard_count in groups if shard_count > 1}):
+        compact_shards(target, run_name, require_all=False)
+    return len({run_name for run_name, _, _ in groups}), records, rows
+
+def main():
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Re-parse archived raw responses into the current output format")
+    parser.add_argument('--start', help="first run timestamp or date (inclusive)")
+    parser.add_argument('--end', help="last run timestamp or date (inclusive)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--output-dir', help="write the output to this directory")
+    target.add_argument('--in-place', action='store_true', help="rewrite the original output blobs")
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    source_spec = store_spec()
+    target_spec = source_spec if args.in_place else ('local', args.output_dir)
+    started = time.perf_counter()
+    runs, records, rows = reprocess_archive(source_spec, target_spec, parse_time(args.start), parse_time(args.end), args.workers)
+    print(f"Reprocessed {runs} runs: {records} responses into {rows} rows in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
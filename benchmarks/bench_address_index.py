@@ -0,0 +1,74 @@
+"""
+Micro-benchmark of AddressIndex lookups over synthetic cached addresses: exact
+normalized keys, misspelled variants and addresses that are not cached at all.
+
+    python benchmarks/bench_address_index.py [--addresses 100000] [--lookups 20000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from addressindex import AddressIndex
+
+STREETS = ['Marszałkowska', 'Aleje Jerozolimskie', 'Puławska', 'Grójecka', 'Świętokrzyska', 'Nowy Świat', 'Żelazna',
+           'Targowa', 'Grochowska', 'Wolska', 'Górczewska', 'Modlińska', 'Sobieskiego', 'Wilanowska', 'Prosta', 'Chmielna']
+CITIES = ['Warszawa', 'Kraków', 'Łódź', 'Wrocław', 'Poznań', 'Gdańsk', 'Szczecin', 'Lublin']
+
+def make_addresses(count, seed=1):
+
+    rng = random.Random(seed)
+    addresses = set()
+    while len(addresses) < count:
+        street = rng.choice(STREETS)
+        if rng.random() < 0.5:
+            street = f"{street} {rng.choice(STREETS).split()[-1]}"
+        addresses.add(f"{street} {rng.randint(1, 400)}{rng.choice(['', '', '', 'a', 'b'])}, {rng.choice(CITIES)}")
+    return sorted(addresses)
+
+def misspell(address, rng):
+    """Drop or double one letter of the street name"""
+    street, rest = address.split(' ', 1)
+    position = rng.randrange(1, len(street))
+    street = street[:position] + street[position + 1:] if rng.random() < 0.5 else street[:position] + street[position - 1:]
+    return f"{street} {rest}"
+
+def time_lookups(index, queries):
+
+    started = time.perf_counter()
+    found = sum(1 for query in queries if index.lookup(query) is not None)
+    return (time.perf_counter() - started) / len(queries) * 1e6, found
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--addresses', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(2)
+    addresses = make_addresses(args.addresses)
+    index = AddressIndex(threshold=0.85, verify=False)
+    started = time.perf_counter()
+    for address in addresses:
+        index.add(address, {'latitude': 52.0, 'longitude': 21.0, 'display_name': address})
+    print(f"Indexed {len(index)} addresses in {time.perf_counter() - started:.2f}s")
+
+    sample = [rng.choice(addresses) for _ in range(args.lookups)]
+    cases = [
+        ('normalized', [f"ul. {address.upper().replace(',', '')}" for address in sample]),
+        ('misspelled', [misspell(address, rng) for address in sample]),
+        ('not cached', [f"{address.split(',')[0]}{rng.randint(500, 900)}, Warszawa" for address in sample]),
+    ]
+    # The first misspelled pass also builds the trigram postings it needs
+    cases.insert(2, ('misspelled', cases[1][1]))
+    for name, queries in cases:
+        microseconds, found = time_lookups(index, queries)
+        print(f"{name:>12}: {microseconds:7.1f} us/lookup, {found / len(queries):.1%} matched")
+
+if __name__ == "__main__":
+    main()
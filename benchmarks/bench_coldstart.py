@@ -0,0 +1,101 @@
+"""
+Cold-start benchmark for scrape.py: import time of the module (with a per-dependency
+breakdown from `python -X importtime`) and the time from interpreter start to the
+first uploaded blob for a small run against the local output stand-in.
+
+    python benchmarks/bench_coldstart.py [--runs 5] [--routes 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('pandas', 'numpy', 'pyarrow', 'google.cloud.storage', 'requests', 'functions_framework', 'flask', 'orjson')
+
+IMPORT_SCRIPT = """
+import time
+started = time.perf_counter()
+import scrape
+print(time.perf_counter() - started)
+"""
+
+# Runs start() with geocoding and the Uber request answered from the recorded fixture
+COLD_START_SCRIPT = """
+import time
+started = time.perf_counter()
+import json, os, sys
+import scrape
+imported = time.perf_counter()
+with open(os.path.join(sys.argv[1], 'fixtures', 'products_response.json'), 'rb') as f:
+    response = scrape.loads(f.read())
+scrape.load_uber_cookies = lambda: {'sid': 'bench'}
+scrape.geocode_request = lambda address: (200, {'latitude': 52.0 + len(address) / 1e4, 'longitude': 21.0, 'display_name': address})
+scrape.get_uber_prices = lambda origin, destination, cookies, query_profile=None: response
+with open('locations.txt', 'w', encoding='utf-8') as f:
+    f.write('\\n'.join(f'Street {i}:Street {i + 1}' for i in range(int(sys.argv[2]))))
+sys.stdout = open(os.devnull, 'w')
+scrape.start()
+sys.stdout = sys.__stdout__
+print(imported - started, time.perf_counter() - started, ' '.join(sorted(m for m in sys.argv[3].split(',') if m in sys.modules)))
+"""
+
+def run_python(args, work_dir, env=None):
+
+    result = subprocess.run(
+        [sys.executable] + args,
+        cwd=work_dir,
+        env=dict(os.environ, PYTHONPATH=ROOT, **(env or {})),
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return result
+
+def import_breakdown(work_dir):
+    """Cumulative import time in ms of the heavy dependencies pulled in by `import scrape`"""
+    stderr = run_python(['-X', 'importtime', '-c', 'import scrape'], work_dir).stderr
+    breakdown = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        if name in HEAVY_MODULES or name == 'scrape':
+            breakdown[name] = int(cumulative) / 1000
+    return breakdown
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--routes', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = {
+            'GEO_CODE_API_KEY': 'bench',
+            'OUTPUT_DIR': os.path.join(work_dir, 'out'),
+            'GEOCODE_CACHE_PATH': os.path.join(work_dir, 'geocode.sqlite'),
+            'GEOCODE_RATE_LIMIT': '0',
+            'UBER_RATE_LIMIT': '0',
+        }
+
+        print("Import breakdown (cumulative ms)")
+        for name, elapsed in sorted(import_breakdown(work_dir).items(), key=lambda item: -item[1]):
+            print(f"  {name:<22} {elapsed:8.1f}")
+
+        import_times = [float(run_python(['-c', IMPORT_SCRIPT], work_dir).stdout) for _ in range(args.runs)]
+        print(f"import scrape: median {statistics.median(import_times) * 1000:.1f} ms over {args.runs} runs")
+
+        results = []
+        for _ in range(args.runs):
+            output = run_python(['-c', COLD_START_SCRIPT, ROOT, str(args.routes), ','.join(HEAVY_MODULES)], work_dir, env).stdout.split(' ', 2)
+            results.append((float(output[0]), float(output[1]), output[2].strip()))
+        print(f"cold start to first blob ({args.routes} routes): median {statistics.median(r[1] for r in results) * 1000:.1f} ms")
+        print(f"heavy modules loaded during the run: {results[-1][2] or 'none'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+End-to-end throughput benchmark: runs scrape.start() against the local fake Uber and
+geocoding servers for several route counts and reports routes/sec, p50/p99 route
+latency, the share of routes that produced rows and peak RSS. Each size runs in a
+fresh interpreter so RSS is not shared.
+
+    python benchmarks/bench_end_to_end.py --routes 10,1000,100000 --latency-ms 20 --concurrency 32
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from fake_servers import start_fake_servers
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Executed in the child interpreter: times every route through fetch_routes()
+RUN_SCRIPT = """
+import json, os, resource, sys, time
+import scrape
+
+latencies = []
+succeeded = []
+original_fetch_routes = scrape.fetch_routes
+
+def timed_fetch_routes(locations, process_route, *args, **kwargs):
+    def timed_route(origin, destination):
+        started = time.perf_counter()
+        try:
+            rows = process_route(origin, destination)
+            if rows:
+                succeeded.append(1)
+            return rows
+        finally:
+            latencies.append(time.perf_counter() - started)
+    return original_fetch_routes(locations, timed_route, *args, **kwargs)
+
+scrape.fetch_routes = timed_fetch_routes
+sys.stdout = open(os.devnull, 'w')
+started = time.perf_counter()
+scrape.start()
+elapsed = time.perf_counter() - started
+sys.stdout = sys.__stdout__
+
+peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform != 'darwin':
+    peak_rss *= 1024
+print(json.dumps({'elapsed': elapsed, 'latencies': sorted(latencies), 'succeeded': len(succeeded), 'peak_rss': peak_rss}))
+"""
+
+def percentile(sorted_values, fraction):
+
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def run_size(route_count, urls, args):
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        with open(os.path.join(work_dir, 'locations.txt'), 'w', encoding='utf-8') as f:
+            # A pool of addresses reused across routes, like a real city-wide route list
+            address_count = max(2, min(route_count, args.addresses))
+            for i in range(route_count):
+                f.write(f"Street {i % address_count}, Warszawa:Avenue {(i * 7 + 3) % address_count}, Warszawa\n")
+        with open(os.path.join(work_dir, 'uber_cookies.json'), 'w', encoding='utf-8') as f:
+            json.dump({'sid': 'bench'}, f)
+
+        env = dict(
+            os.environ,
+            PYTHONPATH=ROOT,
+            GEO_CODE_API_KEY='bench',
+            OUTPUT_DIR=os.path.join(work_dir, 'out'),
+            GEOCODE_CACHE_PATH=os.path.join(work_dir, 'geocode.sqlite'),
+            FETCH_CONCURRENCY=str(args.concurrency),
+            UBER_RATE_LIMIT='0',
+            GEOCODE_RATE_LIMIT='0',
+            **urls
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', RUN_SCRIPT],
+            cwd=work_dir,
+            env=env,
+            capture_output=True,
+            text=True
+        )
+        if result.returncode != 0:
+            print(result.stderr)
+            raise SystemExit(f"Benchmark run with {route_count} routes failed")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--routes', default='10,1000,100000', help="comma-separated route counts")
+    parser.add_argument('--addresses', type=int, default=5000, help="size of the address pool routes are drawn from")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--slow-rate', type=float, default=0.0, help="fraction of upstream responses delayed to --slow-ms")
+    parser.add_argument('--slow-ms', type=float, default=1000.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--size-factor', type=int, default=1)
+    args = parser.parse_args()
+
+    server, upstream, urls = start_fake_servers(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        size_factor=args.size_factor,
+        slow_rate=args.slow_rate,
+        slow_ms=args.slow_ms
+    )
+
+    print(f"{'routes':>8} {'seconds':>9} {'routes/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'ok %':>6} {'peak RSS MB':>12}")
+    try:
+        for route_count in [int(value) for value in args.routes.split(',')]:
+            result = run_size(route_count, urls, args)
+            latencies = result['latencies']
+            print(
+                f"{route_count:>8} {result['elapsed']:>9.2f} {route_count / result['elapsed']:>10.1f} "
+                f"{percentile(latencies, 0.50) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} "
+                f"{100 * result['succeeded'] / route_count:>6.1f} "
+                f"{result['peak_rss'] / 1024 / 1024:>12.1f}"
+            )
+    finally:
+        server.shutdown()
+
+    print(f"upstream requests: {upstream.counts}")
+
+if __name__ == "__main__":
+    main()
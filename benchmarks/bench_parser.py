@@ -0,0 +1,99 @@
+"""
+Micro-benchmark of Products response parsing: the original json + clean_fare()
+path against fares.loads() + parse_csv_rows(), over recorded responses in fixtures/.
+
+    python benchmarks/bench_parser.py [--repeat 2000]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fares import loads, parse_csv_rows
+
+
+def legacy_clean_fare(fare_str):
+    if not fare_str:
+        return 0.0
+    fare_str = str(fare_str).replace('\xa0', ' ')
+    fare_str = ''.join(c for c in fare_str if c.isdigit() or c == '.')
+    try:
+        return float(fare_str)
+    except ValueError:
+        return 0.0
+
+def legacy_format_price_data_for_csv(origin, destination, raw_data, timestamp, formatted_datetime):
+
+    formatted_data = []
+    tiers = raw_data.get('data', {}).get('products', {}).get('tiers', [])
+    for tier in tiers:
+        for product in tier.get('products', []):
+            eta_raw = product.get('etaStringShort', '')
+            eta = eta_raw.split(' ')[-1] if eta_raw else ''
+            fares = product.get('fares', [{}])[0]
+            fare = legacy_clean_fare(fares.get('fare', '0'))
+            formatted_data.append({
+                'timestamp': timestamp,
+                'datetime': formatted_datetime,
+                'origin': origin,
+                'destination': destination,
+                'tier': tier.get('title', ''),
+                'name': product.get('displayName', ''),
+                'description': product.get('description', ''),
+                'currency': product.get('currencyCode', ''),
+                'fare': fare,
+                'originalFare': legacy_clean_fare(fares.get('preAdjustmentValue', fare)),
+                'discount': fares.get('discountPrimary', ''),
+                'hasPromo': fares.get('hasPromo', False),
+                'capacity': fares.get('capacity', 0),
+                'eta': eta,
+                'estimatedTripMinutes': product.get('estimatedTripTime', 0)
+            })
+    return formatted_data
+
+def legacy_parse(body):
+    return legacy_format_price_data_for_csv('A', 'B', json.loads(body), 0, '')
+
+def fast_parse(body):
+    return parse_csv_rows(loads(body), 'A', 'B', 0, '')
+
+def run(parse, bodies, repeat):
+
+    rows = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for body in bodies:
+            rows += len(parse(body))
+    elapsed = time.perf_counter() - started
+    return rows, elapsed
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--fixtures', default=os.path.join(ROOT, 'fixtures', '*.json'))
+    args = parser.parse_args()
+
+    bodies = []
+    for path in sorted(glob.glob(args.fixtures)):
+        with open(path, 'rb') as f:
+            bodies.append(f.read())
+    if not bodies:
+        print(f"No recorded responses found in {args.fixtures}")
+        return
+
+    print(f"{len(bodies)} recorded response(s), {args.repeat} repetitions")
+    results = {}
+    for name, parse in (('before', legacy_parse), ('after', fast_parse)):
+        rows, elapsed = run(parse, bodies, args.repeat)
+        results[name] = rows / elapsed
+        print(f"{name:>6}: {rows} rows in {elapsed:.3f}s -> {rows / elapsed:,.0f} rows/s")
+    print(f"speedup: {results['after'] / results['before']:.2f}x")
+
+if __name__ == "__main__":
+    main()
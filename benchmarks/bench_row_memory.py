@@ -0,0 +1,80 @@
+"""
+Memory benchmark of accumulating parsed rows: a list of per-row dicts converted with
+pd.DataFrame() against a ColumnBuffer handed to pandas or Arrow. Each mode runs in a
+fresh interpreter and reports the peak RSS growth over the interpreter with pandas
+and pyarrow imported, and the time spent.
+
+    python benchmarks/bench_row_memory.py [--rows 1000000]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+import json, os, resource, sys, time
+sys.path.insert(0, {root!r})
+import pandas as pd
+import pyarrow as pa
+from fares import parse_csv_rows
+from output import ColumnBuffer
+from scrape import CSV_COLUMN_TYPES, DICTIONARY_COLUMNS
+
+def peak_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+with open(os.path.join({root!r}, 'fixtures', 'products_response.json'), 'rb') as f:
+    body = f.read()
+mode, row_count = {mode!r}, {rows}
+baseline = peak_rss()
+
+started = time.perf_counter()
+rows = [] if mode == 'dicts' else None
+buffer = ColumnBuffer(CSV_COLUMN_TYPES, DICTIONARY_COLUMNS) if mode != 'dicts' else None
+produced = 0
+route = 0
+while produced < row_count:
+    # Parsed per route, as in a run, so repeated strings are new objects every time
+    route_rows = parse_csv_rows(json.loads(body), f"Street {{route % 5000}}, Warszawa", f"Street {{route}}, Warszawa",
+                                1748786400, '2025-06-01 14:00:00')
+    if rows is not None:
+        rows.extend(route_rows)
+    else:
+        buffer.append_rows(route_rows)
+    produced += len(route_rows)
+    route += 1
+accumulated = time.perf_counter() - started
+
+if mode == 'dicts':
+    frame = pd.DataFrame(rows)
+elif mode == 'columns':
+    frame = buffer.to_pandas()
+else:
+    frame = buffer.to_arrow()
+elapsed = time.perf_counter() - started
+
+print(json.dumps({{'rows': len(frame), 'accumulated': accumulated, 'elapsed': elapsed, 'peak_rss': peak_rss() - baseline}}))
+"""
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    print(f"{'mode':>10} {'rows':>10} {'accumulate s':>13} {'total s':>9} {'peak RSS MiB':>13}")
+    for mode in ('dicts', 'columns', 'arrow'):
+        result = subprocess.run(
+            [sys.executable, '-c', WORKER.format(root=ROOT, mode=mode, rows=args.rows)],
+            capture_output=True, text=True, check=True
+        )
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{mode:>10} {stats['rows']:>10} {stats['accumulated']:>13.2f} {stats['elapsed']:>9.2f} "
+              f"{stats['peak_rss'] / 1024 / 1024:>13.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Local stand-ins for the Uber GraphQL endpoint and the geocode.maps.co search API,
+serving recorded payloads with configurable latency, slow-response tail, error rate,
+response size and rejected cookies.
+
+    python benchmarks/fake_servers.py --port 8765 --latency-ms 50 --error-rate 0.01
+
+then point the scraper at it with
+    UBER_GRAPHQL_URL=http://127.0.0.1:8765/go/graphql
+    GEOCODE_API_URL=http://127.0.0.1:8765/search
+"""
+import argparse
+import copy
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FIXTURE = os.path.join(ROOT, 'fixtures', 'products_response.json')
+
+
+def build_products_payload(fixture_path=DEFAULT_FIXTURE, size_factor=1):
+    """Recorded Products response with every tier's product list repeated size_factor times"""
+    with open(fixture_path, 'r', encoding='utf-8') as f:
+        response = json.load(f)
+
+    if size_factor > 1:
+        for tier in response['data']['products']['tiers']:
+            tier['products'] = [copy.deepcopy(product) for _ in range(size_factor) for product in tier['products']]
+
+    return json.dumps(response).encode('utf-8')
+
+class FakeUpstream:
+    """Shared configuration and counters for the request handler"""
+
+    def __init__(self, latency_ms=20.0, jitter_ms=10.0, error_rate=0.0, throttle_rate=0.0, size_factor=1,
+                 fixture_path=DEFAULT_FIXTURE, slow_rate=0.0, slow_ms=1000.0, rejected_cookies=()):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.products_payload = build_products_payload(fixture_path, size_factor)
+        # Cookie values answered with 401, like an expired account
+        self.rejected_cookies = set(rejected_cookies)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, key):
+
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def delay(self):
+
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if random.random() < self.slow_rate:
+            latency = self.slow_ms
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+    def failure_status(self):
+
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 503
+        return None
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    upstream = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json'):
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fail_if_unlucky(self, endpoint):
+
+        status = self.upstream.failure_status()
+        if status is None:
+            return False
+        self.upstream.count(f"{endpoint}_{status}")
+        self._send(status, b'{"error": "injected failure"}')
+        return True
+
+    def do_GET(self):
+
+        parsed = urlparse(self.path)
+        if parsed.path != '/search':
+            self._send(404, b'{}')
+            return
+
+        self.upstream.delay()
+        if self._fail_if_unlucky('geocode'):
+            return
+
+        query = parse_qs(parsed.query).get('q', [''])[0]
+        digest = hashlib.sha1(query.encode('utf-8')).digest()
+        results = [{
+            'lat': str(52.0 + digest[0] / 1000),
+            'lon': str(21.0 + digest[1] / 1000),
+            'display_name': f"{query}, Warszawa, Polska",
+        }]
+        self.upstream.count('geocode_200')
+        self._send(200, json.dumps(results).encode('utf-8'))
+
+    def do_POST(self):
+
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+
+        if urlparse(self.path).path != '/go/graphql':
+            self._send(404, b'{}')
+            return
+
+        cookie_header = self.headers.get('Cookie', '')
+        if any(f"={value}" in cookie_header for value in self.upstream.rejected_cookies):
+            self.upstream.count('graphql_401')
+            self._send(401, b'{"error": "unauthorized"}')
+            return
+
+        self.upstream.delay()
+        if self._fail_if_unlucky('graphql'):
+            return
+
+        self.upstream.count('graphql_200')
+        self._send(200, self.upstream.products_payload)
+
+def start_fake_servers(port=0, **options):
+    """
+    Start the fake upstream on a background thread. Returns (server, upstream, urls) where
+    urls holds the UBER_GRAPHQL_URL and GEOCODE_API_URL to use; call server.shutdown() to stop.
+    """
+    upstream = FakeUpstream(**options)
+    handler = type('BoundFakeUpstreamHandler', (FakeUpstreamHandler,), {'upstream': upstream})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = {
+        'UBER_GRAPHQL_URL': f"{base_url}/go/graphql",
+        'GEOCODE_API_URL': f"{base_url}/search",
+    }
+    return server, upstream, urls
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--slow-rate', type=float, default=0.0, help="fraction of requests answered after --slow-ms")
+    parser.add_argument('--slow-ms', type=float, default=1000.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument('--size-factor', type=int, default=1, help="repeat each tier's products this many times")
+    parser.add_argument('--fixture', default=DEFAULT_FIXTURE)
+    parser.add_argument('--reject-cookie', action='append', default=[], help="answer 401 to requests carrying this cookie value")
+    args = parser.parse_args()
+
+    server, upstream, urls = start_fake_servers(
+        args.port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        size_factor=args.size_factor,
+        fixture_path=args.fixture,
+        slow_rate=args.slow_rate,
+        slow_ms=args.slow_ms,
+        rejected_cookies=args.reject_cookie
+    )
+    for name, url in urls.items():
+        print(f"{name}={url}")
+
+    try:
+        while True:
+            time.sleep(5)
+            print(f"requests: {upstream.counts}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import os
+import pytest
+import scrape
+
+
+class ScraperSandbox:
+    """An offline scraper run: temporary output directory and geocode cache, stubbed cookies and geocoder"""
+
+    def __init__(self, monkeypatch, work_dir):
+        self.monkeypatch = monkeypatch
+        self.work_dir = work_dir
+        self.output_dir = os.path.join(work_dir, 'out')
+        self.store = scrape.LocalStore(self.output_dir)
+        self.fetch_routes = scrape.fetch_routes
+
+    def patch(self, **replacements):
+        """Replace scrape module attributes, e.g. get_uber_prices, for the rest of the test"""
+        for name, replacement in replacements.items():
+            self.monkeypatch.setattr(scrape, name, replacement)
+
+    def stop_after(self, count):
+        """Let runs finish only their first count routes and skip the rest as if the deadline hit"""
+        def interrupted_fetch(locations, process_route, on_result=None, deadline=None, on_skip=None):
+            for origin, destination in locations[:count]:
+                on_result(process_route(origin, destination))
+            for origin, destination in locations[count:]:
+                on_skip(origin, destination)
+        self.patch(fetch_routes=interrupted_fetch)
+
+    def run_to_completion(self):
+        self.patch(fetch_routes=self.fetch_routes)
+
+    def write_locations(self, routes):
+
+        with open(os.path.join(self.work_dir, 'locations.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(f"{origin}:{destination}" for origin, destination in routes))
+
+
+def fake_geocode_request(address):
+    """Distinct coordinates for every "Street N" address"""
+    return 200, {'latitude': 52.0 + len(address) / 1000, 'longitude': 21.0 + int(address.split()[-1]) / 100, 'display_name': address}
+
+
+@pytest.fixture
+def scraper_sandbox(monkeypatch, tmp_path):
+
+    work_dir = str(tmp_path)
+    for var, value in {
+        'GEO_CODE_API_KEY': 'test',
+        'OUTPUT_DIR': os.path.join(work_dir, 'out'),
+        'GEOCODE_CACHE_PATH': os.path.join(work_dir, 'geocode.sqlite'),
+        'GEOCODE_RATE_LIMIT': '0',
+        'UBER_RATE_LIMIT': '0',
+    }.items():
+        monkeypatch.setenv(var, value)
+    monkeypatch.chdir(work_dir)
+    scrape.invalidate_warm_state()
+
+    sandbox = ScraperSandbox(monkeypatch, work_dir)
+    sandbox.patch(load_uber_cookies=lambda: {'sid': 'test'}, geocode_request=fake_geocode_request)
+    yield sandbox
+    # Closes the geocode cache and sessions opened under the temporary directory
+    scrape.invalidate_warm_state()
@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import time
+from fetcher import HOST_RATE_LIMITS, TokenBucket, get_rate_limiter
+
+
+DEFAULT_PROFILE_DIR = 'cookie_profiles'
+DEFAULT_STRATEGY = 'least_loaded'
+DEFAULT_QUARANTINE_SECONDS = 900
+DEFAULT_COOLDOWN_SECONDS = 60
+DEFAULT_MIN_HEALTH = 0.2
+HEALTH_DECAY = 0.2
+AUTH_FAILURE_STATUS = (401, 403)
+
+class PoolExhausted(Exception):
+    """Every session of the pool is quarantined"""
+
+class CookieSession:
+    """One account's cookies with its own rate limit, load and health score"""
+
+    def __init__(self, name, cookies, limiter):
+        self.name = name
+        self.cookies = cookies
+        self.limiter = limiter
+        self.in_flight = 0
+        self.health = 1.0
+        self.requests = 0
+        self.failures = 0
+        self.quarantined_until = 0.0
+        self.quarantine_reason = None
+
+    def available(self, now):
+        return now >= self.quarantined_until
+
+class CookiePool:
+    """
+    Spreads Uber requests over several accounts. Each session is scored by an
+    exponentially weighted success rate; an auth failure (401/403) quarantines it for
+    `quarantine_seconds`, and a score below `min_health` benches it for `cooldown_seconds`.
+    Dispatch is round robin or least loaded (fewest requests in flight per unit of health).
+    """
+
+    def __init__(self, sessions, strategy=None, quarantine_seconds=None, cooldown_seconds=None, min_health=None):
+        if not sessions:
+            raise ValueError("A cookie pool needs at least one session")
+        self.sessions = list(sessions)
+        self.strategy = (strategy or os.getenv('COOKIE_POOL_STRATEGY', DEFAULT_STRATEGY)).lower()
+        if self.strategy not in ('round_robin', 'least_loaded'):
+            raise ValueError(f"Unknown COOKIE_POOL_STRATEGY '{self.strategy}', expected round_robin or least_loaded")
+        self.quarantine_seconds = quarantine_seconds if quarantine_seconds is not None else float(os.getenv('COOKIE_QUARANTINE_SECONDS', DEFAULT_QUARANTINE_SECONDS))
+        self.cooldown_seconds = cooldown_seconds if cooldown_seconds is not None else float(os.getenv('COOKIE_COOLDOWN_SECONDS', DEFAULT_COOLDOWN_SECONDS))
+        self.min_health = min_health if min_health is not None else float(os.getenv('COOKIE_MIN_HEALTH', DEFAULT_MIN_HEALTH))
+        self.next_index = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def available_count(self):
+
+        now = time.monotonic()
+        with self.lock:
+            return sum(1 for session in self.sessions if session.available(now))
+
+    def acquire(self):
+        """Pick a session for one request and count it as in flight; raises PoolExhausted"""
+        now = time.monotonic()
+        with self.lock:
+            candidates = [session for session in self.sessions if session.available(now)]
+            if not candidates:
+                raise PoolExhausted(f"All {len(self.sessions)} cookie sessions are quarantined")
+
+            if self.strategy == 'round_robin':
+                session = None
+                for offset in range(len(self.sessions)):
+                    candidate = self.sessions[(self.next_index + offset) % len(self.sessions)]
+                    if candidate.available(now):
+                        session = candidate
+                        self.next_index = (self.next_index + offset + 1) % len(self.sessions)
+                        break
+            else:
+                session = min(candidates, key=lambda candidate: (candidate.in_flight + 1) / max(candidate.health, 0.05))
+
+            session.in_flight += 1
+            session.requests += 1
+            return session
+
+    def release(self, session, status_code):
+        """
+        Record the outcome of a request sent with the session (status_code None for a
+        network error). Returns the quarantine reason if the session was just benched.
+        """
+        now = time.monotonic()
+        with self.lock:
+            session.in_flight -= 1
+            succeeded = status_code is not None and status_code < 400
+            session.health += HEALTH_DECAY * ((1.0 if succeeded else 0.0) - session.health)
+            if succeeded:
+                return None
+            session.failures += 1
+
+            if status_code in AUTH_FAILURE_STATUS:
+                reason, seconds = f"auth_{status_code}", self.quarantine_seconds
+            elif session.health < self.min_health and session.available(now):
+                reason, seconds = 'unhealthy', self.cooldown_seconds
+            else:
+                return None
+
+            session.quarantined_until = now + seconds
+            session.quarantine_reason = reason
+            # Back on probation when the quarantine ends
+            session.health = max(session.health, self.min_health * 2)
+            return reason
+
+    def stats(self):
+
+        now = time.monotonic()
+        with self.lock:
+            return [{
+                'name': session.name,
+                'requests': session.requests,
+                'failures': session.failures,
+                'health': round(session.health, 3),
+                'quarantined': not session.available(now),
+                'quarantine_reason': session.quarantine_reason if not session.available(now) else None,
+            } for session in self.sessions]
+
+def account_rate_limiter():
+    """Each account gets the full UBER_RATE_LIMIT, so the pool's throughput grows with its size"""
+    env_var, default_rate = HOST_RATE_LIMITS['m.uber.com']
+    return TokenBucket(float(os.getenv(env_var, default_rate)))
+
+def load_cookie_profiles(profile_dir=None):
+    """Read {name: cookies} from the *.json files written by `uber_cookies.py --profile NAME`"""
+    profile_dir = profile_dir or os.getenv('UBER_COOKIE_DIR', DEFAULT_PROFILE_DIR)
+    profiles = {}
+    if not os.path.isdir(profile_dir):
+        return profiles
+
+    for filename in sorted(os.listdir(profile_dir)):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(profile_dir, filename), 'r') as f:
+                cookies = json.load(f)
+            if cookies:
+                profiles[filename[:-len('.json')]] = cookies
+        except Exception as e:
+            print(f"Warning: Could not load cookie profile {filename}: {str(e)}")
+    return profiles
+
+def build_cookie_pool(profiles):
+    return CookiePool([CookieSession(name, cookies, account_rate_limiter()) for name, cookies in profiles.items()])
+
+def as_cookie_pool(cookies):
+    """Use a pool as is; a single cookie dict becomes a one-session pool under the shared host limit"""
+    if isinstance(cookies, CookiePool):
+        return cookies
+    return CookiePool([CookieSession('default', cookies, get_rate_limiter('m.uber.com'))], strategy='round_robin')
@@ -0,0 +1,188 @@
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+
+DEFAULT_KEYFRAME_SECONDS = 86400
+# Columns whose change makes a product row worth writing again
+VALUE_COLUMNS = ('description', 'currency', 'fare', 'originalFare', 'discount', 'hasPromo', 'capacity', 'eta', 'estimatedTripMinutes')
+OP_FULL = 'full'
+OP_UPSERT = 'upsert'
+OP_DELETE = 'delete'
+
+# {date}/{timestamp}_{datetime}.csv, or a shard of it: {date}/{timestamp}_{datetime}/shard-0000-of-0008.csv.
+# Output uploaded before the date partitioning is {year}/{timestamp}_{datetime}.csv
+RUN_BLOB_RE = re.compile(r'^\d{4}/(?:\d{2}/\d{2}/)?(\d+)_([^/]+?)(/shard-\d+-of-\d+)?\.(csv|csv\.gz|parquet)$')
+
+def delta_enabled():
+    return os.getenv('OUTPUT_DELTA', '').lower() in ('1', 'true', 'yes')
+
+def route_key(origin, destination):
+    return f"{origin}:{destination}"
+
+def product_key(row):
+    return f"{row['tier']}|{row['name']}"
+
+def fingerprint(row):
+
+    values = json.dumps([row.get(column) for column in VALUE_COLUMNS], default=str)
+    return hashlib.sha1(values.encode('utf-8')).hexdigest()[:16]
+
+class DeltaEncoder:
+    """
+    Turns each route's rows into change records against the previous snapshot. The first
+    time a route is fetched in a keyframe period (keyframe_seconds of run time) all of
+    its rows are written with op "full"; after that only products whose values changed
+    are written ("upsert") and products that disappeared get a "delete" tombstone.
+    Only a fingerprint per (route, product) is kept between runs.
+    """
+
+    def __init__(self, state=None, keyframe_seconds=None):
+        self.keyframe_seconds = keyframe_seconds or int(os.getenv('DELTA_KEYFRAME_SECONDS', DEFAULT_KEYFRAME_SECONDS))
+        self.routes = (state or {}).get('routes', {})
+        self.rows_in = 0
+        self.rows_out = 0
+
+    def encode(self, origin, destination, rows, timestamp):
+
+        if not rows:
+            return []
+
+        key = route_key(origin, destination)
+        period = timestamp // self.keyframe_seconds
+        products = {product_key(row): fingerprint(row) for row in rows}
+        previous = self.routes.get(key)
+
+        if previous is None or previous['period'] != period:
+            changes = [dict(row, op=OP_FULL) for row in rows]
+        else:
+            changes = [dict(row, op=OP_UPSERT) for row in rows if previous['products'].get(product_key(row)) != products[product_key(row)]]
+            for gone in sorted(previous['products'].keys() - products.keys()):
+                tier, name = gone.split('|', 1)
+                changes.append({
+                    'timestamp': rows[0]['timestamp'],
+                    'datetime': rows[0]['datetime'],
+                    'origin': origin,
+                    'destination': destination,
+                    'tier': tier,
+                    'name': name,
+                    'op': OP_DELETE,
+                })
+
+        self.routes[key] = {'period': period, 'products': products}
+        self.rows_in += len(rows)
+        self.rows_out += len(changes)
+        return changes
+
+    def replay(self, origin, destination, changes, timestamp):
+        """Bring the state up to date with change records an earlier attempt of this run wrote"""
+        if not changes:
+            return
+
+        key = route_key(origin, destination)
+        period = timestamp // self.keyframe_seconds
+        previous = self.routes.get(key)
+        # Replaying records the saved state already holds leaves it as it was
+        if previous is None or previous['period'] != period or any(row.get('op') == OP_FULL for row in changes):
+            products = {}
+        else:
+            products = dict(previous['products'])
+        for row in changes:
+            if row.get('op') == OP_DELETE:
+                products.pop(product_key(row), None)
+            else:
+                products[product_key(row)] = fingerprint(row)
+
+        self.routes[key] = {'period': period, 'products': products}
+        self.rows_out += len(changes)
+
+    def state(self):
+        return {'keyframe_seconds': self.keyframe_seconds, 'routes': self.routes}
+
+def load_delta_state(store, name):
+
+    try:
+        if not store.exists(name):
+            return None
+        with store.open_read(name) as f:
+            return json.loads(f.read().decode('utf-8'))
+    except Exception as e:
+        print(f"Warning: Could not load delta state {name}, writing a keyframe: {str(e)}")
+        return None
+
+def save_delta_state(store, name, encoder):
+
+    try:
+        with store.open_write(name, content_type='application/json') as f:
+            f.write(json.dumps(encoder.state(), ensure_ascii=False).encode('utf-8'))
+    except Exception as e:
+        print(f"Warning: Could not save delta state {name}: {str(e)}")
+
+def read_rows(store, name):
+    """Rows of a CSV (optionally gzipped) or Parquet output blob as dicts"""
+    with store.open_read(name) as raw:
+        if name.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            return pq.read_table(raw).to_pylist()
+
+        data = raw.read()
+        if name.endswith('.gz'):
+            data = gzip.decompress(data)
+        return list(csv.DictReader(io.StringIO(data.decode('utf-8'))))
+
+def list_runs(store, start_timestamp, end_timestamp):
+    """[(timestamp, [blob names])] of the runs between the two run timestamps, oldest first"""
+    runs = {}
+    day = datetime.fromtimestamp(start_timestamp).date()
+    last_day = datetime.fromtimestamp(end_timestamp).date()
+    while day <= last_day:
+        for name in store.list_names(f"{day:%Y/%m/%d}/"):
+            match = RUN_BLOB_RE.match(name)
+            if not match:
+                continue
+            timestamp = int(match.group(1))
+            if start_timestamp <= timestamp <= end_timestamp:
+                runs.setdefault(timestamp, {'merged': [], 'shards': []})['shards' if match.group(3) else 'merged'].append(name)
+        day += timedelta(days=1)
+
+    # A compacted run may briefly coexist with its shard blobs
+    return [(timestamp, sorted(blobs['merged'] or blobs['shards'])) for timestamp, blobs in sorted(runs.items())]
+
+def apply_changes(snapshot, rows):
+    """Apply change records (or plain rows of a non-delta run, treated as full) to {route: {product: row}}"""
+    full_routes = set()
+    for row in rows:
+        op = row.pop('op', None) or OP_FULL
+        key = route_key(row['origin'], row['destination'])
+        if op == OP_FULL:
+            # A keyframe replaces everything known about the route
+            if key not in full_routes:
+                snapshot[key] = {}
+                full_routes.add(key)
+            snapshot[key][product_key(row)] = row
+        elif op == OP_UPSERT:
+            snapshot.setdefault(key, {})[product_key(row)] = row
+        elif op == OP_DELETE:
+            snapshot.get(key, {}).pop(product_key(row), None)
+
+def reconstruct_snapshot(store, timestamp, keyframe_seconds=None, max_periods=2):
+    """
+    Rebuild the full set of rows as of a run timestamp (the `timestamp` column) by
+    replaying the change records from the start of its keyframe period. Routes not
+    fetched yet in that period are taken from up to max_periods - 1 earlier periods.
+    Returns the rows of the latest version of every product, without the op column.
+    """
+    keyframe_seconds = keyframe_seconds or int(os.getenv('DELTA_KEYFRAME_SECONDS', DEFAULT_KEYFRAME_SECONDS))
+    period_start = (timestamp // keyframe_seconds - (max_periods - 1)) * keyframe_seconds
+
+    snapshot = {}
+    for _, names in list_runs(store, period_start, timestamp):
+        for name in names:
+            apply_changes(snapshot, read_rows(store, name))
+
+    return [row for products in snapshot.values() for row in products.values()]
@@ -0,0 +1,131 @@
+import json
+import re
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# First number in a fare string with its grouping and decimal separators (\s covers NBSP and U+202F)
+_NUMBER_RE = re.compile(r"\d[\d.,'\s]*")
+_GROUPING_RE = re.compile(r"['\s]")
+_TRAILING_SEPARATORS = ".,'"
+
+def loads(content):
+    """Decode a JSON response body, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def _number_to_float(number, decimal_separator=None):
+
+    number = _GROUPING_RE.sub('', number)
+
+    if decimal_separator is None:
+        last_comma = number.rfind(',')
+        last_dot = number.rfind('.')
+        if last_comma >= 0 and last_dot >= 0:
+            decimal_separator = ',' if last_comma > last_dot else '.'
+        elif last_comma >= 0 or last_dot >= 0:
+            # A single separator followed by anything but three digits is a decimal point:
+            # "12,50" and "31.4" are decimals, "1,089" and "1.089" are thousands
+            separator = ',' if last_comma >= 0 else '.'
+            position = max(last_comma, last_dot)
+            if number.count(separator) == 1 and len(number) - position - 1 != 3:
+                decimal_separator = separator
+
+    if decimal_separator is None:
+        return float(number.replace(',', '').replace('.', ''))
+
+    grouping_separator = '.' if decimal_separator == ',' else ','
+    return float(number.replace(grouping_separator, '').replace(decimal_separator, '.'))
+
+@lru_cache(maxsize=8192)
+def split_fare(fare_str, decimal_separator=None):
+    """
+    Split a display fare such as "PLN 31.46", "31,46 zł" or "€1.089,00" into
+    (currency, value). The decimal separator is inferred per string unless given;
+    ranges like "PLN 20-25" yield their lower bound.
+    """
+    match = _NUMBER_RE.search(fare_str)
+    if not match:
+        return fare_str.strip(), 0.0
+
+    number = match.group().rstrip().rstrip(_TRAILING_SEPARATORS)
+    currency = fare_str[:match.start()].strip() or fare_str[match.end():].strip()
+    try:
+        return currency, _number_to_float(number, decimal_separator)
+    except ValueError:
+        print(f"Warning: Could not parse fare value: {fare_str}")
+        return currency, 0.0
+
+def parse_fare(fare, decimal_separator=None):
+
+    if not fare:
+        return 0.0
+    if isinstance(fare, (int, float)):
+        return float(fare)
+    return split_fare(str(fare), decimal_separator)[1]
+
+def iter_products(raw_data):
+    """Yield (tier_title, product) for every product in a Products response"""
+    products_data = (raw_data.get('data') or {}).get('products') or {}
+    for tier in products_data.get('tiers') or []:
+        tier_title = tier.get('title', '')
+        for product in tier.get('products') or []:
+            yield tier_title, product
+
+def parse_csv_rows(raw_data, origin, destination, timestamp, formatted_datetime):
+    """Build the CSV rows for a Products response in a single pass over the tree"""
+    rows = []
+    for tier_title, product in iter_products(raw_data):
+        eta_raw = product.get('etaStringShort', '')
+        fare_entries = product.get('fares') or [{}]
+        fare_entry = fare_entries[0]
+        fare = parse_fare(fare_entry.get('fare', '0'))
+
+        rows.append({
+            'timestamp': timestamp,
+            'datetime': formatted_datetime,
+            'origin': origin,
+            'destination': destination,
+            'tier': tier_title,
+            'name': product.get('displayName', ''),
+            'description': product.get('description', ''),
+            'currency': product.get('currencyCode', ''),
+            'fare': fare,
+            'originalFare': parse_fare(fare_entry.get('preAdjustmentValue', fare)),
+            'discount': fare_entry.get('discountPrimary', ''),
+            'hasPromo': fare_entry.get('hasPromo', False),
+            'capacity': fare_entry.get('capacity', 0),
+            'eta': eta_raw.split(' ')[-1] if eta_raw else '',
+            'estimatedTripMinutes': product.get('estimatedTripTime', 0)
+        })
+    return rows
+
+def parse_fare_entries(raw_data):
+    """Build one entry per fare (not just the first) with the currency taken from the fare string"""
+    result = []
+    for tier_title, product in iter_products(raw_data):
+        estimated_trip_time = product.get('estimatedTripTime', 0)
+        trip_minutes = int(estimated_trip_time / 60) if estimated_trip_time else 0
+
+        for fare_entry in product.get('fares') or []:
+            currency, fare_value = split_fare(fare_entry.get('fare') or '')
+
+            result.append({
+                'tier': tier_title,
+                'name': product.get('displayName', ''),
+                'description': product.get('detailedDescription', ''),
+                'currency': currency,
+                'fare': fare_value,
+                'originalFare': parse_fare(fare_entry.get('preAdjustmentValue')),
+                'discount': fare_entry.get('discountPrimary', ''),
+                'hasPromo': fare_entry.get('hasPromo', False),
+                'capacity': fare_entry.get('capacity', 0),
+                'eta': product.get('etaStringShort', ''),
+                'estimatedTripMinutes': trip_minutes
+            })
+    return result
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_FLUSH_SECONDS = 10.0
+DEFAULT_INITIAL_ROUTE_SECONDS = 5.0
+
+# Requests per second allowed against each upstream host (0 disables the limit)
+HOST_RATE_LIMITS = {
+    'm.uber.com': ('UBER_RATE_LIMIT', 5.0),
+    'geocode.maps.co': ('GEOCODE_RATE_LIMIT', 1.0),
+}
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return how many seconds the caller has to wait before using it"""
+        if self.rate <= 0:
+            return 0.0
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class AdaptiveTokenBucket(TokenBucket):
+    """
+    Token bucket that halves its rate when the upstream throttles (429/5xx)
+    and creeps back up by `increase` tokens per second after each success
+    """
+
+    def __init__(self, rate, min_rate=0.1, max_rate=None, increase=0.1):
+        super().__init__(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self.increase = increase
+
+    def on_success(self):
+
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+
+def get_rate_limiter(host):
+
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(host)
+        if limiter is None:
+            env_var, default_rate = HOST_RATE_LIMITS.get(host, (None, 0.0))
+            rate = float(os.getenv(env_var, default_rate)) if env_var else default_rate
+            limiter = TokenBucket(rate)
+            _rate_limiters[host] = limiter
+        return limiter
+
+class Deadline:
+    """
+    Time budget of a run. A new route is only started while the time left covers the
+    expected cost of a route plus `flush_seconds` for writing out the results. Route
+    cost is a smoothed mean plus four mean deviations of observed route durations, the
+    same estimator TCP uses for retransmission timeouts.
+    """
+
+    def __init__(self, seconds, flush_seconds=None, initial_route_seconds=None, alpha=0.125, beta=0.25):
+        self.expires_at = time.monotonic() + seconds
+        self.flush_seconds = flush_seconds if flush_seconds is not None else float(os.getenv('DEADLINE_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS))
+        self.initial_route_seconds = initial_route_seconds if initial_route_seconds is not None else float(os.getenv('DEADLINE_INITIAL_ROUTE_SECONDS', DEFAULT_INITIAL_ROUTE_SECONDS))
+        self.alpha = alpha
+        self.beta = beta
+        self.mean = None
+        self.deviation = 0.0
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def observe(self, seconds):
+
+        with self.lock:
+            if self.mean is None:
+                self.mean = seconds
+                self.deviation = seconds / 2
+            else:
+                self.deviation += self.beta * (abs(seconds - self.mean) - self.deviation)
+                self.mean += self.alpha * (seconds - self.mean)
+
+    def route_estimate(self):
+
+        with self.lock:
+            if self.mean is None:
+                return self.initial_route_seconds
+            return self.mean + 4 * self.deviation
+
+    def allows_next(self):
+        return self.remaining() > self.route_estimate() + self.flush_seconds
+
+def fetch_routes(locations, process_route, concurrency=None, on_result=None, deadline=None, on_skip=None):
+    """
+    Run process_route(origin, destination) for every route with at most `concurrency`
+    routes in flight. Results are returned in the same order as `locations`; a route
+    whose processing raised an exception yields None.
+
+    When on_result is given, it is called with each result as soon as its route
+    finishes (in completion order, always from the calling thread) and results are
+    not kept, so memory stays flat however many routes there are.
+
+    With a Deadline, no route is started once the budget left no longer covers it;
+    on_skip(origin, destination) is called for each route that was not started.
+    """
+    if concurrency is None:
+        concurrency = int(os.getenv('FETCH_CONCURRENCY', DEFAULT_CONCURRENCY))
+    concurrency = max(1, min(concurrency, len(locations) or 1))
+
+    return asyncio.run(_fetch_all(locations, process_route, concurrency, on_result, deadline, on_skip))
+
+async def _fetch_all(locations, process_route, concurrency, on_result=None, deadline=None, on_skip=None):
+
+    loop = asyncio.get_running_loop()
+    results = [None] * len(locations) if on_result is None else None
+    pending = iter(enumerate(locations))
+    skipped = []
+
+    # requests is blocking, so each worker hands its route to a thread of its own
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        async def worker():
+            for index, (origin, destination) in pending:
+                if deadline is not None and not deadline.allows_next():
+                    skipped.append((origin, destination))
+                    break
+
+                started = time.monotonic()
+                try:
+                    result = await loop.run_in_executor(executor, process_route, origin, destination)
+                except Exception as e:
+                    print(f"Error processing route {origin} -> {destination}: {str(e)}")
+                    continue
+                finally:
+                    if deadline is not None:
+                        deadline.observe(time.monotonic() - started)
+
+                if on_result is None:
+                    results[index] = result
+                else:
+                    on_result(result)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    skipped.extend((origin, destination) for _, (origin, destination) in pending)
+    if on_skip is not None:
+        for origin, destination in skipped:
+            on_skip(origin, destination)
+
+    return results
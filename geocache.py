@@ -0,0 +1,274 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from addresses import normalize_address
+from addressindex import AddressIndex, address_index_enabled
+
+
+# Cloud Functions can only write under the temp directory, which starts empty on every instance
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'geocode_cache.sqlite')
+# Where the cache is kept in the output store between instances
+CACHE_BLOB_NAME = 'geocache/geocode_cache.sqlite'
+DEFAULT_TTL = 30 * 24 * 3600          # refresh coordinates after 30 days
+DEFAULT_NEGATIVE_TTL = 24 * 3600      # retry addresses with no results after a day
+
+def cache_path():
+    return os.getenv('GEOCODE_CACHE_PATH', DEFAULT_CACHE_PATH)
+
+def cache_sync_enabled():
+    """Sync through the output store by default only when the cache lives in the ephemeral temp directory"""
+    value = os.getenv('GEOCODE_CACHE_SYNC')
+    if value is None:
+        return not os.getenv('GEOCODE_CACHE_PATH')
+    return value.lower() in ('1', 'true', 'yes')
+
+def restore_cache(store, path=None, blob_name=CACHE_BLOB_NAME):
+    """
+    Download the cache an earlier instance persisted to the output store, unless this
+    instance already has one. Returns True if a cache was downloaded.
+    """
+    path = path or cache_path()
+    if os.path.exists(path):
+        return False
+    try:
+        if not store.exists(blob_name):
+            return False
+        temp_path = f"{path}.part"
+        with store.open_read(blob_name) as source, open(temp_path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(temp_path, path)
+        return True
+    except Exception as e:
+        print(f"Warning: Could not restore geocode cache from {blob_name}: {str(e)}")
+        return False
+
+class GeocodeCache:
+    """
+    Persistent geocode cache in SQLite, keyed on normalize_address() output.
+
+    Entries are looked up one at a time through the primary key index, so cold
+    start cost does not grow with the size of the cache. Addresses the API had
+    no results for are stored as negative entries with a shorter TTL. Spelling
+    variants that miss the key are matched by an AddressIndex, loaded on the
+    first such miss.
+    """
+
+    def __init__(self, path=None, ttl=None, negative_ttl=None):
+        self.path = path or cache_path()
+        self.ttl = ttl if ttl is not None else int(os.getenv('GEOCODE_CACHE_TTL', DEFAULT_TTL))
+        self.negative_ttl = negative_ttl if negative_ttl is not None else int(os.getenv('GEOCODE_NEGATIVE_TTL', DEFAULT_NEGATIVE_TTL))
+        self.lock = threading.Lock()
+        try:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        except sqlite3.Error as e:
+            # The run still deduplicates its own lookups, it just starts cold next time
+            print(f"Warning: Could not open geocode cache {self.path}, using an in-memory cache: {str(e)}")
+            self.path = ':memory:'
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.address_index = None
+        self._index_lock = threading.Lock()
+        # Entries written since the cache was opened or last persisted
+        self.writes = 0
+        self._create_schema()
+
+    def _create_schema(self):
+
+        try:
+            with self.lock, self.conn:
+                self.conn.execute('PRAGMA journal_mode=WAL')
+                self.conn.execute(
+                    'CREATE TABLE IF NOT EXISTS geocode ('
+                    ' address_key TEXT PRIMARY KEY,'
+                    ' latitude REAL,'
+                    ' longitude REAL,'
+                    ' display_name TEXT,'
+                    ' found INTEGER NOT NULL,'
+                    ' updated_at INTEGER NOT NULL)'
+                )
+                self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        except sqlite3.Error as e:
+            # A cache shipped on a read-only filesystem can still be read
+            print(f"Warning: Could not initialise geocode cache {self.path}: {str(e)}")
+
+    def lookup(self, address):
+        """
+        Return (cached, coordinates). cached is False when the address has to be
+        geocoded; (True, None) means the API is known to have no results for it.
+        """
+        key = normalize_address(address)
+        try:
+            with self.lock:
+                row = self.conn.execute(
+                    'SELECT latitude, longitude, display_name, found, updated_at FROM geocode WHERE address_key = ?',
+                    (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Warning: Geocode cache lookup failed: {str(e)}")
+            return False, None
+
+        if row is None:
+            return False, None
+
+        latitude, longitude, display_name, found, updated_at = row
+        ttl = self.ttl if found else self.negative_ttl
+        if ttl and time.time() - updated_at > ttl:
+            return False, None
+
+        if not found:
+            return True, None
+
+        return True, {
+            'latitude': latitude,
+            'longitude': longitude,
+            'display_name': display_name
+        }
+
+    def fuzzy_lookup(self, address):
+        """Match an address that missed the exact key; returns (coords, matched address, similarity) or None"""
+        if not address_index_enabled():
+            return None
+        return self._load_address_index().lookup(address)
+
+    def _load_address_index(self):
+
+        with self._index_lock:
+            if self.address_index is not None:
+                return self.address_index
+
+            index = AddressIndex()
+            try:
+                with self.lock:
+                    rows = self.conn.execute(
+                        'SELECT address_key, latitude, longitude, display_name FROM geocode WHERE found = 1 AND updated_at >= ?',
+                        (int(time.time() - self.ttl) if self.ttl else 0,)
+                    ).fetchall()
+            except sqlite3.Error as e:
+                print(f"Warning: Could not load the address index: {str(e)}")
+                rows = []
+            for key, latitude, longitude, display_name in rows:
+                index.add(key, {'latitude': latitude, 'longitude': longitude, 'display_name': display_name})
+            self.address_index = index
+            return index
+
+    def store(self, address, coords):
+        """Write a geocoding result through to disk; coords=None records a negative entry"""
+        self.store_many([(address, coords)])
+
+    def store_many(self, entries):
+
+        now = int(time.time())
+        rows = []
+        for address, coords in entries:
+            if coords:
+                # Entries imported from an export keep their age, so the TTL still expires them
+                updated_at = int(coords.get('updated_at') or now)
+                rows.append((normalize_address(address), coords['latitude'], coords['longitude'], coords.get('display_name'), 1, updated_at))
+            else:
+                rows.append((normalize_address(address), None, None, None, 0, now))
+
+        try:
+            with self.lock, self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?)', rows)
+                self.writes += len(rows)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not write to geocode cache: {str(e)}")
+
+        if self.address_index is not None:
+            for address, coords in entries:
+                if coords:
+                    self.address_index.add(address, {key: coords.get(key) for key in ('latitude', 'longitude', 'display_name')})
+
+    def import_json(self, json_path):
+        """Load a locations.json file into the cache, skipping it if unchanged since the last import"""
+        if not os.path.exists(json_path):
+            return 0
+
+        meta_key = f"imported:{os.path.abspath(json_path)}"
+        mtime = str(os.path.getmtime(json_path))
+        try:
+            with self.lock:
+                row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (meta_key,)).fetchone()
+        except sqlite3.Error:
+            row = None
+        if row and row[0] == mtime:
+            return 0
+
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                locations = json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not load {json_path}: {str(e)}")
+            return 0
+
+        self.store_many(locations.items())
+        try:
+            with self.lock, self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (meta_key, mtime))
+        except sqlite3.Error as e:
+            print(f"Warning: Could not record import of {json_path}: {str(e)}")
+
+        print(f"Imported {len(locations)} cached locations from {json_path}")
+        return len(locations)
+
+    def export_json(self, json_path):
+        """Write the cached locations to a locations.json, keeping the addresses as the file spelled them"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT address_key, latitude, longitude, display_name, updated_at FROM geocode WHERE found = 1 ORDER BY address_key'
+            ).fetchall()
+
+        spellings = {}
+        if os.path.exists(json_path):
+            try:
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    spellings = {normalize_address(address): address for address in json.load(f)}
+            except Exception as e:
+                print(f"Warning: Could not read {json_path}, exporting normalized addresses: {str(e)}")
+
+        locations = {
+            spellings.get(key, key): {'latitude': latitude, 'longitude': longitude, 'display_name': display_name, 'updated_at': updated_at}
+            for key, latitude, longitude, display_name, updated_at in rows
+        }
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(locations, f, indent=4, ensure_ascii=False)
+        return len(locations)
+
+    def persist(self, store, blob_name=CACHE_BLOB_NAME):
+        """Upload a consistent copy of the cache to the output store if it changed; returns True if uploaded"""
+        if not self.writes:
+            return False
+
+        temp_path = os.path.join(tempfile.gettempdir(), f"geocode_cache-{os.getpid()}-{threading.get_ident()}.sqlite")
+        try:
+            target = sqlite3.connect(temp_path)
+            try:
+                with self.lock:
+                    self.conn.backup(target)
+                    writes = self.writes
+            finally:
+                target.close()
+            with open(temp_path, 'rb') as source, store.open_write(blob_name, content_type='application/x-sqlite3') as f:
+                shutil.copyfileobj(source, f)
+            self.writes -= writes
+            return True
+        except Exception as e:
+            # Concurrent shards may each upload; the last copy wins and the others are refetched later
+            print(f"Warning: Could not persist geocode cache to {blob_name}: {str(e)}")
+            return False
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def __len__(self):
+
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM geocode WHERE found = 1').fetchone()[0]
+
+    def close(self):
+
+        with self.lock:
+            self.conn.close()
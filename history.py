@@ -0,0 +1,443 @@
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import time
+from datetime import datetime, timedelta
+from delta import RUN_BLOB_RE, read_rows
+from output import LocalStore
+
+
+MANIFEST_PREFIX = 'manifest/'
+DEFAULT_CACHE_DIR = 'history_cache'
+# Entries of runs older than this are not rewritten any more (a retried run lands within hours)
+SETTLED_SECONDS = 2 * 86400
+CSV_CHUNK_SIZE = 100000
+# Output uploaded before the date partitioning sits directly under its year, {year}/{timestamp}_{datetime}.csv,
+# and is listed by timestamp prefixes spanning this many seconds
+LEGACY_BUCKET_SECONDS = 10 ** 6
+DAY_PREFIX_RE = re.compile(r'^\d{4}/\d{2}/\d{2}/')
+LEGACY_NAME_RE = re.compile(r'^(\d{4})/(\d+)_')
+
+NULLABLE_TYPES = {
+    'int64': 'Int64',
+    'float64': 'Float64',
+    'bool': 'boolean',
+    'string': 'string',
+}
+
+def manifest_enabled():
+    return os.getenv('MANIFEST_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+def manifest_entry_name(blob_name):
+    """manifest/{blob name}.json, e.g. manifest/2025/06/01/1748779200_2025-06-01 14:00:00.csv.json"""
+    return f"{MANIFEST_PREFIX}{blob_name}.json"
+
+class ManifestBuilder:
+    """Collects the time range, routes and row count of the rows written to one output blob"""
+
+    def __init__(self):
+        self.rows = 0
+        self.routes = set()
+        self.min_timestamp = None
+        self.max_timestamp = None
+
+    def add(self, rows):
+
+        for row in rows:
+            timestamp = int(row['timestamp'])
+            if self.min_timestamp is None or timestamp < self.min_timestamp:
+                self.min_timestamp = timestamp
+            if self.max_timestamp is None or timestamp > self.max_timestamp:
+                self.max_timestamp = timestamp
+            self.routes.add((row['origin'], row['destination']))
+        self.rows += len(rows)
+
+    def entry(self, blob_name, run_name, delta=False):
+        return {
+            'blob': blob_name,
+            'run': run_name,
+            'rows': self.rows,
+            'min_timestamp': self.min_timestamp,
+            'max_timestamp': self.max_timestamp,
+            'routes': sorted(self.routes),
+            'delta': delta,
+            'written_at': time.time(),
+        }
+
+def write_manifest_entry(store, entry):
+
+    name = manifest_entry_name(entry['blob'])
+    try:
+        with store.open_write(name, content_type='application/json') as f:
+            f.write(json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+    except Exception as e:
+        # The blob is still found by index_history, only without the shortcut
+        print(f"Warning: Could not write manifest entry {name}: {str(e)}")
+
+def read_manifest_entry(store, name):
+
+    with store.open_read(name) as f:
+        return json.loads(f.read().decode('utf-8'))
+
+def index_blob(store, blob_name, delta=False):
+    """Build the manifest entry of an output blob from its content"""
+    match = RUN_BLOB_RE.match(blob_name)
+    builder = ManifestBuilder()
+    rows = read_rows(store, blob_name)
+    builder.add(rows)
+    run_name = blob_name[:match.end(2)]
+    return builder.entry(blob_name, run_name, delta=delta or any(row.get('op') for row in rows))
+
+def merge_manifest_entries(store, shard_names, target_name):
+    """
+    Replace the entries of a run's shard blobs with one for the compacted blob. Shards
+    written without an entry make the compacted blob be indexed from its content.
+    """
+    try:
+        entries = []
+        for name in shard_names:
+            entry_name = manifest_entry_name(name)
+            if not store.exists(entry_name):
+                entries = None
+                break
+            entries.append(read_manifest_entry(store, entry_name))
+
+        if entries:
+            timestamps = [entry[key] for entry in entries for key in ('min_timestamp', 'max_timestamp') if entry[key] is not None]
+            merged = {
+                'blob': target_name,
+                'run': entries[0]['run'],
+                'rows': sum(entry['rows'] for entry in entries),
+                'min_timestamp': min(timestamps) if timestamps else None,
+                'max_timestamp': max(timestamps) if timestamps else None,
+                'routes': sorted({tuple(route) for entry in entries for route in entry['routes']}),
+                'delta': any(entry['delta'] for entry in entries),
+                'written_at': time.time(),
+            }
+        else:
+            merged = index_blob(store, target_name)
+        write_manifest_entry(store, merged)
+
+        for name in shard_names:
+            if store.exists(manifest_entry_name(name)):
+                store.delete(manifest_entry_name(name))
+    except Exception as e:
+        print(f"Warning: Could not update the manifest for {target_name}: {str(e)}")
+
+def index_history(store, start_timestamp, end_timestamp=None):
+    """Write manifest entries for output blobs that have none, e.g. those uploaded before the manifest existed"""
+    indexed = 0
+    for prefix in day_prefixes(store, start_timestamp, end_timestamp):
+        names = store.list_names(prefix)
+        existing = set(store.list_names(f"{MANIFEST_PREFIX}{prefix}"))
+        for name in names:
+            if RUN_BLOB_RE.match(name) and manifest_entry_name(name) not in existing:
+                write_manifest_entry(store, index_blob(store, name))
+                indexed += 1
+    return indexed
+
+def legacy_prefix(timestamp):
+    # Four or more leading digits of a timestamp never match a month directory
+    return f"{datetime.fromtimestamp(timestamp):%Y}/{timestamp // LEGACY_BUCKET_SECONDS}"
+
+def day_prefixes(store, start_timestamp=None, end_timestamp=None):
+    """
+    Date prefixes (YYYY/MM/DD/) covering the window, followed by the prefixes of the
+    undated {year}/{timestamp}_{datetime} blobs in it. Without a start, the prefixes of
+    every manifest entry.
+    """
+    if start_timestamp is None:
+        days = set()
+        legacy = set()
+        last_day = f"{datetime.fromtimestamp(end_timestamp):%Y/%m/%d}/" if end_timestamp is not None else None
+        for name in store.list_names(MANIFEST_PREFIX):
+            name = name[len(MANIFEST_PREFIX):]
+            if DAY_PREFIX_RE.match(name):
+                if last_day is None or name[:len(last_day)] <= last_day:
+                    days.add(name[:len('YYYY/MM/DD/')])
+                continue
+            match = LEGACY_NAME_RE.match(name)
+            if match and (end_timestamp is None or int(match.group(2)) <= end_timestamp):
+                legacy.add(legacy_prefix(int(match.group(2))))
+        return sorted(days) + sorted(legacy)
+
+    last_timestamp = int(end_timestamp if end_timestamp is not None else time.time() + 86400)
+    day = datetime.fromtimestamp(start_timestamp).date()
+    last_day = datetime.fromtimestamp(last_timestamp).date()
+    prefixes = []
+    while day <= last_day:
+        prefixes.append(f"{day:%Y/%m/%d}/")
+        day += timedelta(days=1)
+
+    for bucket in range(int(start_timestamp) // LEGACY_BUCKET_SECONDS, last_timestamp // LEGACY_BUCKET_SECONDS + 1):
+        # A bucket spanning New Year is listed under both years
+        first = max(int(start_timestamp), bucket * LEGACY_BUCKET_SECONDS)
+        last = min(last_timestamp, (bucket + 1) * LEGACY_BUCKET_SECONDS - 1)
+        for prefix in (legacy_prefix(first), legacy_prefix(last)):
+            if prefix not in prefixes:
+                prefixes.append(prefix)
+    return prefixes
+
+def output_schema():
+    """Column types and dictionary-encoded columns of the run output"""
+    from scrape import CSV_COLUMN_TYPES, DICTIONARY_COLUMNS
+    return dict(CSV_COLUMN_TYPES, op='string'), DICTIONARY_COLUMNS + ['op']
+
+class HistoryReader:
+    """
+    Reads collected rows for a time window and set of routes. The manifest tells which
+    blobs can hold matching rows, so only those are downloaded; downloads and settled
+    manifest entries are kept under cache_dir. Parquet blobs get the filters pushed down
+    to their row groups and CSV blobs are filtered chunk by chunk while streaming.
+    """
+
+    def __init__(self, store, cache_dir=None):
+        self.store = store
+        self.cache_dir = cache_dir or os.getenv('HISTORY_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.blobs_read = 0
+        self.blobs_skipped = 0
+        self.cache_hits = 0
+
+    def entries(self, start_timestamp=None, end_timestamp=None):
+        """Manifest entries of the blobs overlapping the window; a compacted run hides its shards"""
+        runs = {}
+        for prefix in day_prefixes(self.store, start_timestamp, end_timestamp):
+            for name in self.store.list_names(f"{MANIFEST_PREFIX}{prefix}"):
+                if not name.endswith('.json'):
+                    continue
+                entry = self._load_entry(name)
+                if entry is None or entry['min_timestamp'] is None:
+                    continue
+                if start_timestamp is not None and entry['max_timestamp'] < start_timestamp:
+                    continue
+                if end_timestamp is not None and entry['min_timestamp'] > end_timestamp:
+                    continue
+                match = RUN_BLOB_RE.match(entry['blob'])
+                blobs = runs.setdefault(entry['run'], {'merged': [], 'shards': []})
+                blobs['shards' if match and match.group(3) else 'merged'].append(entry)
+
+        return [entry for _, blobs in sorted(runs.items()) for entry in sorted(blobs['merged'] or blobs['shards'], key=lambda entry: entry['blob'])]
+
+    def select(self, start_timestamp=None, end_timestamp=None, routes=None, origins=None, destinations=None):
+        """Entries of the blobs that can contain rows matching all the filters"""
+        selected = []
+        for entry in self.entries(start_timestamp, end_timestamp):
+            if entry['rows'] and any(_route_matches(tuple(route), routes, origins, destinations) for route in entry['routes']):
+                selected.append(entry)
+            else:
+                self.blobs_skipped += 1
+        return selected
+
+    def read(self, start_timestamp=None, end_timestamp=None, routes=None, origins=None, destinations=None):
+        """
+        Return the matching rows as a DataFrame with nullable column types and categorical
+        text columns. Timestamps are run timestamps (the `timestamp` column), inclusive.
+        Delta runs contribute their change records, with the `op` column set.
+        """
+        import pandas as pd
+
+        routes = {tuple(route) for route in routes} if routes is not None else None
+        origins = set(origins) if origins is not None else None
+        destinations = set(destinations) if destinations is not None else None
+
+        frames = []
+        for entry in self.select(start_timestamp, end_timestamp, routes, origins, destinations):
+            path = self._local_path(entry)
+            filters = (start_timestamp, end_timestamp, routes, origins, destinations)
+            if entry['blob'].endswith('.parquet'):
+                frame = _read_parquet(path, *filters)
+            else:
+                frame = _read_csv(path, *filters)
+            self.blobs_read += 1
+            if len(frame):
+                frames.append(frame)
+
+        column_types, dictionary_columns = output_schema()
+        if not frames:
+            return _typed(pd.DataFrame({column: pd.Series(dtype='object') for column in column_types}), column_types, dictionary_columns)
+
+        frame = pd.concat([frame.astype({column: 'object' for column in frame.columns if isinstance(frame[column].dtype, pd.CategoricalDtype)}) for frame in frames], ignore_index=True)
+        return _typed(frame, column_types, dictionary_columns)
+
+    def _load_entry(self, name):
+
+        cache_path = os.path.join(self.cache_dir, *name.split('/'))
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        try:
+            entry = read_manifest_entry(self.store, name)
+        except Exception as e:
+            print(f"Warning: Could not read manifest entry {name}: {str(e)}")
+            return None
+
+        if entry['max_timestamp'] is not None and time.time() - entry['max_timestamp'] > SETTLED_SECONDS:
+            _write_atomic(cache_path, json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+        return entry
+
+    def _local_path(self, entry):
+        """Path of the blob on disk, downloading it unless this exact version is cached"""
+        name = entry['blob']
+        if isinstance(self.store, LocalStore):
+            # A local directory stand-in is read in place
+            return self.store.path(name)
+
+        directory = os.path.join(self.cache_dir, *name.split('/')[:-1])
+        base_name = name.split('/')[-1]
+        # A resumed run rewrites its blob, so the cached copy is keyed by when it was written
+        cache_path = os.path.join(directory, f"{int(entry['written_at'] * 1000)}-{base_name}")
+        if os.path.exists(cache_path):
+            self.cache_hits += 1
+            return cache_path
+
+        for stale in glob.glob(os.path.join(glob.escape(directory), f"*-{glob.escape(base_name)}")):
+            os.remove(stale)
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{cache_path}.part"
+        with self.store.open_read(name) as source, open(temp_path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(temp_path, cache_path)
+        return cache_path
+
+def read_history(store, start_timestamp=None, end_timestamp=None, routes=None, origins=None, destinations=None, cache_dir=None):
+    """Shortcut for HistoryReader(store, cache_dir).read(...)"""
+    return HistoryReader(store, cache_dir).read(start_timestamp, end_timestamp, routes, origins, destinations)
+
+def _route_matches(route, routes, origins, destinations):
+
+    if routes is not None and route not in routes:
+        return False
+    if origins is not None and route[0] not in origins:
+        return False
+    if destinations is not None and route[1] not in destinations:
+        return False
+    return True
+
+def _filter_frame(frame, start_timestamp, end_timestamp, routes, origins, destinations):
+
+    mask = None
+    def narrow(condition):
+        return condition if mask is None else mask & condition
+
+    if start_timestamp is not None:
+        mask = narrow(frame['timestamp'] >= start_timestamp)
+    if end_timestamp is not None:
+        mask = narrow(frame['timestamp'] <= end_timestamp)
+    if origins is not None:
+        mask = narrow(frame['origin'].isin(origins))
+    if destinations is not None:
+        mask = narrow(frame['destination'].isin(destinations))
+    if routes is not None:
+        keys = frame['origin'].astype(str) + '\x00' + frame['destination'].astype(str)
+        mask = narrow(keys.isin({f"{origin}\x00{destination}" for origin, destination in routes}))
+    return frame if mask is None else frame[mask]
+
+def _read_parquet(path, start_timestamp, end_timestamp, routes, origins, destinations):
+
+    import pyarrow.parquet as pq
+
+    # Row groups whose statistics rule them out are not decoded at all
+    filters = []
+    if start_timestamp is not None:
+        filters.append(('timestamp', '>=', start_timestamp))
+    if end_timestamp is not None:
+        filters.append(('timestamp', '<=', end_timestamp))
+    route_origins = {route[0] for route in routes} if routes is not None else None
+    route_destinations = {route[1] for route in routes} if routes is not None else None
+    for column, values in (('origin', origins), ('destination', destinations), ('origin', route_origins), ('destination', route_destinations)):
+        if values is not None:
+            filters.append((column, 'in', sorted(values)))
+
+    frame = pq.read_table(path, filters=filters or None).to_pandas()
+    # Origin and destination sets still admit pairs that are not among the routes
+    return _filter_frame(frame, None, None, routes, None, None)
+
+def _read_csv(path, start_timestamp, end_timestamp, routes, origins, destinations):
+
+    import pandas as pd
+
+    chunks = []
+    with pd.read_csv(path, dtype=str, keep_default_na=False, compression='gzip' if path.endswith('.gz') else None,
+                     chunksize=CSV_CHUNK_SIZE) as reader:
+        for chunk in reader:
+            chunk['timestamp'] = pd.to_numeric(chunk['timestamp'])
+            chunk = _filter_frame(chunk, start_timestamp, end_timestamp, routes, origins, destinations)
+            if len(chunk):
+                chunks.append(chunk)
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=['timestamp'])
+
+def _typed(frame, column_types, dictionary_columns):
+
+    import pandas as pd
+
+    for column, type_name in column_types.items():
+        if column not in frame.columns:
+            if column == 'op':
+                continue
+            frame[column] = None
+        values = frame[column]
+        if values.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+            values = values.astype(object).replace('', None)
+        if type_name == 'bool':
+            values = values.map(lambda value: value if value is None or isinstance(value, bool) else str(value).lower() == 'true', na_action='ignore')
+        elif type_name in ('int64', 'float64'):
+            values = pd.to_numeric(values)
+        frame[column] = values.astype('category' if column in dictionary_columns else NULLABLE_TYPES[type_name])
+    return frame[[column for column in column_types if column in frame.columns]]
+
+def _write_atomic(path, data):
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.part"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def parse_time(value):
+    """A run timestamp, or a date/datetime such as 2025-06-01 or 2025-06-01T14:00"""
+    if value is None or value.isdigit():
+        return int(value) if value else None
+    return int(datetime.fromisoformat(value).timestamp())
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Read collected prices from the output store through its manifest")
+    parser.add_argument('--start', help="first run timestamp or date (inclusive)")
+    parser.add_argument('--end', help="last run timestamp or date (inclusive)")
+    parser.add_argument('--origin', action='append', help="only rows from this origin (repeatable)")
+    parser.add_argument('--destination', action='append', help="only rows to this destination (repeatable)")
+    parser.add_argument('--output', help="write the rows to this CSV or .parquet file")
+    parser.add_argument('--index', action='store_true', help="write manifest entries for blobs uploaded without one")
+    args = parser.parse_args()
+
+    from scrape import get_output_store
+    store = get_output_store(os.getenv('GCS_BUCKET_NAME'))
+    if store is None:
+        return
+
+    start_timestamp, end_timestamp = parse_time(args.start), parse_time(args.end)
+    if args.index:
+        if start_timestamp is None:
+            parser.error("--index requires --start")
+        print(f"Indexed {index_history(store, start_timestamp, end_timestamp)} blobs")
+        return
+
+    reader = HistoryReader(store)
+    started = time.perf_counter()
+    frame = reader.read(start_timestamp, end_timestamp, origins=args.origin, destinations=args.destination)
+    print(f"Read {len(frame)} rows from {reader.blobs_read} blobs ({reader.cache_hits} cached, "
+          f"{reader.blobs_skipped} skipped by the manifest) in {time.perf_counter() - started:.2f}s")
+
+    if args.output:
+        if args.output.endswith('.parquet'):
+            frame.to_parquet(args.output, index=False)
+        else:
+            frame.to_csv(args.output, index=False)
+        print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import json
+import os
+import re
+import time
+from collections import Counter
+
+
+DEFAULT_FLUSH_ROUTES = 100
+DEFAULT_FLUSH_SECONDS = 30
+SEGMENT_NAME_RE = re.compile(r'segment-(\d+)\.jsonl$')
+
+def journal_enabled():
+    return os.getenv('JOURNAL_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+class RunJournal:
+    """
+    Append-only record of the routes a run has finished and the rows it wrote for them,
+    kept in the output store as numbered JSON-lines segments under journal/{name}/.
+    Objects cannot be appended to, so each flush writes a new segment; a retried
+    invocation of the same run reads them back and only fetches what is missing.
+    """
+
+    def __init__(self, store, name, flush_routes=None, flush_seconds=None):
+        self.store = store
+        self.prefix = f"journal/{name}/"
+        self.flush_routes = flush_routes if flush_routes is not None else int(os.getenv('JOURNAL_FLUSH_ROUTES', DEFAULT_FLUSH_ROUTES))
+        self.flush_seconds = flush_seconds if flush_seconds is not None else float(os.getenv('JOURNAL_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS))
+        self.pending = []
+        self.next_segment = 0
+        self.last_flush = time.monotonic()
+
+    def segment_names(self):
+
+        names = []
+        for name in self.store.list_names(self.prefix):
+            match = SEGMENT_NAME_RE.search(name)
+            if match:
+                names.append((int(match.group(1)), name))
+        return [name for _, name in sorted(names)]
+
+    def load(self):
+        """Return [(origin, destination, rows)] recorded by earlier attempts of this run"""
+        entries = []
+        for name in self.segment_names():
+            self.next_segment = max(self.next_segment, int(SEGMENT_NAME_RE.search(name).group(1)) + 1)
+            try:
+                with self.store.open_read(name) as f:
+                    content = f.read().decode('utf-8')
+            except Exception as e:
+                print(f"Warning: Could not read journal segment {name}: {str(e)}")
+                continue
+
+            for line in content.splitlines():
+                try:
+                    entry = json.loads(line)
+                    entries.append((entry['origin'], entry['destination'], entry['rows']))
+                except (ValueError, KeyError):
+                    # A segment cut off by a killed instance loses only its last entry
+                    print(f"Warning: Skipping unreadable entry in journal segment {name}")
+        return entries
+
+    def record(self, origin, destination, rows):
+
+        self.pending.append({'origin': origin, 'destination': destination, 'rows': rows})
+        if len(self.pending) >= self.flush_routes or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+
+        name = f"{self.prefix}segment-{self.next_segment:06d}.jsonl"
+        content = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in self.pending)
+        self.pending = []
+        try:
+            with self.store.open_write(name, content_type='application/x-ndjson') as f:
+                f.write(content.encode('utf-8'))
+            self.next_segment += 1
+        except Exception as e:
+            # The run goes on; a retry simply fetches these routes again
+            print(f"Warning: Could not write journal segment {name}: {str(e)}")
+
+    def clear(self):
+        """Delete the journal once the run's output has been written"""
+        self.pending = []
+        try:
+            for name in self.segment_names():
+                self.store.delete(name)
+        except Exception as e:
+            print(f"Warning: Could not delete run journal {self.prefix}: {str(e)}")
+
+def skip_completed(locations, entries):
+    """Drop one occurrence of a route from locations for every journal entry of it"""
+    completed = Counter((origin, destination) for origin, destination, _ in entries)
+    remaining = []
+    for route in locations:
+        if completed[route] > 0:
+            completed[route] -= 1
+        else:
+            remaining.append(route)
+    return remaining
@@ -0,0 +1,311 @@
+import cProfile
+import functools
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_PREFIX = 'uber_scraper'
+
+class Histogram:
+    """Cumulative-bucket latency histogram, the same shape Prometheus exposes"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside the bucket that contains it"""
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for index, bucket_count in enumerate(self.counts):
+            upper = self.buckets[index] if index < len(self.buckets) else self.max
+            if bucket_count and seen + bucket_count >= rank:
+                estimate = lower + (upper - lower) * (rank - seen) / bucket_count
+                return min(max(estimate, self.min), self.max)
+            seen += bucket_count
+            lower = upper
+        return self.max
+
+    def summary(self):
+
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else 0.0,
+            'min': round(self.min or 0.0, 6),
+            'p50': round(self.quantile(0.50), 6),
+            'p95': round(self.quantile(0.95), 6),
+            'p99': round(self.quantile(0.99), 6),
+            'max': round(self.max or 0.0, 6),
+        }
+
+def _label_key(labels):
+
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(label_key, extra=()):
+
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Metrics:
+    """
+    Thread-safe counters and per-stage latency histograms for one run. Counters are
+    named like Prometheus counters (`*_total`) and take free-form labels.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.started = time.monotonic()
+
+    def inc(self, name, amount=1, **labels):
+
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self, stage):
+        """Record how long the block takes under stage_duration_seconds, counting exceptions per stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc('stage_errors_total', stage=stage)
+            raise
+        finally:
+            self.observe('stage_duration_seconds', time.perf_counter() - started, stage=stage)
+
+    def counter_value(self, name, **labels):
+
+        with self.lock:
+            return self.counters.get((name, _label_key(labels)), 0)
+
+    def summary(self, **run_info):
+        """JSON-serializable run summary: stage latency percentiles and all counters"""
+        with self.lock:
+            stages = {}
+            histograms = {}
+            for (name, label_key), histogram in sorted(self.histograms.items()):
+                labels = dict(label_key)
+                if name == 'stage_duration_seconds' and list(labels) == ['stage']:
+                    stages[labels['stage']] = histogram.summary()
+                else:
+                    histograms.setdefault(name, []).append({'labels': labels, **histogram.summary()})
+
+            counters = {}
+            for (name, label_key), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({'labels': dict(label_key), 'value': value})
+
+        summary = dict(run_info)
+        summary.update({
+            'started_at': self.started_at,
+            'duration_seconds': round(time.monotonic() - self.started, 3),
+            'stages': stages,
+            'counters': counters,
+        })
+        if histograms:
+            summary['histograms'] = histograms
+        return summary
+
+    def to_prometheus(self, prefix=METRIC_PREFIX, **run_labels):
+        """Render the metrics in the Prometheus text exposition format"""
+        run_key = _label_key(run_labels)
+        lines = []
+
+        with self.lock:
+            counter_names = sorted({name for name, _ in self.counters})
+            for name in counter_names:
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                for (counter_name, label_key), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{prefix}_{name}{_format_labels(run_key + label_key)} {value}")
+
+            histogram_names = sorted({name for name, _ in self.histograms})
+            for name in histogram_names:
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                for (histogram_name, label_key), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    labels = run_key + label_key
+                    cumulative = 0
+                    for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(f"{prefix}_{name}_bucket{_format_labels(labels, [('le', repr(bound))])} {cumulative}")
+                    lines.append(f"{prefix}_{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{prefix}_{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                    lines.append(f"{prefix}_{name}_count{_format_labels(labels)} {histogram.count}")
+
+        lines.append(f"# TYPE {prefix}_run_start_time_seconds gauge")
+        lines.append(f"{prefix}_run_start_time_seconds{_format_labels(run_key)} {self.started_at:.3f}")
+        lines.append(f"# TYPE {prefix}_run_duration_seconds gauge")
+        lines.append(f"{prefix}_run_duration_seconds{_format_labels(run_key)} {time.monotonic() - self.started:.3f}")
+        return '\n'.join(lines) + '\n'
+
+    def print_summary(self):
+
+        for stage, stats in self.summary()['stages'].items():
+            print(
+                f"{stage}: {stats['count']} calls, p50 {stats['p50'] * 1000:.1f} ms, "
+                f"p95 {stats['p95'] * 1000:.1f} ms, p99 {stats['p99'] * 1000:.1f} ms"
+            )
+
+_current_metrics = Metrics()
+
+def get_metrics():
+    """Metrics of the run in progress"""
+    return _current_metrics
+
+def reset_metrics():
+    """Start a fresh set of metrics, e.g. at the beginning of each run on a warm instance"""
+    global _current_metrics
+    _current_metrics = Metrics()
+    return _current_metrics
+
+def timed(stage):
+    """Decorator recording each call of the function as a stage in the current metrics"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_metrics().time(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _write_local(path, content):
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    # Replaced atomically so a textfile collector never reads a half-written file
+    os.replace(temporary_path, path)
+
+def write_run_metrics(metrics, run_info, suffix='', local_dir=None, store=None, store_prefix='metrics'):
+    """
+    Write the JSON run summary and the Prometheus text file. In local_dir the files are
+    overwritten on every run (uber_scraper{suffix}.json/.prom) as a textfile collector
+    expects; in the store they are kept per run as {store_prefix}/{run_name}{suffix}.json/.prom.
+    """
+    summary = json.dumps(metrics.summary(**run_info), indent=2)
+    prometheus_labels = {key: value for key, value in run_info.items() if key in ('shard_index', 'shard_count')}
+    prometheus_text = metrics.to_prometheus(**prometheus_labels)
+    outputs = (('json', summary, 'application/json'), ('prom', prometheus_text, 'text/plain'))
+    written = []
+
+    if local_dir:
+        for extension, content, _ in outputs:
+            path = os.path.join(local_dir, f"{METRIC_PREFIX}{suffix}.{extension}")
+            _write_local(path, content)
+            written.append(path)
+
+    if store is not None:
+        for extension, content, content_type in outputs:
+            blob_name = f"{store_prefix}/{run_info['run_name']}{suffix}.{extension}"
+            with store.open_write(blob_name, content_type=content_type) as f:
+                f.write(content.encode('utf-8'))
+            written.append(store.uri(blob_name))
+
+    return written
+
+class HotPathProfiler:
+    """
+    cProfile capture for functions run on worker threads: each thread profiles its
+    own calls and the profiles are merged when the run ends.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.disabled = False
+
+    def wrap(self, func):
+
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            if self.disabled:
+                return func(*args, **kwargs)
+
+            profile = getattr(self.local, 'profile', None)
+            if profile is None:
+                profile = self.local.profile = cProfile.Profile()
+                with self.lock:
+                    self.profiles.append(profile)
+            try:
+                profile.enable()
+            except ValueError as e:
+                # Only one profiler may be active at a time on some Python versions
+                print(f"Warning: Disabling hot path profiling: {str(e)}")
+                self.disabled = True
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+        return profiled
+
+    def stats(self):
+
+        with self.lock:
+            profiles = list(self.profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def dump(self, path, top=20):
+        """Save the merged profile for snakeviz/pstats and print the most expensive calls"""
+        stats = self.stats()
+        if stats is None:
+            return False
+        stats.dump_stats(path)
+        print(f"Hot path profile saved to {path}")
+        stats.sort_stats('cumulative').print_stats(top)
+        return True
@@ -0,0 +1,371 @@
+import csv
+import gzip
+import io
+import os
+import sys
+from array import array
+
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024   # resumable upload chunk, must be a multiple of 256 KiB
+
+class GCSStore:
+    """Blob store backed by a Google Cloud Storage bucket"""
+
+    def __init__(self, bucket, chunk_size=None):
+        self.bucket = bucket
+        self.chunk_size = chunk_size or int(os.getenv('UPLOAD_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+
+    def uri(self, name):
+        return f"gs://{self.bucket.name}/{name}"
+
+    def open_write(self, name, content_type=None, content_encoding=None):
+        """Open a resumable upload; data is sent chunk by chunk and the blob appears on close()"""
+        blob = self.bucket.blob(name, chunk_size=self.chunk_size)
+        if content_encoding:
+            blob.content_encoding = content_encoding
+        return blob.open('wb', ignore_flush=True, content_type=content_type)
+
+    def open_read(self, name):
+        # Stored bytes as written: a gzip content_encoding blob would otherwise be decompressed in transit
+        return self.bucket.blob(name).open('rb', raw_download=True)
+
+    def list_names(self, prefix=''):
+        return sorted(blob.name for blob in self.bucket.list_blobs(prefix=prefix))
+
+    def exists(self, name):
+        return self.bucket.blob(name).exists()
+
+    def delete(self, name):
+        self.bucket.blob(name).delete()
+
+class LocalStore:
+    """Stand-in for GCSStore that keeps blobs as files under a local directory"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def uri(self, name):
+        return self.path(name)
+
+    def open_write(self, name, content_type=None, content_encoding=None):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return open(path, 'wb')
+
+    def open_read(self, name):
+        return open(self.path(name), 'rb')
+
+    def list_names(self, prefix=''):
+
+        names = []
+        for directory, _, files in os.walk(self.root):
+            for filename in files:
+                name = os.path.relpath(os.path.join(directory, filename), self.root).replace(os.sep, '/')
+                if name.startswith(prefix):
+                    names.append(name)
+        return sorted(names)
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def delete(self, name):
+        os.remove(self.path(name))
+
+class CSVStreamWriter:
+    """
+    Writes rows to a store as they arrive instead of building the whole CSV in memory.
+    The blob is only created once the first row is written, so an empty run uploads nothing,
+    unless always_create is set.
+    """
+
+    def __init__(self, store, blob_name, columns, compress=False, always_create=False):
+        self.store = store
+        self.blob_name = blob_name
+        self.columns = columns
+        self.compress = compress
+        self.always_create = always_create
+        self.rows_written = 0
+        self._raw = None
+        self._gzip = None
+        self._text = None
+        self._writer = None
+
+    def _open(self):
+
+        if self.compress:
+            self._raw = self.store.open_write(self.blob_name, content_type='text/csv', content_encoding='gzip')
+            self._gzip = gzip.GzipFile(fileobj=self._raw, mode='wb')
+            binary = self._gzip
+        else:
+            self._raw = self.store.open_write(self.blob_name, content_type='text/csv')
+            binary = self._raw
+
+        self._text = io.TextIOWrapper(binary, encoding='utf-8', newline='', write_through=True)
+        self._writer = csv.DictWriter(self._text, fieldnames=self.columns, extrasaction='ignore')
+        self._writer.writeheader()
+
+    def write_rows(self, rows):
+
+        if not rows:
+            return
+        if self._writer is None:
+            self._open()
+        self._writer.writerows(rows)
+        self.rows_written += len(rows)
+
+    def close(self):
+        """Finish the upload; returns True if a blob was written"""
+        if self._writer is None:
+            if not self.always_create:
+                return False
+            self._open()
+
+        self._text.flush()
+        self._text.detach()
+        if self._gzip is not None:
+            self._gzip.close()
+        self._raw.close()
+        self._writer = None
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+PARQUET_TYPES = {
+    'int64': 'int64',
+    'float64': 'float64',
+    'bool': 'bool_',
+    'string': 'string',
+}
+
+# array.array type codes of the columns stored as plain numbers
+ARRAY_TYPECODES = {
+    'int64': 'q',
+    'float64': 'd',
+    'bool': 'b',
+}
+
+def _to_bool(value):
+    return value if isinstance(value, bool) else str(value).lower() == 'true'
+
+class ColumnBuffer:
+    """
+    Accumulates rows as typed columns instead of one dict per row. Numbers and flags go
+    into array.array buffers, columns in dictionary_columns are stored as int32 codes
+    into a list of their distinct values, and other text is interned. to_arrow() and
+    to_pandas() hand the number and code buffers over without copying them and leave
+    the buffer empty.
+    """
+
+    def __init__(self, column_types, dictionary_columns=()):
+        self.column_types = dict(column_types)
+        self.dictionary_columns = set(dictionary_columns)
+        self.clear()
+
+    def clear(self):
+
+        self.length = 0
+        self.columns = {}
+        self.dictionaries = {}
+        # Validity per row (1 = value present), only for columns that have had a missing value
+        self.masks = {}
+        for column, type_name in self.column_types.items():
+            if column in self.dictionary_columns:
+                self.columns[column] = array('i')
+                self.dictionaries[column] = {}
+            elif type_name in ARRAY_TYPECODES:
+                self.columns[column] = array(ARRAY_TYPECODES[type_name])
+            else:
+                self.columns[column] = []
+
+    def __len__(self):
+        return self.length
+
+    def append_rows(self, rows):
+
+        if not rows:
+            return
+        end = self.length + len(rows)
+        for mask in self.masks.values():
+            mask.extend(b'\x01' * len(rows))
+
+        for column, type_name in self.column_types.items():
+            values = self.columns[column]
+            if column in self.dictionary_columns:
+                codes = self.dictionaries[column]
+                for position, row in enumerate(rows):
+                    value = row.get(column)
+                    if value is None:
+                        values.append(-1)
+                        self._set_missing(column, self.length + position, end)
+                        continue
+                    code = codes.get(value)
+                    if code is None:
+                        code = codes[value] = len(codes)
+                    values.append(code)
+            elif type_name in ARRAY_TYPECODES:
+                convert = _to_bool if type_name == 'bool' else float if type_name == 'float64' else int
+                for position, row in enumerate(rows):
+                    value = row.get(column)
+                    if value is None or value == '':
+                        values.append(0)
+                        self._set_missing(column, self.length + position, end)
+                    else:
+                        values.append(convert(value))
+            else:
+                for row in rows:
+                    value = row.get(column)
+                    values.append(None if value is None else sys.intern(str(value)))
+        self.length = end
+
+    def _set_missing(self, column, index, end):
+
+        mask = self.masks.get(column)
+        if mask is None:
+            mask = self.masks[column] = bytearray(b'\x01') * end
+        mask[index] = 0
+
+    def to_arrow(self, schema=None):
+        """Hand the rows over as a pyarrow Table; number and code columns share the buffers"""
+        import numpy as np
+        import pyarrow as pa
+
+        arrays = []
+        for column, type_name in self.column_types.items():
+            values = self.columns[column]
+            mask = self.masks.get(column)
+            validity = pa.array(np.frombuffer(mask, dtype=np.bool_)).buffers()[1] if mask is not None else None
+            if column in self.dictionary_columns:
+                indices = pa.Array.from_buffers(pa.int32(), self.length, [validity, pa.py_buffer(values)], null_count=-1)
+                arrays.append(pa.DictionaryArray.from_arrays(indices, pa.array(list(self.dictionaries[column]), type=pa.string())))
+            elif type_name == 'bool':
+                # Arrow packs flags into bits, so these are the one number column that is copied
+                flags = np.frombuffer(values, dtype=np.bool_)
+                arrays.append(pa.array(flags, mask=~np.frombuffer(mask, dtype=np.bool_) if mask is not None else None))
+            elif type_name in ARRAY_TYPECODES:
+                arrow_type = pa.int64() if type_name == 'int64' else pa.float64()
+                arrays.append(pa.Array.from_buffers(arrow_type, self.length, [validity, pa.py_buffer(values)], null_count=-1))
+            else:
+                arrays.append(pa.array(values, type=pa.string()))
+
+        names = list(self.column_types)
+        self.clear()
+        if schema is not None:
+            return pa.Table.from_arrays(arrays, schema=schema)
+        return pa.Table.from_arrays(arrays, names=names)
+
+    def to_pandas(self):
+        """
+        Hand the rows over as a DataFrame: numbers and flags as numpy views of the buffers
+        (nullable extension arrays where values are missing) and dictionary columns as
+        categoricals over their codes
+        """
+        import numpy as np
+        import pandas as pd
+
+        numpy_types = {'int64': np.int64, 'float64': np.float64, 'bool': np.bool_}
+        nullable_types = {'int64': pd.arrays.IntegerArray, 'float64': pd.arrays.FloatingArray, 'bool': pd.arrays.BooleanArray}
+        data = {}
+        for column, type_name in self.column_types.items():
+            values = self.columns[column]
+            mask = self.masks.get(column)
+            if column in self.dictionary_columns:
+                # Missing values already carry code -1
+                data[column] = pd.Categorical.from_codes(np.frombuffer(values, dtype=np.int32), categories=list(self.dictionaries[column]))
+            elif type_name in ARRAY_TYPECODES:
+                numbers = np.frombuffer(values, dtype=numpy_types[type_name])
+                data[column] = nullable_types[type_name](numbers, ~np.frombuffer(mask, dtype=np.bool_)) if mask is not None else numbers
+            else:
+                data[column] = pd.array(values, dtype='string')
+
+        self.clear()
+        return pd.DataFrame(data, copy=False)
+
+class ParquetStreamWriter:
+    """
+    Writes rows to a store as compressed Parquet, one row group per `row_group_size`
+    rows, so only a single row group is held in memory at a time, in a ColumnBuffer.
+    Columns listed in dictionary_columns are stored dictionary-encoded and read back
+    as categoricals.
+    """
+
+    def __init__(self, store, blob_name, column_types, dictionary_columns=(), compression=None, row_group_size=None,
+                 always_create=False):
+        self.store = store
+        self.blob_name = blob_name
+        self.always_create = always_create
+        self.column_types = column_types
+        self.dictionary_columns = list(dictionary_columns)
+        self.compression = compression or os.getenv('PARQUET_COMPRESSION', 'zstd')
+        self.row_group_size = row_group_size or int(os.getenv('PARQUET_ROW_GROUP_SIZE', 50000))
+        self.rows_written = 0
+        self._buffer = ColumnBuffer(column_types, self.dictionary_columns)
+        self._raw = None
+        self._writer = None
+        self._schema = None
+
+    def _open(self):
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        fields = []
+        for column, type_name in self.column_types.items():
+            if column in self.dictionary_columns:
+                fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+            else:
+                fields.append(pa.field(column, getattr(pa, PARQUET_TYPES[type_name])()))
+        self._schema = pa.schema(fields)
+
+        self._raw = self.store.open_write(self.blob_name, content_type='application/vnd.apache.parquet')
+        self._writer = pq.ParquetWriter(
+            self._raw,
+            self._schema,
+            compression=self.compression,
+            use_dictionary=self.dictionary_columns
+        )
+
+    def _flush_row_group(self):
+
+        if not len(self._buffer):
+            return
+        if self._writer is None:
+            self._open()
+
+        self._writer.write_table(self._buffer.to_arrow(self._schema))
+
+    def write_rows(self, rows):
+
+        if not rows:
+            return
+        self._buffer.append_rows(rows)
+        self.rows_written += len(rows)
+        if len(self._buffer) >= self.row_group_size:
+            self._flush_row_group()
+
+    def close(self):
+        """Write the last row group and finish the upload; returns True if a blob was written"""
+        self._flush_row_group()
+        if self._writer is None:
+            if not self.always_create:
+                return False
+            self._open()
+
+        self._writer.close()
+        self._raw.close()
+        self._writer = None
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
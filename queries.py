@@ -0,0 +1,102 @@
+import json
+import os
+
+
+# Query sent by the m.uber.com web client, kept verbatim
+FULL_PRODUCTS_QUERY = 'query Products($capacity: Int, $destinations: [InputCoordinate!]!, $includeRecommended: Boolean = false, $paymentProfileUUID: String, $pickup: InputCoordinate!, $pickupFormattedTime: String, $profileType: String, $profileUUID: String, $returnByFormattedTime: String, $stuntID: String, $targetProductType: EnumRVWebCommonTargetProductType) {\n  products(\n    capacity: $capacity\n    destinations: $destinations\n    includeRecommended: $includeRecommended\n    paymentProfileUUID: $paymentProfileUUID\n    pickup: $pickup\n    pickupFormattedTime: $pickupFormattedTime\n    profileType: $profileType\n    profileUUID: $profileUUID\n    returnByFormattedTime: $returnByFormattedTime\n    stuntID: $stuntID\n    targetProductType: $targetProductType\n  ) {\n    ...ProductsFragment\n    __typename\n  }\n}\n\nfragment ProductsFragment on RVWebCommonProductsResponse {\n  defaultVVID\n  hourlyTiersWithMinimumFare {\n    ...HourlyTierFragment\n    __typename\n  }\n  intercity {\n    ...IntercityFragment\n    __typename\n  }\n  links {\n    iFrame\n    text\n    url\n    __typename\n  }\n  productsUnavailableMessage\n  tiers {\n    ...TierFragment\n    __typename\n  }\n  __typename\n}\n\nfragment BadgesFragment on RVWebCommonProductBadge {\n  color\n  text\n  __typename\n}\n\nfragment HourlyTierFragment on RVWebCommonHourlyTier {\n  description\n  distance\n  fare\n  fareAmountE5\n  farePerHour\n  minutes\n  packageVariantUUID\n  preAdjustmentValue\n  __typename\n}\n\nfragment IntercityFragment on RVWebCommonIntercityInfo {\n  oneWayIntercityConfig(destinations: $destinations, pickup: $pickup) {\n    ...IntercityConfigFragment\n    __typename\n  }\n  roundTripIntercityConfig(destinations: $destinations, pickup: $pickup) {\n    ...IntercityConfigFragment\n    __typename\n  }\n  __typename\n}\n\nfragment IntercityConfigFragment on RVWebCommonIntercityConfig {\n  description\n  onDemandAllowed\n  reservePickup {\n    ...IntercityTimePickerFragment\n    __typename\n  }\n  returnBy {\n    ...IntercityTimePickerFragment\n    __typename\n  }\n  __typename\n}\n\nfragment IntercityTimePickerFragment on RVWebCommonIntercityTimePicker {\n  bookingRange {\n    maximum\n    minimum\n    __typename\n  }\n  header {\n    subTitle\n    title\n    __typename\n  }\n  __typename\n}\n\nfragment TierFragment on RVWebCommonProductTier {\n  products {\n    ...ProductFragment\n    __typename\n  }\n  title\n  __typename\n}\n\nfragment ProductFragment on RVWebCommonProduct {\n  badges {\n    ...BadgesFragment\n    __typename\n  }\n  cityID\n  currencyCode\n  description\n  detailedDescription\n  discountPrimary\n  displayName\n  estimatedTripTime\n  etaStringShort\n  fares {\n    capacity\n    discountPrimary\n    fare\n    fareAmountE5\n    hasPromo\n    hasRidePass\n    meta\n    preAdjustmentValue\n    __typename\n  }\n  hasPromo\n  hasRidePass\n  hasBenefitsOnFare\n  hourly {\n    tiers {\n      ...HourlyTierFragment\n      __typename\n    }\n    overageRates {\n      ...HourlyOverageRatesFragment\n      __typename\n    }\n    __typename\n  }\n  iconType\n  id\n  is3p\n  isAvailable\n  legalConsent {\n    ...ProductLegalConsentFragment\n    __typename\n  }\n  parentProductUuid\n  preAdjustmentValue\n  productImageUrl\n  productUuid\n  reserveEnabled\n  __typename\n}\n\nfragment ProductLegalConsentFragment on RVWebCommonProductLegalConsent {\n  header\n  image {\n    url\n    width\n    __typename\n  }\n  description\n  enabled\n  ctaUrl\n  ctaDisplayString\n  buttonLabel\n  showOnce\n  shouldBlockRequest\n  __typename\n}\n\nfragment HourlyOverageRatesFragment on RVWebCommonHourlyOverageRates {\n  perDistanceUnit\n  perTemporalUnit\n  __typename\n}\n'
+
+# Only the fields read by format_price_data_for_csv() and extract_price_data()
+LEAN_PRODUCTS_FIELDS = {
+    'tiers': {
+        'title': None,
+        'products': {
+            'currencyCode': None,
+            'description': None,
+            'detailedDescription': None,
+            'displayName': None,
+            'estimatedTripTime': None,
+            'etaStringShort': None,
+            'fares': {
+                'capacity': None,
+                'discountPrimary': None,
+                'fare': None,
+                'hasPromo': None,
+                'preAdjustmentValue': None,
+            },
+        },
+    },
+}
+
+DEFAULT_QUERY_PROFILE = 'full'
+
+def render_selection(fields, indent=4):
+    """Render a nested {field: subfields-or-None} dict as a GraphQL selection set"""
+    pad = ' ' * indent
+    lines = []
+    for name, subfields in fields.items():
+        if subfields:
+            lines.append(f"{pad}{name} {{")
+            lines.append(render_selection(subfields, indent + 2))
+            lines.append(f"{pad}}}")
+        else:
+            lines.append(f"{pad}{name}")
+    return '\n'.join(lines)
+
+LEAN_PRODUCTS_QUERY = (
+    'query Products($destinations: [InputCoordinate!]!, $includeRecommended: Boolean = false, '
+    '$pickup: InputCoordinate!, $profileType: String) {\n'
+    '  products(\n'
+    '    destinations: $destinations\n'
+    '    includeRecommended: $includeRecommended\n'
+    '    pickup: $pickup\n'
+    '    profileType: $profileType\n'
+    '  ) {\n'
+    + render_selection(LEAN_PRODUCTS_FIELDS) +
+    '\n  }\n}\n'
+)
+
+QUERY_PROFILES = {
+    'full': FULL_PRODUCTS_QUERY,
+    'lean': LEAN_PRODUCTS_QUERY,
+}
+
+_VARIABLES_PLACEHOLDER = '__VARIABLES__'
+
+def _serialize_body_template(query):
+    body = json.dumps({
+        'operationName': 'Products',
+        'variables': _VARIABLES_PLACEHOLDER,
+        'query': query,
+    })
+    prefix, suffix = body.split(json.dumps(_VARIABLES_PLACEHOLDER))
+    return prefix.encode('utf-8'), suffix.encode('utf-8')
+
+# The query text never changes, so each profile is encoded once per process and only
+# the variables are serialized per request
+_BODY_TEMPLATES = {profile: _serialize_body_template(query) for profile, query in QUERY_PROFILES.items()}
+
+def get_query_profile(profile=None):
+
+    profile = profile or os.getenv('UBER_QUERY_PROFILE', DEFAULT_QUERY_PROFILE)
+    if profile not in QUERY_PROFILES:
+        raise ValueError(f"Unknown query profile '{profile}', expected one of: {', '.join(QUERY_PROFILES)}")
+    return profile
+
+def build_products_body(origin_coords, destination_coords, profile=None):
+    """Return the encoded Products request body for a route"""
+    prefix, suffix = _BODY_TEMPLATES[get_query_profile(profile)]
+    variables = json.dumps({
+        'includeRecommended': False,
+        'destinations': [
+            {
+                'latitude': destination_coords['latitude'],
+                'longitude': destination_coords['longitude'],
+            },
+        ],
+        'pickup': {
+            'latitude': origin_coords['latitude'],
+            'longitude': origin_coords['longitude'],
+        },
+        'profileType': 'Personal',
+    })
+    return prefix + variables.encode('utf-8') + suffix
@@ -0,0 +1,181 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+# Answers that mean the session itself is refused rather than one request failing
+BLOCKED_STATUS = (401, 403)
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BASE_DELAY = 0.5
+DEFAULT_RETRY_MAX_DELAY = 10.0
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+DEFAULT_HEDGE_QUANTILE = 0.95
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+
+_breakers = {}
+_latency_trackers = {}
+_registry_lock = threading.Lock()
+_hedge_executor = None
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, honouring a numeric Retry-After when the upstream sends one"""
+
+    def __init__(self, max_retries=None, base_delay=None, max_delay=None):
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('UBER_MAX_RETRIES', DEFAULT_MAX_RETRIES))
+        self.base_delay = base_delay if base_delay is not None else float(os.getenv('UBER_RETRY_BASE_DELAY', DEFAULT_RETRY_BASE_DELAY))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv('UBER_RETRY_MAX_DELAY', DEFAULT_RETRY_MAX_DELAY))
+
+    def delay(self, attempt, retry_after=None):
+
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after:
+            try:
+                return min(self.max_delay, max(backoff, float(retry_after)))
+            except ValueError:
+                pass
+        return backoff
+
+class CircuitBreaker:
+    """
+    Stops calls to an upstream after `failure_threshold` consecutive failures. After
+    `reset_timeout` seconds a single trial call is let through: success closes the
+    circuit, another failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        self.failure_threshold = failure_threshold if failure_threshold is not None else int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', DEFAULT_FAILURE_THRESHOLD))
+        self.reset_timeout = reset_timeout if reset_timeout is not None else float(os.getenv('CIRCUIT_RESET_TIMEOUT', DEFAULT_RESET_TIMEOUT))
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+
+        if self.failure_threshold <= 0:
+            return True
+
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def release_trial(self):
+        """End a half-open trial whose outcome says nothing about the upstream's health"""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        """Count a failure; returns True when this failure opened the circuit"""
+        if self.failure_threshold <= 0:
+            return False
+
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.trial_in_flight = False
+                return True
+            return False
+
+class LatencyTracker:
+    """Recent request latencies of one upstream, used to pick the hedging delay"""
+
+    def __init__(self, window=500):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+
+        with self.lock:
+            self.samples.append(seconds)
+
+    def quantile(self, q, min_samples=DEFAULT_HEDGE_MIN_SAMPLES):
+        """Latency quantile of the window, or None until enough samples were seen"""
+        with self.lock:
+            if len(self.samples) < min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def get_circuit_breaker(host):
+
+    with _registry_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker()
+        return breaker
+
+def get_latency_tracker(host):
+
+    with _registry_lock:
+        tracker = _latency_trackers.get(host)
+        if tracker is None:
+            tracker = _latency_trackers[host] = LatencyTracker()
+        return tracker
+
+def hedging_enabled():
+    return os.getenv('HEDGE_REQUESTS', '').lower() in ('1', 'true', 'yes')
+
+def get_hedge_delay(host):
+    """Seconds to wait for a response before sending a duplicate (the HEDGE_QUANTILE latency), or None"""
+    quantile = float(os.getenv('HEDGE_QUANTILE', DEFAULT_HEDGE_QUANTILE))
+    return get_latency_tracker(host).quantile(quantile)
+
+def _get_hedge_executor():
+
+    global _hedge_executor
+    with _registry_lock:
+        if _hedge_executor is None:
+            # Room for a primary and a hedge for every route in flight
+            _hedge_executor = ThreadPoolExecutor(max_workers=2 * int(os.getenv('FETCH_CONCURRENCY', 8)))
+        return _hedge_executor
+
+def hedged_call(func, delay, accept=lambda result: True):
+    """
+    Call func() and, if it has not returned after `delay` seconds, call it a second time
+    in parallel. Returns (result, hedge_won) for the first result that passes accept(), or
+    the last outcome when neither does. The slower call is left to finish on its own.
+    """
+    executor = _get_hedge_executor()
+    primary = executor.submit(func)
+    try:
+        return primary.result(timeout=delay), False
+    except FutureTimeoutError:
+        pass
+
+    pending = {primary, executor.submit(func)}
+    last = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            last = future
+            if future.exception() is None and accept(future.result()):
+                return future.result(), future is not primary
+    return last.result(), last is not primary
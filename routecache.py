@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+
+DEFAULT_TTL = 60
+DEFAULT_PRECISION = 4          # decimal places of latitude/longitude, 4 is roughly 11 m
+DEFAULT_MAX_ENTRIES = 10000
+
+class RouteCache:
+    """
+    Short-lived cache of Products responses keyed by quantized pickup and dropoff
+    coordinates. Concurrent lookups of the same key while a fetch is in flight wait
+    for that fetch instead of sending their own request.
+    """
+
+    def __init__(self, ttl=None, precision=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl if ttl is not None else float(os.getenv('ROUTE_CACHE_TTL', DEFAULT_TTL))
+        self.precision = precision if precision is not None else int(os.getenv('ROUTE_CACHE_PRECISION', DEFAULT_PRECISION))
+        self.max_entries = max_entries
+        self.entries = {}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def key(self, origin_coords, destination_coords):
+
+        return (
+            round(origin_coords['latitude'], self.precision),
+            round(origin_coords['longitude'], self.precision),
+            round(destination_coords['latitude'], self.precision),
+            round(destination_coords['longitude'], self.precision),
+        )
+
+    def get_or_fetch(self, origin_coords, destination_coords, fetch):
+        """Return the cached response for the route, or call fetch() once for all concurrent callers"""
+        key = self.key(origin_coords, destination_coords)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = Future()
+                self.in_flight[key] = future
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.in_flight[key]
+            # Failures are shared with callers already waiting but never cached
+            if value is not None and self.ttl > 0:
+                self._evict_expired()
+                self.entries[key] = (time.monotonic() + self.ttl, value)
+        future.set_result(value)
+        return value
+
+    def _evict_expired(self):
+
+        if len(self.entries) < self.max_entries:
+            return
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self.entries.items() if expires_at <= now]:
+            del self.entries[key]
+        while len(self.entries) >= self.max_entries:
+            del self.entries[next(iter(self.entries))]
+
+    def stats(self):
+
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'entries': len(self.entries),
+            }
@@ -0,0 +1,135 @@
+import json
+import math
+import os
+
+
+DEFAULT_MIN_REFRESH_SECONDS = 6 * 3600
+DEFAULT_SURGE_WEIGHT = 1.0
+DEFAULT_ALPHA = 0.3
+# Assumed volatility (log fare change per square-root hour) of a route seen only once
+DEFAULT_VOLATILITY = 0.05
+
+def route_key(origin, destination):
+    return f"{origin}:{destination}"
+
+def summarize_rows(rows):
+    """Mean fare and mean surge (|fare / originalFare - 1|) over the products of one route"""
+    fares = [row['fare'] for row in rows if row.get('fare')]
+    surges = [abs(row['fare'] / row['originalFare'] - 1) for row in rows if row.get('fare') and row.get('originalFare')]
+    if not fares:
+        return None, None
+    return sum(fares) / len(fares), (sum(surges) / len(surges) if surges else 0.0)
+
+class RouteScheduler:
+    """
+    Spends a fixed per-run request budget on the routes whose fares are most likely to
+    have moved. Each route keeps an exponentially weighted variance of its log fare change
+    per hour and a surge level; its score is the expected fare drift since it was last
+    fetched plus the weighted surge level. Routes that were never fetched or are older
+    than `min_refresh_seconds` are always included, even beyond the budget.
+    """
+
+    def __init__(self, budget, min_refresh_seconds=None, surge_weight=None, alpha=None, state=None):
+        self.budget = budget
+        self.min_refresh_seconds = min_refresh_seconds if min_refresh_seconds is not None else float(os.getenv('SCHEDULER_MIN_REFRESH_SECONDS', DEFAULT_MIN_REFRESH_SECONDS))
+        self.surge_weight = surge_weight if surge_weight is not None else float(os.getenv('SCHEDULER_SURGE_WEIGHT', DEFAULT_SURGE_WEIGHT))
+        self.alpha = alpha if alpha is not None else float(os.getenv('SCHEDULER_ALPHA', DEFAULT_ALPHA))
+        self.routes = state or {}
+
+    def score(self, entry, now):
+
+        age_hours = max(0.0, now - entry['last_fetched']) / 3600
+        variance_rate = entry['variance_rate'] if entry.get('samples', 1) > 1 else DEFAULT_VOLATILITY ** 2
+        return math.sqrt(variance_rate * age_hours) + self.surge_weight * entry.get('surge', 0.0)
+
+    def select(self, locations, now):
+        """Return (selected, deferred) routes; selected keeps the order of locations"""
+        if self.budget is None or len(locations) <= self.budget:
+            return list(locations), []
+
+        due = set()
+        scored = []
+        for index, (origin, destination) in enumerate(locations):
+            entry = self.routes.get(route_key(origin, destination))
+            if entry is None or now - entry['last_fetched'] >= self.min_refresh_seconds:
+                due.add(index)
+            else:
+                scored.append((-self.score(entry, now), index))
+
+        if len(due) > self.budget:
+            print(f"Warning: {len(due)} routes are due for their minimum refresh, more than the budget of {self.budget}")
+
+        chosen = set(due)
+        for _, index in sorted(scored)[:max(0, self.budget - len(due))]:
+            chosen.add(index)
+
+        selected = [route for index, route in enumerate(locations) if index in chosen]
+        deferred = [route for index, route in enumerate(locations) if index not in chosen]
+        return selected, deferred
+
+    def observe(self, origin, destination, rows, now):
+        """Update a route's volatility and surge level with the rows of a fresh fetch"""
+        fare, surge = summarize_rows(rows)
+        if fare is None:
+            return
+
+        key = route_key(origin, destination)
+        entry = self.routes.get(key)
+        if entry is None:
+            self.routes[key] = {'fare': fare, 'surge': surge, 'variance_rate': 0.0, 'samples': 1, 'last_fetched': now}
+            return
+        # A retried invocation of the same run must not count its fetch twice
+        if now <= entry['last_fetched']:
+            return
+
+        elapsed_hours = max(now - entry['last_fetched'], 60) / 3600
+        change_rate = math.log(fare / entry['fare']) ** 2 / elapsed_hours if entry['fare'] > 0 else 0.0
+        if entry['samples'] == 1:
+            entry['variance_rate'] = change_rate
+        else:
+            entry['variance_rate'] += self.alpha * (change_rate - entry['variance_rate'])
+        entry['surge'] += self.alpha * (surge - entry['surge'])
+        entry['fare'] = fare
+        entry['samples'] += 1
+        entry['last_fetched'] = now
+
+def load_scheduler_state(store, name):
+
+    try:
+        if not store.exists(name):
+            return {}
+        with store.open_read(name) as f:
+            return json.loads(f.read().decode('utf-8'))
+    except Exception as e:
+        print(f"Warning: Could not load scheduler state {name}: {str(e)}")
+        return {}
+
+def save_scheduler_state(store, name, scheduler):
+
+    try:
+        with store.open_write(name, content_type='application/json') as f:
+            f.write(json.dumps(scheduler.routes, ensure_ascii=False).encode('utf-8'))
+    except Exception as e:
+        print(f"Warning: Could not save scheduler state {name}: {str(e)}")
+
+def load_selection(store, name, run_name):
+    """Routes an earlier attempt of this run selected, or None if it was not cut short"""
+    try:
+        if not store.exists(name):
+            return None
+        with store.open_read(name) as f:
+            selection = json.loads(f.read().decode('utf-8'))
+    except Exception as e:
+        print(f"Warning: Could not load route selection {name}: {str(e)}")
+        return None
+    if selection.get('run') != run_name:
+        return None
+    return [tuple(route) for route in selection['routes']]
+
+def save_selection(store, name, run_name, routes):
+
+    try:
+        with store.open_write(name, content_type='application/json') as f:
+            f.write(json.dumps({'run': run_name, 'routes': routes}, ensure_ascii=False).encode('utf-8'))
+    except Exception as e:
+        print(f"Warning: Could not save route selection {name}: {str(e)}")
@@ -1,41 +1,63 @@
-import functions_framework
-import requests
 import json
 import pickle
 import os
-import re
-import unicodedata
+import sys
+import threading
 import urllib.parse
 import time
 from datetime import datetime
-import pandas as pd
-from google.cloud import storage
 from dotenv import load_dotenv
 from io import StringIO
+from fetcher import Deadline, fetch_routes, get_rate_limiter
+from transport import close_sessions, get_geocode_session, get_uber_session, post_body
+from queries import build_products_body
+from addresses import normalize_address
+from fares import loads, parse_csv_rows, parse_fare, parse_fare_entries
+from geocache import CACHE_BLOB_NAME, GeocodeCache, cache_sync_enabled, restore_cache
+from routecache import RouteCache
+from resilience import BLOCKED_STATUS, RETRYABLE_STATUS, RetryPolicy, get_circuit_breaker, get_hedge_delay, get_latency_tracker, hedged_call, hedging_enabled
+from cookiepool import PoolExhausted, as_cookie_pool, build_cookie_pool, load_cookie_profiles
+from scheduler import RouteScheduler, load_scheduler_state, load_selection, save_scheduler_state, save_selection
+from delta import DeltaEncoder, delta_enabled, load_delta_state, save_delta_state
+from journal import RunJournal, journal_enabled, skip_completed
+from history import ManifestBuilder, manifest_enabled, write_manifest_entry
+from archive import RawArchive, archive_enabled
+from metrics import HotPathProfiler, get_metrics, reset_metrics, timed, write_run_metrics
+from shards import compact_shards, parse_run_options, select_shard, shard_file_name
+from output import CSVStreamWriter, GCSStore, LocalStore, ParquetStreamWriter
 
 
 load_dotenv()
 
-def normalize_address(address):
-    address = address.replace(',', ' ')
-    address = unicodedata.normalize('NFKD', address).encode('ASCII', 'ignore').decode('ASCII')
-    address = re.sub(r'\s+', ' ', address).strip()
-    
-    return address
+GEOCODE_API_URL = 'https://geocode.maps.co/search'
+UBER_GRAPHQL_URL = 'https://m.uber.com/go/graphql'
 
-def geocode_address(address):
+def record_response(host, response):
+    """Count an upstream response by status code along with the bytes received"""
+    metrics = get_metrics()
+    metrics.inc('http_requests_total', host=host, status=response.status_code)
+    metrics.inc('response_bytes_total', len(response.content), host=host)
+
+def geocode_request(address):
+    """
+    Geocode an address and return (status_code, coordinates).
+    A 200 status with None coordinates means the API found no results;
+    status_code is None when the request could not be made at all.
+    """
     normalized_address = normalize_address(address)
     encoded_address = urllib.parse.quote(normalized_address)
     
     api_key = os.getenv('GEO_CODE_API_KEY')
     if not api_key:
         print("Error: GEO_CODE_API_KEY not found in environment variables")
-        return None
+        return None, None
     
-    url = f"https://geocode.maps.co/search?q={encoded_address}&api_key={api_key}"
+    base_url = os.getenv('GEOCODE_API_URL', GEOCODE_API_URL)
+    url = f"{base_url}?q={encoded_address}&api_key={api_key}"
     
     try:
-        response = requests.get(url)
+        response = get_geocode_session().get(url)
+        record_response('geocode.maps.co', response)
         
         if response.status_code == 200:
             data = response.json()
@@ -43,21 +65,25 @@ def geocode_address(address):
             if data and len(data) > 0:
                 result = data[0]
                 
-                return {
+                return response.status_code, {
                     "latitude": float(result.get("lat")),
                     "longitude": float(result.get("lon")),
                     "display_name": result.get("display_name")
                 }
             else:
                 print("No results found for the given address")
-                return None
+                return response.status_code, None
         else:
             print(f"Error: API request failed with status code {response.status_code}")
-            return None
+            return response.status_code, None
             
     except Exception as e:
+        get_metrics().inc('http_requests_total', host='geocode.maps.co', status='error')
         print(f"Error occurred during geocoding: {str(e)}")
-        return None
+        return None, None
+
+def geocode_address(address):
+    return geocode_request(address)[1]
 
 def load_uber_cookies():
     json_path = 'uber_cookies.json'
@@ -79,116 +105,128 @@ def load_uber_cookies():
         print(f"Error loading cookies: {str(e)}")
         return None
 
-def get_uber_prices(origin_coords, destination_coords, cookies):
-    headers = {
-        'accept': '*/*',
-        'accept-language': 'en-US,en;q=0.9,pl-PL;q=0.8,pl;q=0.7',
-        'content-type': 'application/json',
-        'origin': 'https://m.uber.com',
-        'priority': 'u=1, i',
-        'sec-ch-ua': '"Google Chrome";v="135", "Not-A.Brand";v="8", "Chromium";v="135"',
-        'sec-ch-ua-mobile': '?0',
-        'sec-ch-ua-platform': '"Windows"',
-        'sec-fetch-dest': 'empty',
-        'sec-fetch-mode': 'cors',
-        'sec-fetch-site': 'same-origin',
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36',
-        'x-csrf-token': 'x',
-        'x-uber-rv-initial-load-city-id': '939',
-        'x-uber-rv-session-type': 'desktop_session',
-    }
-
-    json_data = {
-        'operationName': 'Products',
-        'variables': {
-            'includeRecommended': False,
-            'destinations': [
-                {
-                    'latitude': destination_coords['latitude'],
-                    'longitude': destination_coords['longitude'],
-                },
-            ],
-            'pickup': {
-                'latitude': origin_coords['latitude'],
-                'longitude': origin_coords['longitude'],
-            },
-            'profileType': 'Personal',
-        },
-        'query': 'query Products($capacity: Int, $destinations: [InputCoordinate!]!, $includeRecommended: Boolean = false, $paymentProfileUUID: String, $pickup: InputCoordinate!, $pickupFormattedTime: String, $profileType: String, $profileUUID: String, $returnByFormattedTime: String, $stuntID: String, $targetProductType: EnumRVWebCommonTargetProductType) {\n  products(\n    capacity: $capacity\n    destinations: $destinations\n    includeRecommended: $includeRecommended\n    paymentProfileUUID: $paymentProfileUUID\n    pickup: $pickup\n    pickupFormattedTime: $pickupFormattedTime\n    profileType: $profileType\n    profileUUID: $profileUUID\n    returnByFormattedTime: $returnByFormattedTime\n    stuntID: $stuntID\n    targetProductType: $targetProductType\n  ) {\n    ...ProductsFragment\n    __typename\n  }\n}\n\nfragment ProductsFragment on RVWebCommonProductsResponse {\n  defaultVVID\n  hourlyTiersWithMinimumFare {\n    ...HourlyTierFragment\n    __typename\n  }\n  intercity {\n    ...IntercityFragment\n    __typename\n  }\n  links {\n    iFrame\n    text\n    url\n    __typename\n  }\n  productsUnavailableMessage\n  tiers {\n    ...TierFragment\n    __typename\n  }\n  __typename\n}\n\nfragment BadgesFragment on RVWebCommonProductBadge {\n  color\n  text\n  __typename\n}\n\nfragment HourlyTierFragment on RVWebCommonHourlyTier {\n  description\n  distance\n  fare\n  fareAmountE5\n  farePerHour\n  minutes\n  packageVariantUUID\n  preAdjustmentValue\n  __typename\n}\n\nfragment IntercityFragment on RVWebCommonIntercityInfo {\n  oneWayIntercityConfig(destinations: $destinations, pickup: $pickup) {\n    ...IntercityConfigFragment\n    __typename\n  }\n  roundTripIntercityConfig(destinations: $destinations, pickup: $pickup) {\n    ...IntercityConfigFragment\n    __typename\n  }\n  __typename\n}\n\nfragment IntercityConfigFragment on RVWebCommonIntercityConfig {\n  description\n  onDemandAllowed\n  reservePickup {\n    ...IntercityTimePickerFragment\n    __typename\n  }\n  returnBy {\n    ...IntercityTimePickerFragment\n    __typename\n  }\n  __typename\n}\n\nfragment IntercityTimePickerFragment on RVWebCommonIntercityTimePicker {\n  bookingRange {\n    maximum\n    minimum\n    __typename\n  }\n  header {\n    subTitle\n    title\n    __typename\n  }\n  __typename\n}\n\nfragment TierFragment on RVWebCommonProductTier {\n  products {\n    ...ProductFragment\n    __typename\n  }\n  title\n  __typename\n}\n\nfragment ProductFragment on RVWebCommonProduct {\n  badges {\n    ...BadgesFragment\n    __typename\n  }\n  cityID\n  currencyCode\n  description\n  detailedDescription\n  discountPrimary\n  displayName\n  estimatedTripTime\n  etaStringShort\n  fares {\n    capacity\n    discountPrimary\n    fare\n    fareAmountE5\n    hasPromo\n    hasRidePass\n    meta\n    preAdjustmentValue\n    __typename\n  }\n  hasPromo\n  hasRidePass\n  hasBenefitsOnFare\n  hourly {\n    tiers {\n      ...HourlyTierFragment\n      __typename\n    }\n    overageRates {\n      ...HourlyOverageRatesFragment\n      __typename\n    }\n    __typename\n  }\n  iconType\n  id\n  is3p\n  isAvailable\n  legalConsent {\n    ...ProductLegalConsentFragment\n    __typename\n  }\n  parentProductUuid\n  preAdjustmentValue\n  productImageUrl\n  productUuid\n  reserveEnabled\n  __typename\n}\n\nfragment ProductLegalConsentFragment on RVWebCommonProductLegalConsent {\n  header\n  image {\n    url\n    width\n    __typename\n  }\n  description\n  enabled\n  ctaUrl\n  ctaDisplayString\n  buttonLabel\n  showOnce\n  shouldBlockRequest\n  __typename\n}\n\nfragment HourlyOverageRatesFragment on RVWebCommonHourlyOverageRates {\n  perDistanceUnit\n  perTemporalUnit\n  __typename\n}\n',
-    }
+def load_cookie_pool():
+    """
+    Pool of the cookie profiles in UBER_COOKIE_DIR (collected with `uber_cookies.py --profile NAME`),
+    or of the single uber_cookies.pkl/json when there are none
+    """
+    profiles = load_cookie_profiles()
+    if profiles:
+        print(f"Loaded {len(profiles)} cookie profiles: {', '.join(profiles)}")
+    else:
+        cookies = load_uber_cookies()
+        if not cookies:
+            return None
+        profiles = {'default': cookies}
+    return build_cookie_pool(profiles)
 
+def send_price_request(body, cookie_pool):
+    """One POST to the Products endpoint through the next session of the pool, under that account's rate limit"""
+    session = cookie_pool.acquire()
+    status_code = None
     try:
-        response = requests.post(
-            'https://m.uber.com/go/graphql', 
-            headers=headers, 
-            cookies=cookies, 
-            json=json_data,
-            timeout=30
-        )
+        session.limiter.acquire()
         
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"Error: API request failed with status code {response.status_code}")
-            print(f"Response: {response.text[:500]}...")
-            return None
-    except Exception as e:
-        print(f"Error occurred during price request: {str(e)}")
-        return None
+        started = time.monotonic()
+        response = post_body(
+            get_uber_session(session.cookies),
+            os.getenv('UBER_GRAPHQL_URL', UBER_GRAPHQL_URL),
+            body,
+            timeout=float(os.getenv('UBER_REQUEST_TIMEOUT', 30))
+        )
+        status_code = response.status_code
+        record_response('m.uber.com', response)
+        if status_code == 200:
+            get_latency_tracker('m.uber.com').observe(time.monotonic() - started)
+        return response
+    finally:
+        get_metrics().inc('cookie_requests_total', profile=session.name, status=status_code or 'error')
+        reason = cookie_pool.release(session, status_code)
+        if reason:
+            get_metrics().inc('cookie_quarantined_total', profile=session.name, reason=reason)
+            print(f"Quarantining cookie profile '{session.name}' ({reason})")
 
-def extract_price_data(raw_data):
+def request_prices_once(body, cookie_pool):
+    """Send the request, hedged with a duplicate after the p95 latency when HEDGE_REQUESTS is set"""
+    if hedging_enabled():
+        delay = get_hedge_delay('m.uber.com')
+        if delay is not None:
+            response, hedge_won = hedged_call(
+                lambda: send_price_request(body, cookie_pool),
+                delay,
+                accept=lambda response: response.status_code == 200
+            )
+            if hedge_won:
+                get_metrics().inc('hedge_wins_total', host='m.uber.com')
+            return response
+    return send_price_request(body, cookie_pool)
 
-    result = []
+@timed('get_uber_prices')
+def get_uber_prices(origin_coords, destination_coords, cookies, query_profile=None):
+    """Fetch the Products response for a route; cookies is a CookiePool or a single cookie dict"""
+    body = build_products_body(origin_coords, destination_coords, query_profile)
+    cookie_pool = as_cookie_pool(cookies)
+    breaker = get_circuit_breaker('m.uber.com')
+    retry_policy = RetryPolicy()
     
-    try:
-        tiers = raw_data.get('data', {}).get('products', {}).get('tiers', [])
+    for attempt in range(retry_policy.max_retries + 1):
+        if not breaker.allow():
+            get_metrics().inc('circuit_rejected_total', host='m.uber.com')
+            print("Skipping price request: circuit open after repeated Uber failures")
+            return None
         
-        for tier in tiers:
-            tier_title = tier.get('title', '')
-            products = tier.get('products', [])
+        retry_after = None
+        # Every way out of the attempt ends a half-open trial; record_success and record_failure
+        # have already done so when the upstream's health was judged
+        try:
+            try:
+                response = request_prices_once(body, cookie_pool)
+                status_code = response.status_code
+                # A malformed body fails the attempt like a transport error
+                if status_code == 200:
+                    prices = loads(response.content)
+            except PoolExhausted as e:
+                get_metrics().inc('cookie_pool_exhausted_total')
+                print(f"Skipping price request: {str(e)}")
+                return None
+            except Exception as e:
+                get_metrics().inc('http_requests_total', host='m.uber.com', status='error')
+                print(f"Error occurred during price request: {str(e)}")
+                status_code = None
+            else:
+                if status_code == 200:
+                    breaker.record_success()
+                    return prices
             
-            for product in products:
-                name = product.get('displayName', '')
-                description = product.get('detailedDescription', '')
-                eta = product.get('etaStringShort', '')
-                estimated_trip_time = product.get('estimatedTripTime', 0)
-                
-                trip_minutes = int(estimated_trip_time / 60) if estimated_trip_time else 0
-                
-                fares = product.get('fares', [])
-                
-                for fare in fares:
-                    fare_str = fare.get('fare', '')
-                    fare_parts = fare_str.split('\u00a0')
-                    currency = fare_parts[0] if len(fare_parts) > 0 else ''
-                    fare_value = float(fare_parts[1]) if len(fare_parts) > 1 else 0.0
-                    
-                    pre_adjustment_str = fare.get('preAdjustmentValue', '')
-                    pre_adjustment_parts = pre_adjustment_str.split('\u00a0')
-                    pre_adjustment_value = float(pre_adjustment_parts[1]) if len(pre_adjustment_parts) > 1 else 0.0
-                    
-                    discount = fare.get('discountPrimary', '')
-                    has_promo = fare.get('hasPromo', False)
-                    capacity = fare.get('capacity', 0)
-                    
-                    entry = {
-                        'tier': tier_title,
-                        'name': name,
-                        'description': description,
-                        'currency': currency,
-                        'fare': fare_value,
-                        'originalFare': pre_adjustment_value,
-                        'discount': discount,
-                        'hasPromo': has_promo,
-                        'capacity': capacity,
-                        'eta': eta,
-                        'estimatedTripMinutes': trip_minutes
-                    }
-                    
-                    result.append(entry)
+                print(f"Error: API request failed with status code {status_code}")
+                print(f"Response: {response.text[:500]}...")
+                retry_after = response.headers.get('Retry-After')
+            
+            # The refused account is quarantined by the pool, the next one is tried straight away
+            if status_code in BLOCKED_STATUS and cookie_pool.available_count():
+                continue
+            
+            # Other 4xx answers are about this request, not the upstream's health
+            if status_code is None or status_code in RETRYABLE_STATUS or status_code in BLOCKED_STATUS:
+                if breaker.record_failure():
+                    get_metrics().inc('circuit_opened_total', host='m.uber.com')
+                    print(f"Opening circuit for m.uber.com for {breaker.reset_timeout:.0f}s")
+            
+            if status_code is not None and status_code not in RETRYABLE_STATUS:
+                return None
+        finally:
+            breaker.release_trial()
         
-        return result
+        if attempt < retry_policy.max_retries:
+            get_metrics().inc('retries_total', stage='get_uber_prices')
+            time.sleep(retry_policy.delay(attempt, retry_after))
     
+    return None
+
+def extract_price_data(raw_data):
+
+    try:
+        return parse_fare_entries(raw_data)
     except Exception as e:
         print(f"Error extracting price data: {str(e)}")
         return []
@@ -213,75 +251,104 @@ def save_results(origin, destination, price_data, filename=None):
     print(f"Results saved to {filename}")
 
 def read_locations(filename='locations.txt'):
-
+    """
+    Read origin:destination routes, highest priority first. An optional third field
+    (origin:destination:priority) ranks a route; routes without one have priority 0
+    and keep their order in the file.
+    """
     locations = []
     try:
         with open(filename, 'r', encoding='utf-8') as f:
             for line in f:
                 line = line.strip()
                 if line:  # Skip empty lines
-                    origin, destination = line.split(':')
-                    locations.append((origin.strip(), destination.strip()))
-        return locations
+                    parts = line.split(':')
+                    priority = float(parts.pop()) if len(parts) == 3 else 0.0
+                    origin, destination = parts
+                    locations.append((priority, origin.strip(), destination.strip()))
+        locations.sort(key=lambda location: -location[0])
+        return [(origin, destination) for _, origin, destination in locations]
     except Exception as e:
         print(f"Error reading locations file: {str(e)}")
         return []
 
 def clean_fare(fare_str):
     """Helper function to clean fare strings and extract numeric value"""
-    if not fare_str:
-        return 0.0
-    fare_str = str(fare_str).replace('\xa0', ' ')
-    fare_str = ''.join(c for c in fare_str if c.isdigit() or c == '.')
-    try:
-        return float(fare_str)
-    except ValueError:
-        print(f"Warning: Could not parse fare value: {fare_str}")
-        return 0.0
-    
+    return parse_fare(fare_str)
+
+CSV_COLUMN_TYPES = {
+    'timestamp': 'int64',
+    'datetime': 'string',
+    'origin': 'string',
+    'destination': 'string',
+    'tier': 'string',
+    'name': 'string',
+    'description': 'string',
+    'currency': 'string',
+    'fare': 'float64',
+    'originalFare': 'float64',
+    'discount': 'string',
+    'hasPromo': 'bool',
+    'capacity': 'int64',
+    'eta': 'string',
+    'estimatedTripMinutes': 'int64',
+}
 
+CSV_COLUMNS = list(CSV_COLUMN_TYPES)
+
+# Low-cardinality columns that repeat on every row
+DICTIONARY_COLUMNS = ['origin', 'destination', 'tier', 'name', 'description', 'currency']
+
+@timed('format_price_data_for_csv')
 def format_price_data_for_csv(origin, destination, raw_data, timestamp, formatted_datetime):
 
-    formatted_data = []
     try:
-        tiers = raw_data.get('data', {}).get('products', {}).get('tiers', [])
-        
-        for tier in tiers:
-            
-            products = tier.get('products', [])
-            
-            for product in products:
-                #print(product)  # Debug print
-
-                eta_raw = product.get('etaStringShort', '')
-                eta = eta_raw.split(' ')[-1] if eta_raw else ''
-                
-                fares = product.get('fares', [{}])[0]
-                fare = clean_fare(fares.get('fare', '0'))
-   
-                row = {
-                    'timestamp': timestamp,
-                    'datetime': formatted_datetime,
-                    'origin': origin,
-                    'destination': destination,
-                    'tier': tier.get('title', ''),
-                    'name': product.get('displayName', ''),
-                    'description': product.get('description', ''),
-                    'currency': product.get('currencyCode', ''),
-                    'fare': fare,
-                    'originalFare': clean_fare(fares.get('preAdjustmentValue', fare)),
-                    'discount': fares.get('discountPrimary', ''),
-                    'hasPromo': fares.get('hasPromo', False),
-                    'capacity': fares.get('capacity', 0),
-                    'eta': eta,
-                    'estimatedTripMinutes': product.get('estimatedTripTime', 0)
-                }
-                formatted_data.append(row)
-                
+        return parse_csv_rows(raw_data, origin, destination, timestamp, formatted_datetime)
     except Exception as e:
         print(f"Error formatting price data: {str(e)}")
+        return []
+
+# Objects kept across warm invocations of the function; failed setups are not kept
+_warm_state = {}
+_warm_state_lock = threading.RLock()
+
+def get_warm(name, factory):
+
+    with _warm_state_lock:
+        if name not in _warm_state:
+            value = factory()
+            if value is None:
+                return None
+            _warm_state[name] = value
+        return _warm_state[name]
+
+def invalidate_warm_state(*names):
+    """Drop memoized objects by name (e.g. 'cookie_pool', 'gcs_client'), or everything when no name is given"""
+    with _warm_state_lock:
+        if names:
+            dropped = {name: _warm_state.pop(name, None) for name in names}
+        else:
+            dropped = dict(_warm_state)
+            _warm_state.clear()
     
-    return formatted_data
+    geocode_cache = dropped.get('geocode_cache')
+    if geocode_cache is not None:
+        geocode_cache.close()
+    # Pooled Uber sessions carry the cookies of the pool they were opened for
+    if not names or 'cookie_pool' in names:
+        close_sessions()
+
+def open_geocode_cache(store=None):
+    """
+    Open the SQLite geocode cache. A fresh instance first fetches the copy persisted to the
+    output store, which also records the locations.json import, so the JSON is not parsed
+    on every cold start.
+    """
+    if store is not None and cache_sync_enabled():
+        restore_cache(store)
+    geocode_cache = GeocodeCache()
+    geocode_cache.import_json('locations.json')
+    return geocode_cache
 
 def setup_gcs_client():
 
@@ -289,6 +356,7 @@ def setup_gcs_client():
         credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
         if credentials_path and os.path.exists(credentials_path):
             print(f"Using credentials from: {credentials_path}")
+            from google.cloud import storage
             return storage.Client()
         
         print("Error: Google Cloud credentials not found. Please ensure one of the following:")
@@ -301,25 +369,54 @@ def setup_gcs_client():
         print(f"Error setting up GCS client: {str(e)}")
         return None
 
-def upload_to_gcs(bucket_name, data_frame, destination_blob_name):
+def report_gcs_error(e):
 
-    try:
-        storage_client = setup_gcs_client()
-        if not storage_client:
-            return False
-            
-        buckets = list(storage_client.list_buckets())
-        bucket_names = [bucket.name for bucket in buckets]
-        
-        if bucket_name not in bucket_names:
-            print(f"\nError: Bucket '{bucket_name}' not found!")
+    if "403" in str(e):
+        print("\nError: Permission denied. Please check that your service account has the following roles:")
+        print("- Storage Object Creator (storage.objects.create)")
+        print("- Storage Object Viewer (storage.objects.get)")
+        print("- Storage Bucket Viewer (storage.buckets.get)")
+    elif "404" in str(e):
+        print("\nError: Resource not found. Please check your bucket name and permissions.")
+    else:
+        print(f"\nError uploading to GCS: {str(e)}")
+
+def get_bucket(storage_client, bucket_name):
+    """Check that the bucket exists with a single metadata lookup instead of listing the project"""
+    bucket = storage_client.lookup_bucket(bucket_name)
+    
+    if bucket is None:
+        print(f"\nError: Bucket '{bucket_name}' not found!")
+        try:
+            bucket_names = [bucket.name for bucket in storage_client.list_buckets()]
             print("\nAvailable buckets in your project:")
             for name in bucket_names:
                 print(f"- {name}")
-            print("\nPlease update your GCS_BUCKET_NAME in .env to one of these bucket names.")
+        except Exception:
+            pass
+        print("\nPlease update your GCS_BUCKET_NAME in .env to one of these bucket names.")
+        return None
+    
+    return bucket
+
+def get_warm_bucket(bucket_name):
+    """Validated bucket handle, looked up once per instance"""
+    def validate_bucket():
+        storage_client = get_warm('gcs_client', setup_gcs_client)
+        if not storage_client:
+            return None
+        return get_bucket(storage_client, bucket_name)
+    
+    return get_warm(('bucket', bucket_name), validate_bucket)
+
+@timed('upload_to_gcs')
+def upload_to_gcs(bucket_name, data_frame, destination_blob_name):
+
+    try:
+        bucket = get_warm_bucket(bucket_name)
+        if bucket is None:
             return False
             
-        bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(destination_blob_name)
 
         csv_buffer = StringIO()
@@ -331,100 +428,430 @@ def upload_to_gcs(bucket_name, data_frame, destination_blob_name):
         return True
         
     except Exception as e:
-        if "403" in str(e):
-            print("\nError: Permission denied. Please check that your service account has the following roles:")
-            print("- Storage Object Creator (storage.objects.create)")
-            print("- Storage Object Viewer (storage.objects.get)")
-            print("- Storage Bucket Viewer (storage.buckets.get)")
-        elif "404" in str(e):
-            print("\nError: Resource not found. Please check your bucket name and permissions.")
-        else:
-            print(f"\nError uploading to GCS: {str(e)}")
+        report_gcs_error(e)
         return False
 
-def get_coordinates(address, cached_locations=None):
+def get_output_store(bucket_name):
+    """Return the store results are written to: OUTPUT_DIR if set (local stand-in), otherwise the GCS bucket"""
+    output_dir = os.getenv('OUTPUT_DIR')
+    if output_dir:
+        print(f"Writing output to local directory: {output_dir}")
+        return LocalStore(output_dir)
+    
+    try:
+        bucket = get_warm_bucket(bucket_name)
+        if bucket is None:
+            return None
+        
+        return GCSStore(bucket)
+    
+    except Exception as e:
+        report_gcs_error(e)
+        return None
 
-    if cached_locations and address in cached_locations:
-        print(f"Using cached coordinates for: {address}")
-        return cached_locations[address]
+def get_run_timestamp(run_time=None):
+
+    current_time = run_time if run_time is not None else time.time()
+    timestamp = int(current_time) + 7200  # Adding 2 hours (7200 seconds)
+    formatted_datetime = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+    return timestamp, formatted_datetime
+
+def build_run_name(timestamp, formatted_datetime):
+    """Partition output by date, e.g. 2025/06/01/1748779200_2025-06-01 14:00:00"""
+    run_date = datetime.fromtimestamp(timestamp)
+    return f"{run_date:%Y/%m/%d}/{timestamp}_{formatted_datetime}"
+
+def shard_suffix(shard_index=0, shard_count=1):
+    return f"-shard-{shard_index:04d}-of-{shard_count:04d}" if shard_count > 1 else ''
+
+def build_blob_name(timestamp, formatted_datetime, extension, shard_index=0, shard_count=1):
+    """Blob for a run; sharded runs write one blob per shard under a directory named after the run"""
+    run_name = build_run_name(timestamp, formatted_datetime)
+    if shard_count > 1:
+        return f"{run_name}/{shard_file_name(shard_index, shard_count, extension)}"
+    return f"{run_name}.{extension}"
+
+def create_output_writer(store, timestamp, formatted_datetime, shard_index=0, shard_count=1, delta=False):
+    """Writer for the run's output; delta runs carry an extra `op` column (full/upsert/delete)"""
+    output_format = os.getenv('OUTPUT_FORMAT', 'csv').lower()
+    # Every shard writes a blob, even an empty one, so compaction can tell when all have finished
+    always_create = shard_count > 1
+    column_types = dict(CSV_COLUMN_TYPES, op='string') if delta else CSV_COLUMN_TYPES
+    
+    if output_format == 'parquet':
+        blob_name = build_blob_name(timestamp, formatted_datetime, 'parquet', shard_index, shard_count)
+        dictionary_columns = DICTIONARY_COLUMNS + ['op'] if delta else DICTIONARY_COLUMNS
+        return ParquetStreamWriter(store, blob_name, column_types, dictionary_columns, always_create=always_create)
+    
+    if output_format != 'csv':
+        print(f"Warning: Unknown OUTPUT_FORMAT '{output_format}', writing CSV")
+    
+    compress = os.getenv('OUTPUT_GZIP', '').lower() in ('1', 'true', 'yes')
+    blob_name = build_blob_name(timestamp, formatted_datetime, 'csv.gz' if compress else 'csv', shard_index, shard_count)
+    return CSVStreamWriter(store, blob_name, list(column_types), compress, always_create=always_create)
+
+@timed('get_coordinates')
+def get_coordinates(address, geocode_cache=None):
+
+    if geocode_cache is not None:
+        cached, coords = geocode_cache.lookup(address)
+        if cached:
+            if coords is None:
+                get_metrics().inc('geocode_cache_total', result='negative')
+                print(f"Skipping address cached as not found: {address}")
+            else:
+                get_metrics().inc('geocode_cache_total', result='hit')
+                print(f"Using cached coordinates for: {address}")
+            return coords
+        get_metrics().inc('geocode_cache_total', result='miss')
+        
+        match = geocode_cache.fuzzy_lookup(address)
+        if match is not None:
+            coords, matched_address, similarity = match
+            kind = 'normalized' if similarity == 1.0 else 'fuzzy'
+            get_metrics().inc('geocode_calls_saved_total', match=kind)
+            print(f"Using cached coordinates of '{matched_address}' for: {address} ({kind} match, similarity {similarity:.2f})")
+            # Kept under this spelling too, so the next run hits the exact key
+            geocode_cache.store(address, coords)
+            return coords
     
     print(f"Geocoding address: {address}")
-    return geocode_address(address)
+    get_rate_limiter('geocode.maps.co').acquire()
+    status_code, coords = geocode_request(address)
+    
+    # Only a successful "no results" answer is cached as negative, errors are retried next time
+    if geocode_cache is not None and status_code == 200:
+        geocode_cache.store(address, coords)
+    
+    return coords
+
+def report_run_metrics(metrics, store, route_cache, run_info, profiler=None):
+    """
+    Print the per-stage latency summary and write the JSON summary and Prometheus text
+    file to METRICS_DIR and, with METRICS_UPLOAD set, next to the output under metrics/
+    """
+    cache_stats = route_cache.stats()
+    for result, key in (('hit', 'hits'), ('miss', 'misses'), ('coalesced', 'coalesced')):
+        if cache_stats[key]:
+            metrics.inc('route_cache_total', cache_stats[key], result=result)
+    print(f"Route cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['coalesced']} coalesced")
+    saved = {kind: metrics.counter_value('geocode_calls_saved_total', match=kind) for kind in ('normalized', 'fuzzy')}
+    if any(saved.values()):
+        print(f"Address index: saved {sum(saved.values())} geocode calls ({saved['normalized']} normalized, {saved['fuzzy']} fuzzy matches)")
+    metrics.print_summary()
+    
+    suffix = shard_suffix(run_info['shard_index'], run_info['shard_count'])
+    upload = os.getenv('METRICS_UPLOAD', '').lower() in ('1', 'true', 'yes')
+    try:
+        for location in write_run_metrics(metrics, run_info, suffix, os.getenv('METRICS_DIR'), store if upload else None):
+            print(f"Run metrics written to {location}")
+    except Exception as e:
+        print(f"Warning: Could not write run metrics: {str(e)}")
+    
+    profile_output = os.getenv('PROFILE_OUTPUT')
+    if profiler is not None and profile_output:
+        profiler.dump(profile_output)
 
-def start():
+def skipped_routes_blob_name(run_info):
+    return f"skipped/{run_info['run_name']}{shard_suffix(run_info['shard_index'], run_info['shard_count'])}.json"
+
+def clear_skipped_routes(store, run_info):
+
+    blob_name = skipped_routes_blob_name(run_info)
+    try:
+        if store.exists(blob_name):
+            store.delete(blob_name)
+    except Exception as e:
+        print(f"Warning: Could not remove skipped routes record {blob_name}: {str(e)}")
+
+def record_skipped_routes(store, run_info, skipped):
+    """Write the routes a deadline-limited run did not reach to skipped/{run_name}{suffix}.json"""
+    blob_name = skipped_routes_blob_name(run_info)
+    content = json.dumps({
+        'run_name': run_info['run_name'],
+        'shard_index': run_info['shard_index'],
+        'shard_count': run_info['shard_count'],
+        'routes': [{'origin': origin, 'destination': destination} for origin, destination in skipped],
+    }, ensure_ascii=False, indent=2)
+    
+    try:
+        with store.open_write(blob_name, content_type='application/json') as f:
+            f.write(content.encode('utf-8'))
+        print(f"Deadline reached: {len(skipped)} routes skipped, listed in {store.uri(blob_name)}")
+    except Exception as e:
+        print(f"Warning: Could not record skipped routes: {str(e)}")
+
+def start(shard_index=0, shard_count=1, run_time=None, deadline_seconds=None):
 
     print("Starting Uber price collector")
     print("--------------------------")
     
-    required_env_vars = ['GEO_CODE_API_KEY', 'GCS_BUCKET_NAME']
+    metrics = reset_metrics()
+    
+    # Time budget of the invocation, e.g. a little under the function timeout
+    if deadline_seconds is None and os.getenv('RUN_DEADLINE_SECONDS'):
+        deadline_seconds = float(os.getenv('RUN_DEADLINE_SECONDS'))
+    deadline = Deadline(deadline_seconds) if deadline_seconds else None
+    
+    if not 0 <= shard_index < shard_count:
+        print(f"Error: Invalid shard {shard_index} of {shard_count}")
+        return
+    
+    required_env_vars = ['GEO_CODE_API_KEY'] if os.getenv('OUTPUT_DIR') else ['GEO_CODE_API_KEY', 'GCS_BUCKET_NAME']
     missing_vars = [var for var in required_env_vars if not os.getenv(var)]
     if missing_vars:
         print(f"Error: Missing required environment variables: {', '.join(missing_vars)}")
         print("Please set them in your .env file")
         return
     
-    cookies = load_uber_cookies()
+    cookies = get_warm('cookie_pool', load_cookie_pool)
     if not cookies:
         return
     
-    cached_locations = {}
-    if os.path.exists('locations.json'):
-        try:
-            with open('locations.json', 'r', encoding='utf-8') as f:
-                cached_locations = json.load(f)
-            print(f"Loaded {len(cached_locations)} cached locations from locations.json")
-        except Exception as e:
-            print(f"Warning: Could not load locations.json: {str(e)}")
-    
     locations = read_locations()
     if not locations:
         print("No locations found in locations.txt")
         return
     
-    current_time = time.time()
-    timestamp = int(current_time) + 7200  # Adding 2 hours (7200 seconds)
-    formatted_datetime = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+    if shard_count > 1:
+        if run_time is None:
+            print("Warning: Sharded run without run_time, shards will not share one output directory")
+        locations = select_shard(locations, shard_index, shard_count)
+        print(f"Shard {shard_index + 1} of {shard_count}: {len(locations)} routes")
     
-    csv_filename = f"{timestamp}_{formatted_datetime}.csv"
+    timestamp, formatted_datetime = get_run_timestamp(run_time)
     
-    all_price_data = []
+    store = get_output_store(os.getenv('GCS_BUCKET_NAME'))
+    if store is None:
+        return
+    
+    geocode_cache = get_warm('geocode_cache', lambda: open_geocode_cache(store))
+    
+    # Delta runs write only the rows that changed since the previous snapshot, plus keyframes
+    delta_encoder = None
+    if delta_enabled():
+        delta_state_name = f"delta/state{shard_suffix(shard_index, shard_count)}.json"
+        delta_encoder = DeltaEncoder(load_delta_state(store, delta_state_name))
+    
+    writer = create_output_writer(store, timestamp, formatted_datetime, shard_index, shard_count, delta=delta_encoder is not None)
+    # Indexes what the blob holds so history reads can skip the blobs they do not need
+    manifest = ManifestBuilder() if manifest_enabled() else None
+    # Raw responses are kept so a parser or schema change can be backfilled without refetching
+    archive = RawArchive(store, build_run_name(timestamp, formatted_datetime), timestamp, formatted_datetime, shard_index, shard_count) if archive_enabled() else None
+    
+    def emit_rows(origin_addr, dest_addr, rows):
+        """Write a route's rows, as change records in a delta run; returns what was written"""
+        if delta_encoder is not None:
+            rows = delta_encoder.encode(origin_addr, dest_addr, rows, timestamp)
+        write_output_rows(rows)
+        return rows
+    
+    def write_output_rows(rows):
+        writer.write_rows(rows)
+        if manifest is not None:
+            manifest.add(rows)
     
-    for origin_addr, dest_addr in locations:
+    run_name = build_run_name(timestamp, formatted_datetime)
+    
+    # With a request budget, stable routes are fetched less often than volatile ones
+    scheduler = None
+    if os.getenv('SCHEDULER_BUDGET'):
+        scheduler_state_name = f"scheduler/state{shard_suffix(shard_index, shard_count)}.json"
+        selection_name = f"scheduler/selection{shard_suffix(shard_index, shard_count)}.json"
+        scheduler = RouteScheduler(int(os.getenv('SCHEDULER_BUDGET')), state=load_scheduler_state(store, scheduler_state_name))
+        # A resumed run keeps the routes its first attempt chose, which the state saved since ranks lower
+        selection = load_selection(store, selection_name, run_name)
+        if selection is not None:
+            chosen = set(selection)
+            deferred = [route for route in locations if route not in chosen]
+            locations = [route for route in locations if route in chosen]
+        else:
+            locations, deferred = scheduler.select(locations, timestamp)
+        selected = locations
+        print(f"Scheduler: fetching {len(locations)} routes, deferring {len(deferred)} stable ones")
+        metrics.inc('routes_deferred_total', len(deferred))
+    
+    # Routes finished by an earlier attempt of this run (same run_time) are replayed, not refetched.
+    # The scheduler observed them when they were fetched; their rows may be change records anyway
+    journal = None
+    if journal_enabled():
+        journal = RunJournal(store, f"{run_name}{shard_suffix(shard_index, shard_count)}")
+        try:
+            completed = journal.load()
+        except Exception as e:
+            print(f"Warning: Could not read run journal: {str(e)}")
+            completed = []
+        if completed:
+            print(f"Resuming run: {len(completed)} routes already collected")
+            # The journal holds what was written, so a delta run does not encode the rows a second
+            # time against the state the earlier attempt saved
+            for origin_addr, dest_addr, rows in completed:
+                if delta_encoder is not None:
+                    delta_encoder.replay(origin_addr, dest_addr, rows, timestamp)
+                write_output_rows(rows)
+            metrics.inc('routes_resumed_total', len(completed))
+            locations = skip_completed(locations, completed)
+    
+    # Scoped to this run so a warm instance never serves prices from a previous one
+    route_cache = RouteCache()
+    
+    def process_route(origin_addr, dest_addr):
         print(f"\nProcessing route: {origin_addr} -> {dest_addr}")
         
-        origin_coords = get_coordinates(origin_addr, cached_locations)
+        origin_coords = get_coordinates(origin_addr, geocode_cache)
         if not origin_coords:
             print(f"Could not get coordinates for origin address: {origin_addr}")
-            continue
+            return []
             
-        dest_coords = get_coordinates(dest_addr, cached_locations)
+        dest_coords = get_coordinates(dest_addr, geocode_cache)
         if not dest_coords:
             print(f"Could not get coordinates for destination address: {dest_addr}")
-            continue
+            return []
         
-        raw_data = get_uber_prices(origin_coords, dest_coords, cookies)
+        raw_data = route_cache.get_or_fetch(
+            origin_coords, dest_coords,
+            lambda: get_uber_prices(origin_coords, dest_coords, cookies)
+        )
         if not raw_data:
             print("Failed to get price data")
-            continue
+            return []
         
-        formatted_data = format_price_data_for_csv(origin_addr, dest_addr, raw_data, timestamp, formatted_datetime)
-        all_price_data.extend(formatted_data)
-        
-        #time.sleep(2)
+        if archive is not None:
+            archive.add(origin_addr, dest_addr, raw_data)
+        return format_price_data_for_csv(origin_addr, dest_addr, raw_data, timestamp, formatted_datetime)
+    
+    def measured_route(origin_addr, dest_addr):
+        with metrics.time('process_route'):
+            rows = process_route(origin_addr, dest_addr)
+        metrics.inc('routes_total', outcome='ok' if rows else 'failed')
+        return origin_addr, dest_addr, rows
     
-    if all_price_data:
-        df = pd.DataFrame(all_price_data)
-        #df.to_csv(csv_filename, index=False)
+    def write_rows(result):
+        origin_addr, dest_addr, rows = result
+        with metrics.time('write_output'):
+            written = emit_rows(origin_addr, dest_addr, rows)
+        metrics.inc('rows_total', len(rows))
         
-        bucket_name = os.getenv('GCS_BUCKET_NAME')
-        upload_to_gcs(bucket_name,df,f"2025/{csv_filename}")
+        # Failed routes are left out so a retry fetches them again
+        if journal is not None and rows:
+            journal.record(origin_addr, dest_addr, written)
+        if scheduler is not None and rows:
+            scheduler.observe(origin_addr, dest_addr, rows, timestamp)
+    
+    # PROFILE_OUTPUT captures a cProfile of the route worker threads
+    profiler = HotPathProfiler() if os.getenv('PROFILE_OUTPUT') else None
+    route_worker = profiler.wrap(measured_route) if profiler else measured_route
+    
+    run_info = {
+        'run_name': run_name,
+        'timestamp': timestamp,
+        'shard_index': shard_index,
+        'shard_count': shard_count,
+        'routes': len(locations),
+    }
+    
+    skipped = []
+    def skip_route(origin_addr, dest_addr):
+        skipped.append((origin_addr, dest_addr))
+        metrics.inc('routes_total', outcome='skipped')
+    
+    # Rows are streamed to the upload as each route finishes instead of being collected first
+    try:
+        fetch_routes(locations, route_worker, on_result=write_rows, deadline=deadline, on_skip=skip_route)
+        if journal is not None:
+            journal.flush()
+        with metrics.time('close_output'):
+            uploaded = writer.close()
+        if archive is not None and archive.close():
+            print(f"Archived {len(archive.records)} raw responses ({len(archive.objects)} distinct, "
+                  f"{archive.offset / 1024:.0f} KiB from {archive.bytes_in / 1024:.0f} KiB) to {store.uri(archive.pack_name)}")
+    except Exception as e:
+        report_gcs_error(e)
+        return
+    finally:
+        run_info['rows_written'] = writer.rows_written
+        run_info['routes_skipped'] = len(skipped)
+        run_info['cookie_profiles'] = cookies.stats()
+        report_run_metrics(metrics, store, route_cache, run_info, profiler)
+    
+    if uploaded and manifest is not None:
+        write_manifest_entry(store, manifest.entry(writer.blob_name, run_name, delta=delta_encoder is not None))
+    if scheduler is not None:
+        save_scheduler_state(store, scheduler_state_name, scheduler)
+    if delta_encoder is not None:
+        print(f"Delta encoding: wrote {delta_encoder.rows_out} change records for {delta_encoder.rows_in} rows")
+        save_delta_state(store, delta_state_name, delta_encoder)
+    
+    # A partial run keeps its journal so an invocation with the same run_time can finish it
+    if skipped:
+        record_skipped_routes(store, run_info, skipped)
+        if scheduler is not None:
+            save_selection(store, selection_name, run_name, selected)
+    else:
+        if journal is not None:
+            journal.clear()
+        # An earlier attempt may have stopped before finishing a route, so there was nothing to journal
+        clear_skipped_routes(store, run_info)
+        if scheduler is not None and store.exists(selection_name):
+            store.delete(selection_name)
+    
+    # New geocoding results outlive this instance
+    if cache_sync_enabled() and geocode_cache.persist(store):
+        print(f"Geocode cache saved to {store.uri(CACHE_BLOB_NAME)}")
+    
+    if uploaded:
+        print(f"Data uploaded to {store.uri(writer.blob_name)} ({writer.rows_written} rows)")
+    elif delta_encoder is not None and delta_encoder.rows_in:
+        print("No prices changed since the previous run")
     else:
         print("No price data collected")
     
+    # Whichever shard finishes last merges the run into a single blob, unless a shard still has
+    # routes left for an invocation with the same run_time, which would write its blob again
+    if shard_count > 1:
+        try:
+            if skipped or store.list_names(f"skipped/{run_name}-shard-"):
+                print(f"Not compacting {run_name}: routes skipped by the deadline are still to be collected")
+            else:
+                compact_shards(store, run_name)
+        except Exception as e:
+            print(f"Error compacting shards: {str(e)}")
+    
     return
 
+def compact_run(run_time):
+
+    store = get_output_store(os.getenv('GCS_BUCKET_NAME'))
+    if store is None:
+        return None
+    
+    timestamp, formatted_datetime = get_run_timestamp(run_time)
+    return compact_shards(store, build_run_name(timestamp, formatted_datetime), require_all=False)
+
 # Triggered from a message on a Cloud Pub/Sub topic.
-@functions_framework.cloud_event
 def main(arg):
-    start()
+    options = parse_run_options(arg)
+    
+    if options.get('action') == 'compact':
+        if 'run_time' not in options:
+            print("Error: compact requires run_time")
+            return
+        compact_run(options['run_time'])
+        return
+    if options.get('shard_count', 1) > 1 and 'run_time' not in options:
+        print("Error: a sharded run requires run_time, or its shards write to different runs")
+        return
+    
+    start(
+        shard_index=options.get('shard_index', 0),
+        shard_count=options.get('shard_count', 1),
+        run_time=options.get('run_time'),
+        deadline_seconds=options.get('deadline_seconds')
+    )
     return
+
+# The Functions Framework has already been imported when it loads this module, so the
+# decorator is applied only then and local runs skip importing Flask altogether
+if 'functions_framework' in sys.modules:
+    import functions_framework
+    main = functions_framework.cloud_event(main)
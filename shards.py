@@ -0,0 +1,150 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+from datetime import datetime
+from history import merge_manifest_entries
+
+
+SHARD_NAME_RE = re.compile(r'shard-(\d+)-of-(\d+)\.(.+)$')
+
+def parse_run_options(cloud_event):
+    """
+    Read run options from a Pub/Sub CloudEvent. The message data is a JSON object such as
+    {"shard_index": 2, "shard_count": 8, "run_time": 1748779200, "deadline_seconds": 500} or
+    {"action": "compact", "run_time": 1748779200}; message attributes are accepted too.
+    Without an explicit run_time an unsharded run uses the event's own time.
+    """
+    options = {}
+    data = getattr(cloud_event, 'data', None) or {}
+    message = data.get('message', {}) if isinstance(data, dict) else {}
+
+    encoded = message.get('data')
+    if encoded:
+        try:
+            payload = json.loads(base64.b64decode(encoded))
+            if isinstance(payload, dict):
+                options.update(payload)
+        except ValueError as e:
+            print(f"Warning: Ignoring message data that is not a JSON object: {str(e)}")
+    options.update(message.get('attributes') or {})
+
+    for key, convert in (('shard_index', int), ('shard_count', int), ('run_time', int), ('deadline_seconds', float)):
+        if key in options:
+            try:
+                options[key] = convert(options[key])
+            except (TypeError, ValueError):
+                print(f"Warning: Ignoring invalid {key}: {options[key]!r}")
+                del options[key]
+
+    # Pub/Sub redelivers a failed event with the same time, so retries land in the same run.
+    # Shards of one run are separate messages with their own times, so they must carry run_time
+    if 'run_time' not in options and options.get('shard_count', 1) <= 1:
+        event_time = _event_time(cloud_event)
+        if event_time is not None:
+            options['run_time'] = event_time
+    return options
+
+def _event_time(cloud_event):
+
+    get_attribute = getattr(cloud_event, 'get', None)
+    value = get_attribute('time') if callable(get_attribute) else None
+    if not value:
+        return None
+    try:
+        return int(datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp())
+    except ValueError:
+        return None
+
+def route_shard(origin, destination, shard_count):
+    """Stable shard number for a route, the same on every instance and run"""
+    digest = hashlib.sha1(f"{origin}:{destination}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+def select_shard(locations, shard_index, shard_count):
+    return [route for route in locations if route_shard(route[0], route[1], shard_count) == shard_index]
+
+def shard_file_name(shard_index, shard_count, extension):
+    return f"shard-{shard_index:04d}-of-{shard_count:04d}.{extension}"
+
+def list_shards(store, run_name):
+    """Return [(shard_index, shard_count, extension, blob_name)] written for a run"""
+    shards = []
+    for name in store.list_names(f"{run_name}/"):
+        match = SHARD_NAME_RE.search(name)
+        if match:
+            shards.append((int(match.group(1)), int(match.group(2)), match.group(3), name))
+    return sorted(shards)
+
+def _merge_csv(store, shard_names, target_name, compress):
+
+    content_encoding = 'gzip' if compress else None
+
+    with store.open_write(target_name, content_type='text/csv', content_encoding=content_encoding) as raw:
+        target = gzip.GzipFile(fileobj=raw, mode='wb') if compress else raw
+        for position, name in enumerate(shard_names):
+            with store.open_read(name) as raw_shard:
+                shard = gzip.GzipFile(fileobj=raw_shard, mode='rb') if compress else raw_shard
+                header = shard.readline()
+                if position == 0:
+                    target.write(header)
+                shutil.copyfileobj(shard, target)
+        if compress:
+            target.close()
+
+def _merge_parquet(store, shard_names, target_name):
+
+    import pyarrow.parquet as pq
+
+    writer = None
+    with store.open_write(target_name, content_type='application/vnd.apache.parquet') as raw:
+        for name in shard_names:
+            with store.open_read(name) as shard:
+                parquet_file = pq.ParquetFile(shard)
+                if writer is None:
+                    writer = pq.ParquetWriter(raw, parquet_file.schema_arrow, compression=os.getenv('PARQUET_COMPRESSION', 'zstd'))
+                for row_group in range(parquet_file.num_row_groups):
+                    writer.write_table(parquet_file.read_row_group(row_group))
+        if writer is not None:
+            writer.close()
+
+def compact_shards(store, run_name, delete_shards=True, require_all=True):
+    """
+    Merge the shard blobs of a run into {run_name}.{extension}. Returns the merged
+    blob name, or None if there is nothing to merge or shards are still missing.
+    """
+    shards = list_shards(store, run_name)
+    if not shards:
+        print(f"No shard blobs found under {run_name}/")
+        return None
+
+    shard_count = shards[0][1]
+    extension = shards[0][2]
+    present = {shard[0] for shard in shards}
+    missing = [index for index in range(shard_count) if index not in present]
+    if missing and require_all:
+        print(f"Waiting for {len(missing)} of {shard_count} shards before compacting {run_name}")
+        return None
+
+    shard_names = [shard[3] for shard in shards]
+    target_name = f"{run_name}.{extension}"
+
+    if extension == 'parquet':
+        _merge_parquet(store, shard_names, target_name)
+    else:
+        _merge_csv(store, shard_names, target_name, compress=extension.endswith('.gz'))
+    merge_manifest_entries(store, shard_names, target_name)
+
+    if delete_shards:
+        for name in shard_names:
+            try:
+                store.delete(name)
+            except Exception as e:
+                # Another shard may have compacted the same run concurrently
+                print(f"Warning: Could not delete shard blob {name}: {str(e)}")
+
+    print(f"Compacted {len(shard_names)} shard(s) into {store.uri(target_name)}")
+    return target_name
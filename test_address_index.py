@@ -0,0 +1,65 @@
+import os
+import tempfile
+import scrape
+from addressindex import AddressIndex
+from geocache import GeocodeCache
+from metrics import reset_metrics
+
+def test_address_index():
+    """
+    Spelling variants of a cached address reuse its coordinates without a geocode call,
+    while a different house number or a match contradicting its display_name does not
+    """
+    index = AddressIndex(threshold=0.8, verify=True)
+    index.add('Marszałkowska 12, Warszawa', {'latitude': 52.23, 'longitude': 21.01, 'display_name': '12, Marszałkowska, Śródmieście, Warszawa, Polska'})
+    index.add('Prosta 12, Kraków', {'latitude': 50.06, 'longitude': 19.94, 'display_name': '12, Prosta, Kraków, Polska'})
+
+    assert index.lookup('ul. MARSZALKOWSKA 12 warszawa')[2] == 1.0
+    coords, matched_address, similarity = index.lookup('Marszalkowskaa 12, Warszawa')
+    assert coords['latitude'] == 52.23 and 0.8 <= similarity < 1.0
+    assert index.lookup('Marszałkowska 14, Warszawa') is None
+    assert index.lookup('Prostaa 12, Warszawa') is None
+
+    # A cached spelling the geocoder placed in another city is not trusted for a Warsaw address
+    misplaced = {'latitude': 50.06, 'longitude': 19.94, 'display_name': '7, Prosta, Kraków, Polska'}
+    index.add('Prosta 7, Warszawa', misplaced)
+    assert index.lookup('Prostaa 7, Warszawa') is None and index.rejected == 1
+    unverified = AddressIndex(threshold=0.8, verify=False)
+    unverified.add('Prosta 7, Warszawa', misplaced)
+    assert unverified.lookup('Prostaa 7, Warszawa') is not None
+
+    geocode_calls = []
+    original = scrape.geocode_request
+    def fake_geocode_request(address):
+        geocode_calls.append(address)
+        return 200, {'latitude': 52.0, 'longitude': 21.0, 'display_name': f"6, {address.split(',')[0]}, Warszawa, Polska"}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        previous = {var: os.environ.get(var) for var in ('GEOCODE_RATE_LIMIT', 'GEO_CODE_API_KEY')}
+        os.environ.update(GEOCODE_RATE_LIMIT='0', GEO_CODE_API_KEY='test')
+        cache = GeocodeCache(os.path.join(work_dir, 'geocode.sqlite'))
+        try:
+            scrape.geocode_request = fake_geocode_request
+            metrics = reset_metrics()
+            for address in ('Aleje Jerozolimskie 6, Warszawa', 'aleje jerozolimskie 6 warszawa', 'Aleje Jerozolimskie 6,Warszawa',
+                            'Aleje Jerozolimske 6, Warszawa', 'Aleje Jerozolimskie 8, Warszawa', 'aleje jerozolimskie 6 warszawa'):
+                assert scrape.get_coordinates(address, cache) is not None
+        finally:
+            scrape.geocode_request = original
+            cache.close()
+            for var, value in previous.items():
+                if value is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = value
+
+    # Only house numbers 6 and 8 were geocoded. The comma variant already shares the exact key,
+    # and the repeated lowercase variant hits the key it was stored under the first time
+    assert geocode_calls == ['Aleje Jerozolimskie 6, Warszawa', 'Aleje Jerozolimskie 8, Warszawa']
+    assert metrics.counter_value('geocode_calls_saved_total', match='normalized') == 1
+    assert metrics.counter_value('geocode_calls_saved_total', match='fuzzy') == 1
+
+    print("Address index OK")
+
+if __name__ == "__main__":
+    test_address_index()
@@ -0,0 +1,79 @@
+import copy
+import csv
+import json
+import os
+import tempfile
+from archive import RawArchive, iter_responses, list_archive, read_index, reprocess_archive
+from fares import parse_csv_rows
+from history import ManifestBuilder, write_manifest_entry
+from output import CSVStreamWriter, LocalStore
+from scrape import CSV_COLUMNS, build_blob_name, build_run_name, get_run_timestamp
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'products_response.json')
+
+def test_archive():
+    """
+    Identical responses are stored once per pack, and reprocessing the archive in worker
+    processes writes the same rows as parsing the responses when they were fetched,
+    leaving out a run whose archive lacks routes of its output
+    """
+    with open(FIXTURE_PATH, 'r', encoding='utf-8') as f:
+        response = json.load(f)
+    routes = [(f"Street {i}", f"Street {i + 1}") for i in range(12)]
+
+    with tempfile.TemporaryDirectory() as root:
+        store = LocalStore(os.path.join(root, 'out'))
+        expected = []
+        for run in range(3):
+            timestamp, formatted_datetime = get_run_timestamp(1748736000 + 1800 * run)
+            run_name = build_run_name(timestamp, formatted_datetime)
+            shard_count = 2 if run == 1 else 1
+            output = CSVStreamWriter(store, build_blob_name(timestamp, formatted_datetime, 'csv'), CSV_COLUMNS)
+            manifest = ManifestBuilder()
+            for shard_index in range(shard_count):
+                archive = RawArchive(store, run_name, timestamp, formatted_datetime, shard_index, shard_count)
+                for index, (origin, destination) in enumerate(routes[shard_index::shard_count]):
+                    # Two routes in three get a response of their own, the others share one
+                    raw_data = copy.deepcopy(response) if index % 3 else response
+                    if index % 3:
+                        raw_data['data']['products']['tiers'][0]['products'][0]['fares'][0]['fare'] = f"PLN {10 + index}.00"
+                    rows = parse_csv_rows(raw_data, origin, destination, timestamp, formatted_datetime)
+                    output.write_rows(rows)
+                    manifest.add(rows)
+                    # The last run's first two routes were replayed from a journal whose pack was never finished
+                    if run < 2 or index >= 2:
+                        archive.add(origin, destination, raw_data)
+                    if run < 2:
+                        expected.extend(rows)
+                assert archive.close()
+            output.close()
+            # The last run is checked against its blob's content instead of a manifest entry
+            if run < 2:
+                write_manifest_entry(store, manifest.entry(output.blob_name, run_name))
+
+        groups = list_archive(store)
+        assert [(shard_index, shard_count) for _, shard_index, shard_count in groups] == [(0, 1), (0, 2), (1, 2), (0, 1)]
+
+        index = read_index(store, groups[next(iter(groups))][0])
+        assert len(index['records']) == len(routes)
+        assert len(index['objects']) == 1 + len([i for i in range(len(routes)) if i % 3])
+        assert len(list(iter_responses(store, index))) == len(routes)
+
+        runs, records, rows = reprocess_archive(('local', store.root), ('local', os.path.join(root, 'reprocessed')), workers=2)
+        assert (runs, records, rows) == (2, 2 * len(routes), len(expected))
+
+        reprocessed = LocalStore(os.path.join(root, 'reprocessed'))
+        outputs = [name for name in reprocessed.list_names() if name.endswith('.csv')]
+        assert len(outputs) == 2
+        written = []
+        for name in outputs:
+            with reprocessed.open_read(name) as f:
+                written.extend(csv.DictReader(line.decode('utf-8') for line in f))
+
+    key = lambda row: (int(row['timestamp']), row['origin'], row['name'], float(row['fare']))
+    assert sorted(map(key, written)) == sorted(map(key, expected))
+
+    print(f"Reprocessed {records} archived responses into {rows} rows")
+
+if __name__ == "__main__":
+    test_archive()
@@ -0,0 +1,50 @@
+import os
+import random
+import sys
+import pytest
+import scrape
+from geocache import GeocodeCache
+from test_geocoding import bulk_geocode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+from fake_servers import start_fake_servers
+
+def test_bulk_geocode(monkeypatch, tmp_path):
+    """
+    Bulk geocoding against the stub server sends one successful request per unique
+    normalized address, leaves cached hits and known failures alone and backs off
+    and slows its rate when the server answers 429
+    """
+    server, upstream, urls = start_fake_servers(latency_ms=1, jitter_ms=0, throttle_rate=0.3)
+    for var, value in dict(urls, GEO_CODE_API_KEY='test').items():
+        monkeypatch.setenv(var, value)
+    scrape.invalidate_warm_state()
+    geocode_cache = GeocodeCache(str(tmp_path / 'geocode.sqlite'))
+    try:
+        geocode_cache.store('Cached Street 1', {'latitude': 52.0, 'longitude': 21.0, 'display_name': 'Cached Street 1'})
+        geocode_cache.store('Nowhere 1', None)
+        streets = [f"Street {i}" for i in range(8)]
+        addresses = streets + [street.replace(' ', ', ') for street in streets] + [f"  {street}  " for street in streets]
+        addresses += ['Cached Street 1', 'Nowhere 1', 'Nowhere,  1']
+
+        # One worker keeps the order of the stub server's random 429s fixed
+        random.seed(4)
+        results, stats = bulk_geocode(addresses, geocode_cache, concurrency=1, rate=100.0)
+
+        assert stats['unique'] == 10 and stats['cached'] == 2 and stats['requested'] == 8
+        assert upstream.counts.get('geocode_200') == 8
+        assert upstream.counts.get('geocode_429', 0) > 0
+        assert stats['attempts'] == 8 + upstream.counts['geocode_429']
+        assert stats['final_rate'] < 100.0
+        assert sorted(results) == sorted(scrape.normalize_address(address) for address in streets + ['Cached Street 1'])
+        # Fresh results were written through, the negative entry still stands
+        assert all(geocode_cache.lookup(street)[1] for street in streets)
+        assert geocode_cache.lookup('Nowhere 1') == (True, None)
+        print(f"Bulk geocoding stats: {stats['attempts']} attempts, {upstream.counts}")
+    finally:
+        server.shutdown()
+        geocode_cache.close()
+        scrape.invalidate_warm_state()
+
+if __name__ == "__main__":
+    pytest.main([__file__, '-s'])
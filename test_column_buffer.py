@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+import pandas as pd
+import pyarrow.parquet as pq
+from fares import parse_csv_rows
+from output import ColumnBuffer, LocalStore, ParquetStreamWriter
+from scrape import CSV_COLUMN_TYPES, CSV_COLUMNS, DICTIONARY_COLUMNS
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'products_response.json')
+
+def test_column_buffer():
+    """
+    Rows appended to a ColumnBuffer come back with the same values as a DataFrame built
+    from the row dicts, missing values included, and stream through the Parquet writer
+    """
+    with open(FIXTURE_PATH, 'r', encoding='utf-8') as f:
+        response = json.load(f)
+
+    rows = []
+    for i in range(40):
+        rows.extend(parse_csv_rows(response, f"Street {i % 7}", f"Street {i}", 1748786400, '2025-06-01 14:00:00'))
+    # A delta tombstone carries only its keys
+    tombstone = {'timestamp': 1748786400, 'datetime': '2025-06-01 14:00:00', 'origin': 'Street 1', 'destination': 'Street 2',
+                 'tier': 'Economy', 'name': 'UberX', 'op': 'delete'}
+    column_types = dict(CSV_COLUMN_TYPES, op='string')
+    dictionary_columns = DICTIONARY_COLUMNS + ['op']
+
+    buffer = ColumnBuffer(column_types, dictionary_columns)
+    buffer.append_rows(rows[:50])
+    buffer.append_rows([tombstone])
+    buffer.append_rows(rows[50:])
+    assert len(buffer) == len(rows) + 1
+    # Seven origins are kept once each, however many rows repeat them
+    assert len(buffer.dictionaries['origin']) == 7
+
+    frame = buffer.to_pandas()
+    assert len(buffer) == 0
+    expected = pd.DataFrame(rows[:50] + [tombstone] + rows[50:], columns=list(column_types))
+    for column in column_types:
+        assert [None if pd.isna(value) else value for value in frame[column]] == \
+               [None if pd.isna(value) else value for value in expected[column]], column
+    assert str(frame['origin'].dtype) == 'category' and str(frame['fare'].dtype) == 'Float64'
+    assert frame['timestamp'].dtype == 'int64' and pd.isna(frame['capacity'][50])
+
+    with tempfile.TemporaryDirectory() as root:
+        store = LocalStore(root)
+        writer = ParquetStreamWriter(store, 'run.parquet', column_types, dictionary_columns, row_group_size=64)
+        writer.write_rows(rows[:50])
+        writer.write_rows([tombstone])
+        for start in range(50, len(rows), 5):
+            writer.write_rows(rows[start:start + 5])
+        assert writer.close()
+        table = pq.read_table(store.path('run.parquet'))
+        assert pq.ParquetFile(store.path('run.parquet')).num_row_groups > 1
+
+    assert table.num_rows == len(rows) + 1
+    assert table.column('fare').null_count == 1 and table.column('op').to_pylist().count('delete') == 1
+    assert table.to_pandas()[CSV_COLUMNS].iloc[:50].astype(object).equals(expected[CSV_COLUMNS].iloc[:50].astype(object))
+
+    print(f"Column buffer round-tripped {len(rows) + 1} rows")
+
+if __name__ == "__main__":
+    test_column_buffer()
@@ -0,0 +1,55 @@
+import os
+import sys
+from cookiepool import CookiePool, CookieSession
+from fetcher import TokenBucket
+import scrape
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+from fake_servers import start_fake_servers
+
+ORIGIN = {'latitude': 52.2297, 'longitude': 21.0122}
+DESTINATION = {'latitude': 52.1657, 'longitude': 20.9671}
+
+def test_cookie_pool():
+    """
+    Requests are spread over the pool's accounts and an account whose cookies the
+    stub server rejects is quarantined after its first 401 without losing the route
+    """
+    server, upstream, urls = start_fake_servers(latency_ms=1, jitter_ms=0, rejected_cookies=['expired'])
+    test_env = dict(urls, UBER_MAX_RETRIES='2')
+    previous_env = {var: os.environ.get(var) for var in test_env}
+    os.environ.update(test_env)
+    try:
+        pool = CookiePool(
+            [CookieSession(name, {'sid': name}, TokenBucket(0)) for name in ('alice', 'expired', 'carol')],
+            strategy='round_robin'
+        )
+        results = [scrape.get_uber_prices(ORIGIN, DESTINATION, pool) for _ in range(9)]
+
+        assert all(result and result['data']['products']['tiers'] for result in results)
+        assert upstream.counts.get('graphql_401') == 1
+        assert upstream.counts.get('graphql_200') == 9
+
+        stats = {profile['name']: profile for profile in pool.stats()}
+        assert stats['expired']['quarantined'] and stats['expired']['quarantine_reason'] == 'auth_401'
+        assert stats['alice']['requests'] + stats['carol']['requests'] == 9
+        assert abs(stats['alice']['requests'] - stats['carol']['requests']) <= 1
+
+        # With every account refused the pool fails fast instead of sending requests
+        dead_pool = CookiePool([CookieSession('expired', {'sid': 'expired'}, TokenBucket(0))])
+        assert scrape.get_uber_prices(ORIGIN, DESTINATION, dead_pool) is None
+        assert scrape.get_uber_prices(ORIGIN, DESTINATION, dead_pool) is None
+        assert upstream.counts.get('graphql_401') == 2
+    finally:
+        server.shutdown()
+        scrape.invalidate_warm_state()
+        for var, value in previous_env.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+    print(f"Cookie pool OK: {upstream.counts}")
+
+if __name__ == "__main__":
+    test_cookie_pool()
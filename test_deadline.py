@@ -0,0 +1,72 @@
+import json
+import os
+import tempfile
+import time
+import pytest
+import scrape
+from fetcher import Deadline, fetch_routes
+from scrape import read_locations
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'products_response.json')
+
+def test_deadline():
+    """
+    Routes are read highest priority first, and once the budget no longer covers
+    another route plus the flush the remaining routes are skipped, not started
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'locations.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("A:B\nC:D:5\nE:F\nG:H:10\n")
+        assert read_locations(path) == [('G', 'H'), ('C', 'D'), ('A', 'B'), ('E', 'F')]
+
+    deadline = Deadline(0.5, flush_seconds=0.1, initial_route_seconds=0.05)
+    for _ in range(20):
+        deadline.observe(0.05)
+    assert abs(deadline.route_estimate() - 0.05) < 0.01
+
+    routes = [(f"Street {i}", f"Street {i + 1}") for i in range(100)]
+    finished = []
+    skipped = []
+
+    def process_route(origin, destination):
+        time.sleep(0.05)
+        return origin
+
+    started = time.monotonic()
+    fetch_routes(routes, process_route, concurrency=2, on_result=finished.append, deadline=deadline,
+                 on_skip=lambda origin, destination: skipped.append(origin))
+    elapsed = time.monotonic() - started
+
+    assert finished and skipped
+    assert sorted(finished + skipped) == sorted(origin for origin, _ in routes)
+    assert elapsed < 0.5
+    print(f"Finished {len(finished)} routes in {elapsed:.2f}s, skipped {len(skipped)}")
+
+@pytest.mark.parametrize('journal_enabled', ['1', '0'])
+def test_deadline_retry(scraper_sandbox, monkeypatch, journal_enabled):
+    """
+    A retry that collects every route removes the skipped routes record, even when the
+    first attempt hit its deadline before finishing a single route
+    """
+    with open(FIXTURE_PATH, 'r', encoding='utf-8') as f:
+        response = json.load(f)
+    routes = [(f"Street {i}", f"Street {i + 1}") for i in range(2)]
+    run_time = 1748779200
+
+    monkeypatch.setenv('JOURNAL_ENABLED', journal_enabled)
+    scraper_sandbox.patch(get_uber_prices=lambda origin, destination, cookies, query_profile=None: response)
+    scraper_sandbox.write_locations(routes)
+    store = scraper_sandbox.store
+
+    scraper_sandbox.stop_after(0)
+    scrape.start(run_time=run_time)
+    assert len(store.list_names('skipped/')) == 1 and store.list_names('journal/') == []
+
+    scraper_sandbox.run_to_completion()
+    scrape.start(run_time=run_time)
+    assert store.list_names('skipped/') == []
+    assert store.exists(f"{scrape.build_run_name(*scrape.get_run_timestamp(run_time))}.csv")
+
+if __name__ == "__main__":
+    pytest.main([__file__, '-s'])
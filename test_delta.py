@@ -0,0 +1,101 @@
+import copy
+import json
+import os
+import tempfile
+import pytest
+import scrape
+from delta import DeltaEncoder, read_rows, reconstruct_snapshot
+from fares import parse_csv_rows
+from output import CSVStreamWriter, LocalStore
+from scrape import CSV_COLUMNS, build_blob_name, get_run_timestamp
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'products_response.json')
+
+def snapshot_key(rows):
+    return sorted((row['origin'], row['destination'], row['tier'], row['name'], float(row['fare'])) for row in rows)
+
+def test_delta():
+    """
+    Consecutive delta runs write only changed products and tombstones, and the reader
+    rebuilds exactly the full snapshot of every run
+    """
+    with open(FIXTURE_PATH, 'r', encoding='utf-8') as f:
+        response = json.load(f)
+    routes = [(f"Street {i}", f"Street {i + 1}") for i in range(20)]
+
+    with tempfile.TemporaryDirectory() as root:
+        store = LocalStore(root)
+        encoder = DeltaEncoder(keyframe_seconds=86400)
+        run_times = [1748736000 + 1800 * run for run in range(4)]
+        expected = {}
+        written = []
+
+        for run, run_time in enumerate(run_times):
+            timestamp, formatted_datetime = get_run_timestamp(run_time)
+            writer = CSVStreamWriter(store, build_blob_name(timestamp, formatted_datetime, 'csv'), CSV_COLUMNS + ['op'])
+            full_rows = []
+            for index, (origin, destination) in enumerate(routes):
+                rows = parse_csv_rows(response, origin, destination, timestamp, formatted_datetime)
+                if run >= 1 and index == 3:
+                    rows[0]['fare'] += run                      # one product's fare moves every run
+                if run >= 2 and index == 5:
+                    rows = rows[1:]                             # a product disappears
+                full_rows.extend(rows)
+                writer.write_rows(encoder.encode(origin, destination, rows, timestamp))
+            writer.close()
+            expected[timestamp] = full_rows
+            written.append(writer.rows_written)
+
+        # Keyframe, then one changed fare, then a changed fare and a tombstone, then one changed fare
+        assert written == [len(routes) * 5, 1, 2, 1]
+
+        for timestamp, full_rows in expected.items():
+            assert snapshot_key(reconstruct_snapshot(store, timestamp, keyframe_seconds=86400)) == snapshot_key(full_rows)
+
+    print(f"Delta runs wrote {written} rows for {len(routes) * 5} rows per run")
+
+def test_delta_resume(scraper_sandbox, monkeypatch):
+    """
+    A delta run cut short by its deadline and resumed with the same run_time writes the
+    journaled routes' change records again, so its blob still holds every route
+    """
+    with open(FIXTURE_PATH, 'r', encoding='utf-8') as f:
+        response = json.load(f)
+    changed = copy.deepcopy(response)
+    changed['data']['products']['tiers'][0]['products'][0]['fares'][0]['fare'] = 'PLN\xa099.99'
+
+    routes = [(f"Street {i}", f"Street {i + 1}") for i in range(10)]
+    run_times = [1748736000, 1748736000 + 1800]
+    # The second run sees a new fare on the third route, which its first attempt fetches
+    prices = {}
+
+    monkeypatch.setenv('OUTPUT_DELTA', '1')
+    scraper_sandbox.patch(get_uber_prices=lambda origin, destination, cookies, query_profile=None: prices.get(round(destination['longitude'], 2), response))
+    scraper_sandbox.write_locations(routes)
+
+    store = scraper_sandbox.store
+    written = []
+    for run, run_time in enumerate(run_times):
+        prices = {21.03: changed} if run else {}
+        scraper_sandbox.stop_after(4)
+        scrape.start(run_time=run_time)
+        scraper_sandbox.run_to_completion()
+        scrape.start(run_time=run_time)
+
+        timestamp, formatted_datetime = scrape.get_run_timestamp(run_time)
+        assert store.list_names('journal/') == []
+        written.append(len(read_rows(store, f"{scrape.build_run_name(timestamp, formatted_datetime)}.csv")))
+
+        full_rows = []
+        for origin, destination in routes:
+            route_response = changed if run and destination == 'Street 3' else response
+            full_rows.extend(parse_csv_rows(route_response, origin, destination, timestamp, formatted_datetime))
+        assert snapshot_key(reconstruct_snapshot(store, timestamp, keyframe_seconds=86400)) == snapshot_key(full_rows)
+
+    # A keyframe of every route, then the one fare fetched before the deadline
+    assert written == [len(routes) * 5, 1]
+
+    print(f"Resumed delta runs wrote {written} rows")
+
+if __name__ == "__main__":
+    pytest.main([__file__, '-s'])
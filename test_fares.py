@@ -0,0 +1,23 @@
+from fares import parse_fare, split_fare
+
+def test_fare_parsing():
+    """
+    Fare strings parse the same regardless of currency position, grouping and decimal separators
+    """
+    assert split_fare('PLN 31.46') == ('PLN', 31.46)
+    assert split_fare('31,46 zł') == ('zł', 31.46)
+    assert split_fare('PLN 1,089.00') == ('PLN', 1089.0)
+    assert split_fare('€1.089,00') == ('€', 1089.0)
+    assert split_fare('1 234,50 kr') == ('kr', 1234.5)
+    assert split_fare("CHF 1'234.50") == ('CHF', 1234.5)
+    assert split_fare('PLN 20-25') == ('PLN', 20.0)
+
+    assert parse_fare('') == 0.0
+    assert parse_fare(None) == 0.0
+    assert parse_fare(12.5) == 12.5
+    assert parse_fare('1,5', decimal_separator=',') == 1.5
+
+    print("Fare parsing OK")
+
+if __name__ == "__main__":
+    test_fare_parsing()
@@ -0,0 +1,45 @@
+import json
+import os
+import pytest
+import scrape
+from geocache import CACHE_BLOB_NAME
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'products_response.json')
+
+def test_geocache_sync(scraper_sandbox, monkeypatch, capsys):
+    """
+    A new instance starts from the geocode cache the previous one persisted to the output
+    store instead of importing locations.json and geocoding again
+    """
+    with open(FIXTURE_PATH, 'r', encoding='utf-8') as f:
+        response = json.load(f)
+    routes = [(f"Street {i}", f"Street {i + 1}") for i in range(3)]
+
+    geocoded = []
+    def fake_geocode_request(address):
+        geocoded.append(address)
+        return 200, {'latitude': 52.0, 'longitude': 21.0 + int(address.split()[-1]) / 100, 'display_name': address}
+
+    scraper_sandbox.patch(get_uber_prices=lambda origin, destination, cookies, query_profile=None: response,
+                          geocode_request=fake_geocode_request)
+    scraper_sandbox.write_locations(routes)
+    with open('locations.json', 'w', encoding='utf-8') as f:
+        json.dump({'Street 0': {'latitude': 52.0, 'longitude': 21.0, 'display_name': 'Street 0'}}, f)
+    monkeypatch.setenv('GEOCODE_CACHE_SYNC', '1')
+
+    for instance in range(2):
+        # Every instance starts with an empty temp directory
+        monkeypatch.setenv('GEOCODE_CACHE_PATH', os.path.join(scraper_sandbox.work_dir, f"instance-{instance}.sqlite"))
+        scrape.invalidate_warm_state()
+        scrape.start(run_time=1748779200 + 1800 * instance)
+        output = capsys.readouterr().out
+        if instance == 0:
+            assert 'Imported 1 cached locations' in output and scraper_sandbox.store.exists(CACHE_BLOB_NAME)
+            assert sorted(geocoded) == [f"Street {i}" for i in range(1, 4)]
+        else:
+            assert 'Imported' not in output and 'Geocode cache saved' not in output
+
+    assert len(geocoded) == 3
+
+if __name__ == "__main__":
+    pytest.main([__file__, '-s'])
@@ -1,12 +1,113 @@
+import argparse
 import os
+import random
 import time
-import json
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from scrape import read_locations, geocode_address, normalize_address
+from scrape import read_locations, geocode_request, normalize_address
+from geocache import GeocodeCache
+from fetcher import AdaptiveTokenBucket
+from metrics import get_metrics
+from resilience import RETRYABLE_STATUS
 
-def test_geocoding():
+def geocode_with_backoff(address, limiter, max_retries=5, base_delay=1.0, max_delay=30.0):
     """
-    Test geocoding for all addresses in locations.txt and save results to locations.json
+    Geocode one address under the shared limiter, backing off with jitter on
+    throttling, server errors and network failures.
+    Returns (status_code, coordinates, latency_seconds, attempts).
+    """
+    started = time.monotonic()
+    status_code, coords = None, None
+    
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        status_code, coords = geocode_request(address)
+        
+        if status_code is not None and status_code not in RETRYABLE_STATUS:
+            limiter.on_success()
+            break
+        
+        if status_code is not None:
+            limiter.on_throttle()
+        if attempt < max_retries:
+            get_metrics().inc('retries_total', stage='geocode')
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            time.sleep(random.uniform(delay / 2, delay))
+    
+    return status_code, coords, time.monotonic() - started, attempt + 1
+
+def bulk_geocode(addresses, geocode_cache, concurrency=4, rate=None):
+    """
+    Geocode the unique normalized addresses that are not cached yet, concurrently
+    and under an adaptive rate limit. Returns ({address: coordinates}, stats).
+    """
+    rate = rate or float(os.getenv('GEOCODE_RATE_LIMIT', 1.0)) or 1.0
+    limiter = AdaptiveTokenBucket(rate)
+    
+    unique_addresses = {}
+    for address in addresses:
+        unique_addresses.setdefault(normalize_address(address), address)
+    
+    results = {}
+    pending = []
+    for key, address in unique_addresses.items():
+        # A cached negative entry is a known failure until its TTL expires, not a retry
+        cached, coords = geocode_cache.lookup(address)
+        if not cached:
+            pending.append(address)
+        elif coords:
+            results[key] = coords
+    
+    print(f"{len(unique_addresses)} unique addresses, {len(results)} cached, {len(pending)} to geocode")
+    
+    latencies = {}
+    attempts_total = 0
+    started = time.monotonic()
+    
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for address, (status_code, coords, latency, attempts) in zip(
+            pending, executor.map(lambda a: geocode_with_backoff(a, limiter), pending)
+        ):
+            latencies[address] = latency
+            attempts_total += attempts
+            if status_code == 200:
+                geocode_cache.store(address, coords)
+            if coords:
+                results[normalize_address(address)] = coords
+            print(f"{'OK' if coords else 'FAILED'} {latency:6.2f}s ({attempts} attempt(s)) {address}")
+    
+    elapsed = time.monotonic() - started
+    stats = {
+        'unique': len(unique_addresses),
+        'cached': len(unique_addresses) - len(pending),
+        'requested': len(pending),
+        'attempts': attempts_total,
+        'elapsed': elapsed,
+        'throughput': len(pending) / elapsed if elapsed > 0 else 0.0,
+        'latencies': latencies,
+        'final_rate': limiter.rate,
+    }
+    return results, stats
+
+def print_bulk_stats(stats):
+
+    latencies = sorted(stats['latencies'].values())
+    print("\nBulk Geocoding Throughput")
+    print("-------------------------")
+    print(f"Unique addresses: {stats['unique']} ({stats['cached']} cached, {stats['requested']} requested)")
+    print(f"API attempts: {stats['attempts']}")
+    print(f"Elapsed: {stats['elapsed']:.2f}s, throughput: {stats['throughput']:.2f} addresses/s")
+    print(f"Final request rate: {stats['final_rate']:.2f} req/s")
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"Latency per address: p50 {p50:.2f}s, p95 {p95:.2f}s, max {latencies[-1]:.2f}s")
+
+def test_geocoding(bulk=False, concurrency=4):
+    """
+    Test geocoding for all addresses in locations.txt, write them through to the
+    geocode cache and export the cached locations to locations.json.
+    With bulk=True unique addresses are geocoded concurrently instead of one by one.
     """
     load_dotenv()
     
@@ -19,16 +120,38 @@ def test_geocoding():
         print("Error: No locations found in locations.txt")
         return
     
+    geocode_cache = GeocodeCache()
     geocoded_locations = {}
     failed_addresses = []
     
     print("Starting geocoding test...")
     print("-------------------------")
     
-    for origin, destination in location_pairs:
-        print(f"\nTesting origin: {origin}")
-        if origin not in geocoded_locations:
-            origin_coords = geocode_address(origin)
+    if bulk:
+        roles = {}
+        for origin, destination in location_pairs:
+            roles.setdefault(normalize_address(origin), (origin, set()))[1].add('origin')
+            roles.setdefault(normalize_address(destination), (destination, set()))[1].add('destination')
+        
+        results, stats = bulk_geocode([address for pair in location_pairs for address in pair], geocode_cache, concurrency)
+        
+        for key, (address, address_roles) in roles.items():
+            if key in results:
+                geocoded_locations[address] = results[key]
+            else:
+                failed_addresses.append(('/'.join(sorted(address_roles)), address))
+        total_addresses = len(roles)
+    else:
+        for origin, destination in location_pairs:
+            print(f"\nTesting origin: {origin}")
+            cached, origin_coords = geocode_cache.lookup(origin)
+            if cached:
+                print(f"Using cached {'coordinates' if origin_coords else 'failure'} for: {origin}")
+            else:
+                status_code, origin_coords = geocode_request(origin)
+                if status_code == 200:
+                    geocode_cache.store(origin, origin_coords)
+        
             if origin_coords:
                 geocoded_locations[origin] = {
                     'latitude': origin_coords['latitude'],
@@ -37,13 +160,17 @@ def test_geocoding():
                 }
             else:
                 failed_addresses.append(('origin', origin))
-        else:
-            print(f"Using cached coordinates for: {origin}")
-        time.sleep(2)
+            time.sleep(2)
+        
+            print(f"Testing destination: {destination}")
+            cached, dest_coords = geocode_cache.lookup(destination)
+            if cached:
+                print(f"Using cached {'coordinates' if dest_coords else 'failure'} for: {destination}")
+            else:
+                status_code, dest_coords = geocode_request(destination)
+                if status_code == 200:
+                    geocode_cache.store(destination, dest_coords)
         
-        print(f"Testing destination: {destination}")
-        if destination not in geocoded_locations:
-            dest_coords = geocode_address(destination)
             if dest_coords:
                 geocoded_locations[destination] = {
                     'latitude': dest_coords['latitude'],
@@ -52,11 +179,9 @@ def test_geocoding():
                 }
             else:
                 failed_addresses.append(('destination', destination))
-        else:
-            print(f"Using cached coordinates for: {destination}")
-        time.sleep(2)
+            time.sleep(2)
     
-    total_addresses = len(location_pairs) * 2
+        total_addresses = len(location_pairs) * 2
     successful_addresses = len(geocoded_locations)
     failed_count = len(failed_addresses)
     success_rate = (successful_addresses / total_addresses) * 100
@@ -73,11 +198,17 @@ def test_geocoding():
         for addr_type, addr in failed_addresses:
             print(f"- {addr} ({addr_type})")
     
+    if bulk:
+        print_bulk_stats(stats)
+    
     if geocoded_locations:
-        with open('locations.json', 'w', encoding='utf-8') as f:
-            json.dump(geocoded_locations, f, indent=4, ensure_ascii=False)
-        print("\nGeocoded locations saved to: locations.json")
-        print(f"Cached {len(geocoded_locations)} unique locations")
+        exported = geocode_cache.export_json('locations.json')
+        print(f"\nGeocoded locations saved to: {geocode_cache.path} and locations.json")
+        print(f"Cached {exported} unique locations")
 
 if __name__ == "__main__":
-    test_geocoding() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Geocode all addresses in locations.txt into the geocode cache")
+    parser.add_argument('--bulk', action='store_true', help="geocode unique addresses concurrently with adaptive rate limiting")
+    parser.add_argument('--concurrency', type=int, default=4, help="parallel requests in bulk mode")
+    args = parser.parse_args()
+    test_geocoding(bulk=args.bulk, concurrency=args.concurrency)
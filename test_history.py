@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+from fares import parse_csv_rows
+from history import HistoryReader, ManifestBuilder, index_history, manifest_entry_name, write_manifest_entry
+from output import CSVStreamWriter, LocalStore, ParquetStreamWriter
+from scrape import CSV_COLUMN_TYPES, CSV_COLUMNS, DICTIONARY_COLUMNS, build_blob_name, build_run_name, get_run_timestamp
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'products_response.json')
+
+class CountingStore:
+    """A remote-like store over a local directory that counts the blobs downloaded from it"""
+
+    def __init__(self, root):
+        self.local = LocalStore(root)
+        self.downloads = []
+
+    def open_read(self, name):
+        self.downloads.append(name)
+        return self.local.open_read(name)
+
+    def __getattr__(self, name):
+        return getattr(self.local, name)
+
+def test_history():
+    """
+    The reader only downloads the blobs whose manifest entry matches the time window and
+    routes, returns typed rows from CSV and Parquet blobs alike and serves repeats from its cache.
+    Blobs of the undated {year}/{timestamp}_{datetime}.csv layout are backfilled and read too
+    """
+    with open(FIXTURE_PATH, 'r', encoding='utf-8') as f:
+        response = json.load(f)
+    routes = [(f"Street {i}", f"Street {i + 1}") for i in range(6)]
+
+    with tempfile.TemporaryDirectory() as root:
+        store = CountingStore(os.path.join(root, 'out'))
+        run_timestamps = []
+        for run in range(6):
+            timestamp, formatted_datetime = get_run_timestamp(1748736000 + 3600 * 8 * run)
+            run_timestamps.append(timestamp)
+            # Every other run is Parquet; runs alternate between the first and last three routes
+            run_routes = routes[:3] if run % 2 == 0 else routes[3:]
+            if run % 2:
+                writer = ParquetStreamWriter(store, build_blob_name(timestamp, formatted_datetime, 'parquet'), CSV_COLUMN_TYPES, DICTIONARY_COLUMNS)
+            else:
+                writer = CSVStreamWriter(store, build_blob_name(timestamp, formatted_datetime, 'csv'), CSV_COLUMNS)
+            manifest = ManifestBuilder()
+            for origin, destination in run_routes:
+                rows = parse_csv_rows(response, origin, destination, timestamp, formatted_datetime)
+                writer.write_rows(rows)
+                manifest.add(rows)
+            writer.close()
+            if run != 5:
+                write_manifest_entry(store, manifest.entry(writer.blob_name, build_run_name(timestamp, formatted_datetime)))
+
+        # Output from before the date partitioning, written straight under the year
+        legacy_timestamp, legacy_datetime = get_run_timestamp(1748736000 - 3600 * 8)
+        legacy_name = f"2025/{legacy_timestamp}_{legacy_datetime}.csv"
+        legacy = CSVStreamWriter(store, legacy_name, CSV_COLUMNS)
+        for origin, destination in routes[:3]:
+            legacy.write_rows(parse_csv_rows(response, origin, destination, legacy_timestamp, legacy_datetime))
+        legacy.close()
+
+        # Blobs uploaded before the manifest existed are picked up by a backfill
+        assert index_history(store, legacy_timestamp, run_timestamps[-1]) == 2
+        assert store.exists(manifest_entry_name(writer.blob_name)) and store.exists(manifest_entry_name(legacy_name))
+
+        reader = HistoryReader(store, cache_dir=os.path.join(root, 'cache'))
+        store.downloads.clear()
+        frame = reader.read(run_timestamps[1], run_timestamps[4], routes=[routes[4]])
+        # Runs 1 and 3 hold route 4; runs 2 and 4 are in the window but were skipped by the manifest
+        assert sorted(frame['timestamp'].unique()) == [run_timestamps[1], run_timestamps[3]]
+        assert set(zip(frame['origin'], frame['destination'])) == {routes[4]}
+        assert len(frame) == 2 * 5
+        assert [name for name in store.downloads if not name.startswith('manifest/')] == [
+            name for name in store.list_names() if name.endswith('.parquet') and str(run_timestamps[5]) not in name
+        ]
+        assert reader.blobs_skipped == 2
+        assert str(frame['fare'].dtype) == 'Float64' and str(frame['origin'].dtype) == 'category'
+        assert str(frame['hasPromo'].dtype) == 'boolean' and str(frame['capacity'].dtype) == 'Int64'
+
+        legacy_rows = HistoryReader(store, cache_dir=os.path.join(root, 'cache')).read(legacy_timestamp, legacy_timestamp)
+        assert len(legacy_rows) == 3 * 5 and set(legacy_rows['timestamp']) == {legacy_timestamp}
+
+        # The whole history mixes both formats and both layouts into one frame
+        everything = HistoryReader(store, cache_dir=os.path.join(root, 'cache')).read()
+        assert len(everything) == 7 * 3 * 5
+        assert list(everything.columns) == CSV_COLUMNS
+
+        store.downloads.clear()
+        repeat = HistoryReader(store, cache_dir=os.path.join(root, 'cache'))
+        assert len(repeat.read(run_timestamps[0], run_timestamps[2], origins=[routes[0][0]])) == 2 * 5
+        assert repeat.cache_hits == 2
+        assert not [name for name in store.downloads if not name.startswith('manifest/')]
+
+    print(f"History reader returned {len(everything)} rows from {len(run_timestamps)} runs")
+
+if __name__ == "__main__":
+    test_history()
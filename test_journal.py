@@ -0,0 +1,48 @@
+import csv
+import json
+import os
+import pytest
+import scrape
+from journal import RunJournal
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'products_response.json')
+
+def test_journal(scraper_sandbox):
+    """
+    A retried run with the same run_time replays the routes recorded in its journal,
+    fetches only the rest and removes the journal once the output is written
+    """
+    with open(FIXTURE_PATH, 'r', encoding='utf-8') as f:
+        response = json.load(f)
+
+    routes = [(f"Street {i}", f"Street {i + 1}") for i in range(10)]
+    run_time = 1748779200
+    fetched = []
+
+    scraper_sandbox.patch(get_uber_prices=lambda origin, destination, cookies, query_profile=None: fetched.append(destination['longitude']) or response)
+    scraper_sandbox.write_locations(routes)
+
+    # An earlier attempt of the run finished the first four routes before it was killed
+    store = scraper_sandbox.store
+    timestamp, formatted_datetime = scrape.get_run_timestamp(run_time)
+    run_name = scrape.build_run_name(timestamp, formatted_datetime)
+    journal = RunJournal(store, run_name, flush_routes=2)
+    for origin, destination in routes[:4]:
+        rows = scrape.format_price_data_for_csv(origin, destination, response, timestamp, formatted_datetime)
+        journal.record(origin, destination, rows)
+    assert len(journal.segment_names()) == 2
+
+    scrape.start(run_time=run_time)
+
+    assert sorted(fetched) == [21.0 + (i + 1) / 100 for i in range(4, len(routes))]
+    assert store.list_names('journal/') == []
+
+    with store.open_read(f"{run_name}.csv") as f:
+        rows = list(csv.DictReader(line.decode('utf-8') for line in f))
+    assert len(rows) == len(routes) * 5
+    assert {(row['origin'], row['destination']) for row in rows} == set(routes)
+
+    print(f"Resumed run fetched {len(fetched)} of {len(routes)} routes")
+
+if __name__ == "__main__":
+    pytest.main([__file__, '-s'])
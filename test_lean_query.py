@@ -0,0 +1,46 @@
+import json
+import os
+from queries import LEAN_PRODUCTS_FIELDS, LEAN_PRODUCTS_QUERY, build_products_body
+from scrape import format_price_data_for_csv, extract_price_data
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'products_response.json')
+
+def prune_response(node, fields):
+    """Drop everything a lean query would not have asked for"""
+    if isinstance(node, list):
+        return [prune_response(item, fields) for item in node]
+    if not isinstance(node, dict):
+        return node
+    return {
+        name: prune_response(node[name], subfields) if subfields else node[name]
+        for name, subfields in fields.items()
+        if name in node
+    }
+
+def test_lean_query():
+    """
+    The lean query profile must produce the same CSV rows as the full query
+    for the recorded Products response in fixtures/
+    """
+    with open(FIXTURE_PATH, 'r', encoding='utf-8') as f:
+        full_response = json.load(f)
+
+    lean_response = {'data': {'products': prune_response(full_response['data']['products'], LEAN_PRODUCTS_FIELDS)}}
+
+    full_rows = format_price_data_for_csv('A', 'B', full_response, 1700000000, '2023-11-14 22:13:20')
+    lean_rows = format_price_data_for_csv('A', 'B', lean_response, 1700000000, '2023-11-14 22:13:20')
+
+    assert full_rows
+    assert lean_rows == full_rows
+    assert list(lean_rows[0].keys()) == list(full_rows[0].keys())
+    assert extract_price_data(lean_response) == extract_price_data(full_response)
+
+    body = json.loads(build_products_body({'latitude': 52.1, 'longitude': 21.0}, {'latitude': 52.2, 'longitude': 20.9}, 'lean'))
+    assert body['query'] == LEAN_PRODUCTS_QUERY
+    assert body['variables']['pickup'] == {'latitude': 52.1, 'longitude': 21.0}
+    assert body['variables']['destinations'] == [{'latitude': 52.2, 'longitude': 20.9}]
+
+    print(f"Lean query matches full query output for {len(lean_rows)} rows")
+
+if __name__ == "__main__":
+    test_lean_query()
@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+from metrics import Histogram, Metrics, write_run_metrics
+
+def test_metrics():
+    """
+    Stage timings and labelled counters end up in both the JSON run summary and the
+    Prometheus text file
+    """
+    histogram = Histogram(buckets=(0.1, 0.2, 0.5))
+    for value in (0.05, 0.15, 0.15, 0.3):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 0]
+    assert 0.1 <= histogram.quantile(0.5) <= 0.2
+    assert histogram.quantile(1.0) == 0.3
+
+    metrics = Metrics()
+    with metrics.time('get_uber_prices'):
+        pass
+    try:
+        with metrics.time('get_uber_prices'):
+            raise RuntimeError('boom')
+    except RuntimeError:
+        pass
+    metrics.inc('http_requests_total', host='m.uber.com', status=200)
+    metrics.inc('http_requests_total', host='m.uber.com', status=200)
+    metrics.inc('response_bytes_total', 1024, host='m.uber.com')
+
+    assert metrics.counter_value('http_requests_total', host='m.uber.com', status=200) == 2
+    assert metrics.counter_value('stage_errors_total', stage='get_uber_prices') == 1
+
+    summary = metrics.summary(run_name='2025/06/01/run')
+    assert summary['stages']['get_uber_prices']['count'] == 2
+    assert summary['counters']['response_bytes_total'] == [{'labels': {'host': 'm.uber.com'}, 'value': 1024}]
+
+    text = metrics.to_prometheus(shard_index=0)
+    assert '# TYPE uber_scraper_http_requests_total counter' in text
+    assert 'uber_scraper_http_requests_total{shard_index="0",host="m.uber.com",status="200"} 2' in text
+    assert 'uber_scraper_stage_duration_seconds_bucket{shard_index="0",stage="get_uber_prices",le="+Inf"} 2' in text
+
+    with tempfile.TemporaryDirectory() as metrics_dir:
+        written = write_run_metrics(metrics, {'run_name': '2025/06/01/run', 'shard_index': 1, 'shard_count': 4}, '-shard-0001-of-0004', metrics_dir)
+        assert [os.path.basename(path) for path in written] == ['uber_scraper-shard-0001-of-0004.json', 'uber_scraper-shard-0001-of-0004.prom']
+        with open(written[0], 'r', encoding='utf-8') as f:
+            assert json.load(f)['shard_count'] == 4
+
+    print("Metrics OK")
+
+if __name__ == "__main__":
+    test_metrics()
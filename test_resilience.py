@@ -0,0 +1,85 @@
+import os
+import time
+import resilience
+import scrape
+from cookiepool import PoolExhausted
+from resilience import CircuitBreaker, LatencyTracker, RetryPolicy, hedged_call
+
+class FakeResponse:
+
+    def __init__(self, status_code, content=b'{}'):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode()
+        self.headers = {}
+
+def test_resilience():
+    """
+    The circuit opens after consecutive failures and lets one trial through after the
+    reset timeout; a hedged call returns the faster of two attempts
+    """
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.05)
+    for _ in range(2):
+        assert breaker.allow()
+        assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()          # only one trial while half open
+    breaker.record_success()
+    assert breaker.allow() and breaker.state == CircuitBreaker.CLOSED
+
+    # A 404 answered to the half-open trial ends it without judging the upstream,
+    # and a malformed 200 body is retried like a failed request
+    coords = {'latitude': 52.23, 'longitude': 21.01}
+    responses = [FakeResponse(404), FakeResponse(200, b'{"data": '), FakeResponse(200, b'{"data": {}}')]
+    original = scrape.request_prices_once
+    previous = {host: breaker for host, breaker in resilience._breakers.items()}
+    os.environ['UBER_RETRY_BASE_DELAY'] = '0'
+    try:
+        scrape.request_prices_once = lambda body, cookie_pool: responses.pop(0)
+        trial = resilience._breakers['m.uber.com'] = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        trial.record_failure()
+        assert scrape.get_uber_prices(coords, coords, {}) is None
+        assert trial.state == CircuitBreaker.HALF_OPEN and not trial.trial_in_flight
+        # So does running out of cookies before the trial request was sent
+        def exhausted(body, cookie_pool):
+            raise PoolExhausted("every account is quarantined")
+        scrape.request_prices_once = exhausted
+        assert scrape.get_uber_prices(coords, coords, {}) is None and trial.allow()
+        scrape.request_prices_once = lambda body, cookie_pool: responses.pop(0)
+        resilience._breakers['m.uber.com'] = CircuitBreaker(failure_threshold=5)
+        assert scrape.get_uber_prices(coords, coords, {}) == {'data': {}}
+    finally:
+        scrape.request_prices_once = original
+        resilience._breakers.clear()
+        resilience._breakers.update(previous)
+        os.environ.pop('UBER_RETRY_BASE_DELAY', None)
+
+    retry_policy = RetryPolicy(max_retries=3, base_delay=0.5, max_delay=2.0)
+    assert all(0 <= retry_policy.delay(attempt) <= 2.0 for attempt in range(10))
+    assert retry_policy.delay(0, retry_after='1.5') == 1.5
+
+    tracker = LatencyTracker()
+    assert tracker.quantile(0.95) is None
+    for i in range(100):
+        tracker.observe(i / 1000)
+    assert tracker.quantile(0.95) == 0.095
+
+    calls = []
+    def slow_then_fast():
+        calls.append(len(calls))
+        time.sleep(0.5 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    started = time.monotonic()
+    result, hedge_won = hedged_call(slow_then_fast, delay=0.02)
+    assert hedge_won and result == 2
+    assert time.monotonic() - started < 0.4
+
+    print("Resilience OK")
+
+if __name__ == "__main__":
+    test_resilience()
@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+import pytest
+import scrape
+from output import LocalStore
+from scheduler import RouteScheduler, load_scheduler_state, save_scheduler_state
+
+def fare_rows(fare, original_fare=None):
+    return [{'fare': fare, 'originalFare': original_fare or fare}]
+
+def test_scheduler():
+    """
+    Under a budget the volatile route is refreshed every run while the stable ones wait,
+    and a stable route is still fetched once its minimum refresh interval has passed
+    """
+    routes = [('Stable A', 'Office'), ('Volatile', 'Airport'), ('Stable B', 'Office')]
+    scheduler = RouteScheduler(budget=1, min_refresh_seconds=4 * 3600, surge_weight=1.0, alpha=0.5)
+
+    now = 1748779200
+    selected, deferred = scheduler.select(routes, now)
+    assert selected == routes and deferred == []   # never fetched, so all due
+
+    fetched = []
+    for run in range(9):
+        selected, _ = scheduler.select(routes, now)
+        fetched.append(selected)
+        for origin, destination in selected:
+            if origin == 'Volatile':
+                scheduler.observe(origin, destination, fare_rows(30.0 if run % 2 else 45.0, 30.0), now)
+            else:
+                scheduler.observe(origin, destination, fare_rows(30.0), now)
+        now += 1800
+
+    # Half-hourly runs spend the budget on the volatile route until the stable ones turn 4 hours old
+    assert all(selected == [('Volatile', 'Airport')] for selected in fetched[1:8])
+    assert fetched[8] == [('Stable A', 'Office'), ('Stable B', 'Office')]
+    assert scheduler.routes['Volatile:Airport']['surge'] > scheduler.routes['Stable A:Office']['surge']
+    # Observing the same run again, as a resumed invocation would, changes nothing
+    volatile = dict(scheduler.routes['Volatile:Airport'])
+    scheduler.observe('Volatile', 'Airport', fare_rows(60.0), volatile['last_fetched'])
+    assert scheduler.routes['Volatile:Airport'] == volatile
+
+    with tempfile.TemporaryDirectory() as root:
+        store = LocalStore(root)
+        assert load_scheduler_state(store, 'scheduler/state.json') == {}
+        save_scheduler_state(store, 'scheduler/state.json', scheduler)
+        assert load_scheduler_state(store, 'scheduler/state.json') == scheduler.routes
+
+    print(f"Scheduler picked per run: {[len(selected) for selected in fetched]}")
+
+def test_scheduler_resume(scraper_sandbox, monkeypatch):
+    """
+    A run cut short by its deadline resumes the routes it selected, even though the state
+    saved by the first attempt now ranks the route it finished below the deferred ones
+    """
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'products_response.json'), 'r', encoding='utf-8') as f:
+        response = json.load(f)
+    routes = [(f"Street {i}", f"Street {i + 1}") for i in range(6)]
+    fetched = []
+
+    scraper_sandbox.patch(get_uber_prices=lambda origin, destination, cookies, query_profile=None: fetched.append(destination['longitude']) or response)
+    scraper_sandbox.write_locations(routes)
+    monkeypatch.setenv('SCHEDULER_BUDGET', str(len(routes)))
+    scrape.start(run_time=1748779200)
+
+    monkeypatch.setenv('SCHEDULER_BUDGET', '2')
+    fetched.clear()
+    scraper_sandbox.stop_after(1)
+    scrape.start(run_time=1748779200 + 1800)
+    assert len(fetched) == 1 and scraper_sandbox.store.exists('scheduler/selection.json')
+
+    scraper_sandbox.run_to_completion()
+    scrape.start(run_time=1748779200 + 1800)
+    assert len(fetched) == len(set(fetched)) == 2
+    assert not scraper_sandbox.store.exists('scheduler/selection.json')
+
+if __name__ == "__main__":
+    pytest.main([__file__, '-s'])
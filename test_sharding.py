@@ -0,0 +1,77 @@
+import base64
+import csv
+import json
+import os
+from types import SimpleNamespace
+import pytest
+import scrape
+from history import MANIFEST_PREFIX, manifest_entry_name, read_manifest_entry
+from shards import parse_run_options, select_shard
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'products_response.json')
+
+def make_event(payload, time=None):
+    encoded = base64.b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+    return SimpleNamespace(data={'message': {'data': encoded}}, get={'time': time}.get)
+
+def test_sharding(scraper_sandbox):
+    """
+    Invoking main() once per shard against a local output directory writes one
+    blob per shard and the last shard compacts them into a single CSV
+    """
+    with open(FIXTURE_PATH, 'r', encoding='utf-8') as f:
+        response = json.load(f)
+
+    routes = [(f"Street {i}", f"Street {i + 1}") for i in range(30)]
+    shard_count = 3
+    assert sorted(route for index in range(shard_count) for route in select_shard(routes, index, shard_count)) == sorted(routes)
+    # An option that is not a number is dropped rather than failing the invocation
+    assert parse_run_options(make_event({'shard_count': 'eight', 'run_time': '1748779200', 'deadline_seconds': None})) == {'run_time': 1748779200}
+
+    scraper_sandbox.patch(get_uber_prices=lambda origin, destination, cookies, query_profile=None: response)
+    scraper_sandbox.write_locations(routes)
+
+    # Shards published without run_time would each fall into the run of their own event time
+    assert parse_run_options(make_event({}, time='2025-06-01T12:00:00Z')) == {'run_time': 1748779200}
+    assert parse_run_options(make_event({'shard_count': shard_count}, time='2025-06-01T12:00:00Z')) == {'shard_count': shard_count}
+    scrape.main(make_event({'shard_index': 0, 'shard_count': shard_count}, time='2025-06-01T12:00:00Z'))
+    assert scraper_sandbox.store.list_names() == []
+
+    for shard_index in range(shard_count):
+        scrape.main(make_event({'shard_index': shard_index, 'shard_count': shard_count, 'run_time': 1748779200}))
+
+    store = scraper_sandbox.store
+    names = [name for name in store.list_names() if not name.startswith(MANIFEST_PREFIX)]
+    assert len(names) == 1 and names[0].endswith('.csv')
+
+    # The shards' manifest entries were merged into one for the compacted blob
+    assert store.list_names(MANIFEST_PREFIX) == [manifest_entry_name(names[0])]
+    entry = read_manifest_entry(store, manifest_entry_name(names[0]))
+    assert entry['rows'] == len(routes) * 5 and {tuple(route) for route in entry['routes']} == set(routes)
+
+    with store.open_read(names[0]) as f:
+        rows = list(csv.DictReader(line.decode('utf-8') for line in f))
+    assert len(rows) == len(routes) * 5
+    assert {(row['origin'], row['destination']) for row in rows} == set(routes)
+
+    # A shard cut short by its deadline holds the compaction back until its retry finishes
+    run_time = 1748781000
+    run_name = scrape.build_run_name(*scrape.get_run_timestamp(run_time))
+    for shard_index in (1, 0, 2):
+        if shard_index == 0:
+            scraper_sandbox.stop_after(2)
+        else:
+            scraper_sandbox.run_to_completion()
+        scrape.main(make_event({'shard_index': shard_index, 'shard_count': shard_count, 'run_time': run_time}))
+    scraper_sandbox.run_to_completion()
+    assert len(store.list_names(f"{run_name}/")) == shard_count and not store.exists(f"{run_name}.csv")
+
+    scrape.main(make_event({'shard_index': 0, 'shard_count': shard_count, 'run_time': run_time}))
+    assert store.list_names(f"{run_name}/") == [] and store.list_names('skipped/') == []
+    with store.open_read(f"{run_name}.csv") as f:
+        assert len(list(csv.DictReader(line.decode('utf-8') for line in f))) == len(routes) * 5
+
+    print(f"Sharded run compacted {len(rows)} rows from {shard_count} shards")
+
+if __name__ == "__main__":
+    pytest.main([__file__, '-s'])
@@ -0,0 +1,105 @@
+import os
+import threading
+
+
+DEFAULT_POOL_SIZE = 16
+
+UBER_HEADERS = {
+    'accept': '*/*',
+    'accept-language': 'en-US,en;q=0.9,pl-PL;q=0.8,pl;q=0.7',
+    'content-type': 'application/json',
+    'origin': 'https://m.uber.com',
+    'priority': 'u=1, i',
+    'sec-ch-ua': '"Google Chrome";v="135", "Not-A.Brand";v="8", "Chromium";v="135"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+    'sec-fetch-dest': 'empty',
+    'sec-fetch-mode': 'cors',
+    'sec-fetch-site': 'same-origin',
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36',
+    'x-csrf-token': 'x',
+    'x-uber-rv-initial-load-city-id': '939',
+    'x-uber-rv-session-type': 'desktop_session',
+}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_pool_size():
+
+    default_size = max(DEFAULT_POOL_SIZE, int(os.getenv('FETCH_CONCURRENCY', 0)))
+    return int(os.getenv('HTTP_POOL_SIZE', default_size))
+
+def http2_enabled():
+    return os.getenv('HTTP2_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+def _create_http2_session(headers, cookies, pool_size):
+
+    try:
+        import httpx
+        return httpx.Client(
+            http2=True,
+            headers=headers,
+            cookies=cookies,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+    except ImportError:
+        print("Warning: HTTP/2 requested but httpx[http2] is not installed, falling back to HTTP/1.1")
+        return None
+
+def create_session(headers=None, cookies=None):
+    """
+    Build a keep-alive session with a connection pool sized for the fetch concurrency.
+    Uses httpx with HTTP/2 when HTTP2_ENABLED is set and httpx[http2] is available.
+    """
+    pool_size = get_pool_size()
+
+    if http2_enabled():
+        session = _create_http2_session(headers, cookies, pool_size)
+        if session is not None:
+            return session
+
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if headers:
+        session.headers.update(headers)
+    if cookies:
+        session.cookies.update(cookies)
+    return session
+
+def _get_session(key, headers=None, cookies=None):
+
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = create_session(headers, cookies)
+            _sessions[key] = session
+        return session
+
+def get_geocode_session():
+    return _get_session('geocode')
+
+def get_uber_session(cookies):
+    """Return the pooled Uber session for this cookie set, creating it on first use"""
+    cookie_key = tuple(sorted((cookies or {}).items()))
+    return _get_session(('uber', cookie_key), UBER_HEADERS, cookies)
+
+def post_body(session, url, body, timeout=None):
+    """POST an already-encoded request body through either session type"""
+    import requests
+
+    if isinstance(session, requests.Session):
+        return session.post(url, data=body, timeout=timeout)
+    return session.post(url, content=body, timeout=timeout)
+
+def close_sessions():
+
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
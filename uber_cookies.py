@@ -4,16 +4,21 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+import argparse
 import pickle
 import json
 import time
 import os
 
-def setup_driver():
+PROFILE_DIR = os.getenv('UBER_COOKIE_DIR', 'cookie_profiles')
+
+def setup_driver(profile=None):
 
     chrome_options = Options()
     
-    profile_dir = os.path.join(os.getcwd(), "uber_chrome_profile")
+    # Each account logs in through a browser profile of its own
+    profile_name = f"uber_chrome_profile_{profile}" if profile else "uber_chrome_profile"
+    profile_dir = os.path.join(os.getcwd(), profile_name)
     if not os.path.exists(profile_dir):
         os.makedirs(profile_dir)
         
@@ -70,12 +75,28 @@ def save_cookies(cookies, filename="uber_cookies.json"):
     
     print(f"Cookies saved to {filename}")
 
+def list_profiles():
+
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted(filename[:-len('.json')] for filename in os.listdir(PROFILE_DIR) if filename.endswith('.json'))
+
 def main():
 
+    parser = argparse.ArgumentParser(description="Collect Uber cookies after a manual login")
+    parser.add_argument('--profile', help=f"save the cookies as an account profile in {PROFILE_DIR}/ for the scraper's cookie pool")
+    parser.add_argument('--list', action='store_true', help="list the collected account profiles")
+    args = parser.parse_args()
+    
+    if args.list:
+        profiles = list_profiles()
+        print(f"{len(profiles)} cookie profiles in {PROFILE_DIR}/: {', '.join(profiles)}")
+        return
+    
     print("Starting Uber cookie collector")
     print("------------------------------")
     
-    driver = setup_driver()
+    driver = setup_driver(args.profile)
     
     try:
         if login_to_uber(driver):
@@ -83,14 +104,20 @@ def main():
             
             cookies = collect_cookies(driver)
             
-            save_cookies(cookies)
-            
-            print(f"Successfully collected {len(cookies)} cookies.")
-            print("You can now use these cookies with the requests library.")
-            
-            with open('uber_cookies.pkl', 'wb') as f:
-                pickle.dump(cookies, f)
-            print("Cookies also saved in pickle format for easier loading in Python.")
+            if args.profile:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                save_cookies(cookies, os.path.join(PROFILE_DIR, f"{args.profile}.json"))
+                print(f"Successfully collected {len(cookies)} cookies for profile '{args.profile}'.")
+                print(f"The scraper now spreads requests over {len(list_profiles())} profiles.")
+            else:
+                save_cookies(cookies)
+                
+                print(f"Successfully collected {len(cookies)} cookies.")
+                print("You can now use these cookies with the requests library.")
+                
+                with open('uber_cookies.pkl', 'wb') as f:
+                    pickle.dump(cookies, f)
+                print("Cookies also saved in pickle format for easier loading in Python.")
     
     except Exception as e:
         print(f"An error occurred: {str(e)}")